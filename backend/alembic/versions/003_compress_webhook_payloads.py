@@ -0,0 +1,38 @@
+"""Compress stored webhook payloads with lz4
+
+Revision ID: 003_compress_webhook_payloads
+Revises: 002_add_payment_entitlements
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '003_compress_webhook_payloads'
+down_revision = '002_add_payment_entitlements'
+branch_labels = None
+depends_on = None
+
+
+def _supports_column_compression() -> bool:
+    """Per-column TOAST compression exists on PostgreSQL 14 and later only."""
+    bind = op.get_bind()
+    return bind.dialect.name == "postgresql" and bind.dialect.server_version_info >= (14,)
+
+
+def upgrade() -> None:
+    """Store raw webhook payloads with lz4 TOAST compression."""
+    if not _supports_column_compression():
+        return
+
+    # Applies to newly written values; existing rows keep their current compression
+    op.execute("ALTER TABLE subscriptions ALTER COLUMN raw_payload_json SET COMPRESSION lz4")
+
+
+def downgrade() -> None:
+    """Restore the server default compression for raw webhook payloads."""
+    if not _supports_column_compression():
+        return
+
+    op.execute("ALTER TABLE subscriptions ALTER COLUMN raw_payload_json SET COMPRESSION DEFAULT")
@@ -0,0 +1,39 @@
+"""Track webhook processing status on subscriptions
+
+Revision ID: 004_add_subscription_processing_status
+Revises: 003_compress_webhook_payloads
+Create Date: 2026-10-17 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '004_add_subscription_processing_status'
+down_revision = '003_compress_webhook_payloads'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Add processing_status so accepted-but-unapplied webhook events can be re-driven."""
+    # Existing rows were applied synchronously, so they start out processed
+    op.add_column(
+        'subscriptions',
+        sa.Column('processing_status', sa.String(), nullable=False, server_default='processed')
+    )
+    
+    # Only pending rows are ever scanned for
+    op.create_index(
+        'ix_subscriptions_pending',
+        'subscriptions',
+        ['created_at'],
+        postgresql_where=sa.text("processing_status = 'pending'")
+    )
+
+
+def downgrade() -> None:
+    """Drop the webhook processing status."""
+    op.drop_index('ix_subscriptions_pending', 'subscriptions')
+    op.drop_column('subscriptions', 'processing_status')
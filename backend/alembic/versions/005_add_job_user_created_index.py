@@ -0,0 +1,30 @@
+"""Index jobs by owner and creation time
+
+Revision ID: 005_add_job_user_created_index
+Revises: 004_add_subscription_processing_status
+Create Date: 2026-10-17 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '005_add_job_user_created_index'
+down_revision = '004_add_subscription_processing_status'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Add a (user_id, created_at DESC) index for paginated job listings."""
+    op.create_index(
+        'ix_jobs_user_created',
+        'jobs',
+        ['user_id', sa.text('created_at DESC')]
+    )
+
+
+def downgrade() -> None:
+    """Drop the job listing index."""
+    op.drop_index('ix_jobs_user_created', 'jobs')
@@ -0,0 +1,44 @@
+"""Index active jobs and current entitlements per user
+
+Revision ID: 006_add_active_job_and_entitlement_indexes
+Revises: 005_add_job_user_created_index
+Create Date: 2026-10-17 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '006_add_active_job_and_entitlement_indexes'
+down_revision = '005_add_job_user_created_index'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Add indexes for the job creation limit checks."""
+    # Built concurrently so job creation is not blocked on large tables
+    with op.get_context().autocommit_block():
+        # Concurrent job count only ever looks at pending/running rows
+        op.create_index(
+            'ix_jobs_user_active',
+            'jobs',
+            ['user_id'],
+            postgresql_where=sa.text("status IN ('pending', 'running')"),
+            postgresql_concurrently=True
+        )
+        # Latest entitlement per user, matching get_user_entitlement's ordering
+        op.create_index(
+            'ix_user_entitlements_user_created',
+            'user_entitlements',
+            ['user_id', sa.text('created_at DESC')],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Drop the limit check indexes."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_user_entitlements_user_created', 'user_entitlements', postgresql_concurrently=True)
+        op.drop_index('ix_jobs_user_active', 'jobs', postgresql_concurrently=True)
@@ -0,0 +1,57 @@
+"""Store receipt purchases on subscriptions
+
+Revision ID: 007_add_subscription_receipt_columns
+Revises: 006_add_active_job_and_entitlement_indexes
+Create Date: 2026-10-17 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '007_add_subscription_receipt_columns'
+down_revision = '006_add_active_job_and_entitlement_indexes'
+branch_labels = None
+depends_on = None
+
+# Columns only webhook events carry; receipt purchases leave them null
+WEBHOOK_ONLY_COLUMNS = (
+    ('event_id', sa.String()),
+    ('raw_payload_json', sa.Text()),
+    ('provider', sa.String()),
+)
+
+
+def upgrade() -> None:
+    """Add the columns record_receipt_purchase writes and relax webhook-only ones."""
+    op.add_column('subscriptions', sa.Column('transaction_id', sa.String(), nullable=True))
+    op.add_column('subscriptions', sa.Column('receipt_data', sa.Text(), nullable=True))
+    op.add_column('subscriptions', sa.Column('credits_included', sa.Integer(), nullable=True))
+    
+    for column, column_type in WEBHOOK_ONLY_COLUMNS:
+        op.alter_column('subscriptions', column, existing_type=column_type, nullable=True)
+    
+    # One row per store transaction; record_receipt_purchase dedupes with ON CONFLICT on it
+    op.create_index(
+        'ix_subscriptions_transaction_id',
+        'subscriptions',
+        ['transaction_id'],
+        unique=True,
+        postgresql_where=sa.text("transaction_id IS NOT NULL")
+    )
+
+
+def downgrade() -> None:
+    """Drop receipt rows and columns and restore the webhook-only constraints."""
+    op.drop_index('ix_subscriptions_transaction_id', 'subscriptions')
+    
+    # Receipt rows have no event id and cannot satisfy NOT NULL again
+    op.execute("DELETE FROM subscriptions WHERE event_id IS NULL")
+    
+    for column, column_type in WEBHOOK_ONLY_COLUMNS:
+        op.alter_column('subscriptions', column, existing_type=column_type, nullable=False)
+    
+    op.drop_column('subscriptions', 'credits_included')
+    op.drop_column('subscriptions', 'receipt_data')
+    op.drop_column('subscriptions', 'transaction_id')
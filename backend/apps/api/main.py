@@ -5,14 +5,16 @@ import structlog
 from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
-from fastapi.responses import JSONResponse
-from slowapi import Limiter, _rate_limit_exceeded_handler
+from fastapi.responses import JSONResponse, ORJSONResponse
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from prometheus_fastapi_instrumentator import Instrumentator
 import time
 
 from apps.core.settings import settings
+from apps.api.routers.webhooks import SuperwallSignatureMiddleware
+from apps.core.rate_limit import limiter, RATE_LIMITING_ENABLED
 from apps.core.exceptions import (
     oneshot_exception_handler,
     validation_exception_handler, 
@@ -42,21 +44,6 @@ structlog.configure(
 
 logger = structlog.get_logger()
 
-# Initialize rate limiter with fallback
-RATE_LIMITING_ENABLED = getattr(settings, 'enable_rate_limiting', True)
-
-if RATE_LIMITING_ENABLED:
-    try:
-        limiter = Limiter(key_func=get_remote_address, storage_uri=settings.redis_url)
-        logger.info("Rate limiting enabled with Redis")
-    except Exception as e:
-        logger.warning("Rate limiting disabled due to Redis connection error", error=str(e))
-        RATE_LIMITING_ENABLED = False
-        limiter = None
-else:
-    logger.info("Rate limiting disabled via configuration")
-    limiter = None
-
 
 def create_application() -> FastAPI:
     """Create and configure advanced FastAPI application."""
@@ -67,10 +54,11 @@ def create_application() -> FastAPI:
         version="2.0.0",
         docs_url="/docs" if settings.is_development else None,
         redoc_url="/redoc" if settings.is_development else None,
+        default_response_class=ORJSONResponse,
     )
     
     # Add rate limiting state only if enabled
-    if RATE_LIMITING_ENABLED and limiter:
+    if RATE_LIMITING_ENABLED:
         app.state.limiter = limiter
         app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
     
@@ -130,6 +118,9 @@ def setup_middleware(app: FastAPI):
         max_age=3600 if settings.is_production else 600,  # Cache preflight longer in prod
     )
     
+    # Hash Superwall webhook bodies as they stream in instead of after buffering
+    app.add_middleware(SuperwallSignatureMiddleware)
+    
     # Trusted host middleware (production only)
     if settings.is_production:
         # Configure trusted hosts for production
@@ -230,6 +221,7 @@ def setup_routers(app: FastAPI):
     app.include_router(jobs.router, prefix="/api")
     app.include_router(uploads.router, prefix="/api")
     app.include_router(credits.router, prefix="/api")
+    ensure_unique_routes(app)
     
     # Enhanced health check endpoints (without rate limiting if Redis unavailable)
     if RATE_LIMITING_ENABLED:
@@ -301,6 +293,17 @@ def setup_routers(app: FastAPI):
             }
 
 
+def ensure_unique_routes(app: FastAPI):
+    """Fail fast if a router was mounted twice or two routers claim the same endpoint."""
+    seen = set()
+    for route in app.routes:
+        for method in getattr(route, "methods", None) or ():
+            key = (method, route.path)
+            if key in seen:
+                raise RuntimeError(f"Duplicate route registered: {method} {route.path}")
+            seen.add(key)
+
+
 def setup_event_handlers(app: FastAPI):
     """Setup application event handlers."""
     
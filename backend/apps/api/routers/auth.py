@@ -8,8 +8,10 @@ from typing import Optional, Dict, Any
 import time
 import structlog
 from apps.api.services import ProfileService, CreditService
+from apps.core.concurrency import run_blocking
 from apps.core.security import get_current_active_user, get_optional_user, SupabaseUser
 from apps.core.exceptions import ValidationError
+from apps.core.supabase_client import supabase_client
 
 # Initialize structured logger
 logger = structlog.get_logger()
@@ -39,8 +41,9 @@ async def bootstrap_profile(
     )
     
     try:
-        # Get or create profile using user JWT token
-        profile = ProfileService.get_or_create_profile(current_user, user_token)
+        # Get or create profile using user JWT token; the Supabase calls block,
+        # so they run on the worker pool instead of stalling the event loop
+        profile = await run_blocking(ProfileService.get_or_create_profile, current_user, user_token)
         
         if not profile:
             raise HTTPException(
@@ -93,11 +96,11 @@ async def get_current_user_profile(
     
     try:
         # Get profile from Supabase using user token
-        profile = ProfileService.get_profile(user_token)
+        profile = await run_blocking(ProfileService.get_profile, user_token)
         
         if not profile:
             # Try to bootstrap profile if it doesn't exist
-            profile = ProfileService.get_or_create_profile(current_user, user_token)
+            profile = await run_blocking(ProfileService.get_or_create_profile, current_user, user_token)
         
         if not profile:
             raise HTTPException(
@@ -106,7 +109,7 @@ async def get_current_user_profile(
             )
         
         # Get recent credit transactions using user token
-        credit_transactions = CreditService.get_credit_transactions(user_token, limit=10)
+        credit_transactions = await run_blocking(CreditService.get_credit_transactions, user_token, limit=10)
         
         duration_ms = int((time.time() - start_time) * 1000)
         
@@ -146,7 +149,6 @@ async def auth_health_check(request: Request) -> Dict[str, Any]:
     
     try:
         # Check Supabase connection
-        from apps.core.supabase_client import supabase_client
         is_healthy = supabase_client.health_check()
         
         health_status = {
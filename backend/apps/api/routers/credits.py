@@ -5,6 +5,7 @@ import structlog
 from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Dict, Any, List
 from apps.api.services import CreditService
+from apps.core.concurrency import run_blocking
 from apps.core.security import get_current_active_user, get_raw_token, SupabaseUser
 
 logger = structlog.get_logger()
@@ -22,8 +23,10 @@ async def get_credit_transactions(
     """Get user's credit transaction history."""
     
     try:
-        transactions = CreditService.get_credit_transactions(user_token, limit)
-        current_credits = CreditService.get_user_credits(user_token)
+        # Balance and ledger come back from one embedded select
+        current_credits, transactions = await run_blocking(
+            CreditService.get_credit_summary, user_token, limit
+        )
         
         return {
             "current_credits": current_credits,
@@ -49,7 +52,7 @@ async def get_credit_balance(
     """Get user's current credit balance."""
     
     try:
-        credits = CreditService.get_user_credits(user_token)
+        credits = await run_blocking(CreditService.get_user_credits, user_token)
         
         return {
             "credits": credits,
@@ -1,73 +1,170 @@
 """
 Jobs router with Supabase authentication and enhanced validation.
 """
+import asyncio
+import hashlib
+import threading
+import time
 import structlog
+from cachetools import TTLCache
 from uuid import UUID
-from typing import List, Dict, Any
+from typing import Annotated, List, Dict, Any, Literal, Optional, Union
 from datetime import datetime, timedelta
-from fastapi import APIRouter, Depends, HTTPException, Request, status
-from slowapi import Limiter
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse
 from slowapi.util import get_remote_address
-from pydantic import BaseModel, validator
+from jwt import InvalidTokenError
+from pydantic import BaseModel, Field, HttpUrl, conint, confloat, model_validator
 from apps.api.services import JobService
-from apps.core.security import get_current_active_user, get_raw_token, SupabaseUser, require_token
+from apps.core.concurrency import run_blocking
+from apps.core.job_guard import job_run_guard
+from apps.core.rate_limit import job_creation_bucket
+from apps.core.supa_request import user_client, service_client
+from apps.core.security import (
+    get_current_active_user, get_raw_token, SupabaseUser, require_token, decode_supabase_jwt
+)
 from apps.core.exceptions import ValidationError, InsufficientCreditsError
 from apps.worker.providers import get_provider
 
 logger = structlog.get_logger()
-limiter = Limiter(key_func=get_remote_address)
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
 
+# How long a /run call waits for a concurrent run of the same job to finish
+RUN_LOCK_WAIT_ATTEMPTS = 10
+RUN_LOCK_WAIT_INTERVAL_SECONDS = 0.2
+
+# Job rows stop changing once they reach one of these states; failed jobs can
+# still be re-run through /run, so they are not among them
+IMMUTABLE_JOB_STATUSES = frozenset({"succeeded"})
+
+
+def _job_etag(job: Dict[str, Any]) -> str:
+    """Strong validator for a job row, derived from the fields that change while it runs."""
+    digest = hashlib.blake2b(
+        f"{job['id']}:{job.get('status')}:{job.get('progress', 0)}:{job.get('updated_at', '')}".encode(),
+        digest_size=12
+    ).hexdigest()
+    return f'"{digest}"'
+
+
+# Decoded user IDs keyed by token digest, so repeat /run calls skip HS256 verification
+JWT_UID_CACHE_TTL_SECONDS = 30
+_jwt_payload_cache: TTLCache = TTLCache(maxsize=10_000, ttl=JWT_UID_CACHE_TTL_SECONDS)
+_jwt_payload_cache_lock = threading.Lock()
+
+
+def _decode_uid(token: str) -> str:
+    """Return the user ID (sub claim) of a Supabase JWT, caching verified results briefly."""
+    key = hashlib.sha256(token.encode()).digest()[:16]
+    with _jwt_payload_cache_lock:
+        uid = _jwt_payload_cache.get(key)
+    if uid is not None:
+        return uid
+    
+    payload = decode_supabase_jwt(token, options={"require": ["exp", "sub"]})
+    uid = payload["sub"]
+    # Only cache tokens that stay valid for the whole cache window
+    if payload["exp"] > time.time() + JWT_UID_CACHE_TTL_SECONDS:
+        with _jwt_payload_cache_lock:
+            _jwt_payload_cache[key] = uid
+    return uid
+
+
+class FaceRestoreParams(BaseModel):
+    """Face restoration parameters."""
+    job_type: Literal["face_restoration", "restore"] = Field(exclude=True)
+    model: Literal["gfpgan", "codeformer"] = "gfpgan"
+    scale_factor: conint(ge=1, le=4) = 2
+    max_side: conint(ge=256, le=2048) = 512
+
+
+class UpscaleParams(BaseModel):
+    """Upscaling parameters."""
+    job_type: Literal["upscale"] = Field(exclude=True)
+    model: Literal["realesrgan_x4plus", "4x_ultrasharp"] = "realesrgan_x4plus"
+    scale: Literal[2, 4] = 4
+    max_side: conint(ge=256, le=2048) = 1024
+
+
+class FaceSwapParams(BaseModel):
+    """Face swap parameters."""
+    job_type: Literal["face_swap"] = Field(exclude=True)
+    blend: confloat(ge=0.0, le=1.0) = 0.8
+    max_side: conint(ge=256, le=2048) = 1024
+
+
+# Tagged on job_type so pydantic dispatches straight to the matching model
+JobParameters = Annotated[
+    Union[FaceRestoreParams, UpscaleParams, FaceSwapParams],
+    Field(discriminator="job_type")
+]
+
 
 class JobCreateRequest(BaseModel):
     """Job creation request schema."""
-    job_type: str
-    input_image_url: str
-    target_image_url: str = None
-    parameters: Dict[str, Any] = {}
+    job_type: Literal["face_restoration", "face_swap", "upscale", "restore"]
+    input_image_url: HttpUrl
+    target_image_url: Optional[HttpUrl] = None
+    parameters: JobParameters
     
-    @validator('job_type')
-    def validate_job_type(cls, v):
-        valid_types = ["face_restoration", "face_swap", "upscale", "restore"]
-        if v not in valid_types:
-            raise ValueError(f"Invalid job type. Must be one of: {valid_types}")
-        return v
+    @model_validator(mode="before")
+    @classmethod
+    def tag_parameters(cls, data: Any) -> Any:
+        """Copy the top-level job_type into parameters as the union tag."""
+        if isinstance(data, dict):
+            parameters = dict(data.get("parameters") or {})
+            # The top-level job_type always decides; a client-supplied tag is overwritten
+            parameters["job_type"] = data.get("job_type")
+            data = {**data, "parameters": parameters}
+        return data
     
-    @validator('input_image_url')
-    def validate_input_url(cls, v):
-        if not v or not v.startswith(('http://', 'https://')):
-            raise ValueError("Invalid input image URL")
-        return v
-    
-    @validator('target_image_url')
-    def validate_target_url(cls, v, values):
-        if values.get('job_type') == "face_swap" and not v:
+    @model_validator(mode="after")
+    def require_face_swap_target(self) -> "JobCreateRequest":
+        """Face swap jobs need a target image to swap onto."""
+        if self.job_type == "face_swap" and self.target_image_url is None:
             raise ValueError("Target image URL is required for face swap jobs")
-        if v and not v.startswith(('http://', 'https://')):
-            raise ValueError("Invalid target image URL")
-        return v
+        return self
+
+
+async def enforce_job_creation_rate(
+    current_user: SupabaseUser = Depends(get_current_active_user)
+) -> None:
+    """Apply the per-user job creation token bucket (30 jobs per minute by default)."""
+    if job_creation_bucket is None:
+        return
+    
+    if not await run_blocking(job_creation_bucket.consume, current_user.id):
+        logger.warning("Job creation rate limited", user_id=current_user.id)
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail={
+                "code": "RATE_LIMITED",
+                "message": "Too many job requests, please slow down"
+            }
+        )
 
 
-@router.post("")
-@limiter.limit("30/minute")  # Rate limit: 30 jobs per minute
+@router.post("", dependencies=[Depends(enforce_job_creation_rate)])
 async def create_job(
     request: Request,
     job_data: JobCreateRequest,
     current_user: SupabaseUser = Depends(get_current_active_user),
     user_token: str = Depends(get_raw_token)
-) -> Dict[str, Any]:
+) -> ORJSONResponse:
     """Create a new AI processing job with Supabase authentication."""
     
-    logger.info("Job creation request", 
-               user_id=current_user.id,
-               job_type=job_data.job_type,
-               parameters=job_data.parameters,
-               remote_addr=get_remote_address(request))
+    log = logger.bind(user_id=current_user.id, job_type=job_data.job_type)
+    # Dumped once and shared by the log line and the service call
+    job_payload = job_data.model_dump(mode="json", exclude_none=True)
+    log.info("Job creation request",
+             parameters=job_payload.get("parameters"),
+             remote_addr=get_remote_address(request))
     
     try:
-        # Create job using Supabase service with user JWT
-        job = JobService.create_job(current_user, job_data.dict(), user_token)
+        # Create job using Supabase service with user JWT; the PostgREST call
+        # is blocking, so keep it off the event loop
+        job = await run_blocking(JobService.create_job, current_user, job_payload, user_token)
         
         if not job:
             raise HTTPException(
@@ -75,23 +172,19 @@ async def create_job(
                 detail="Failed to create job"
             )
         
-        logger.info("Job created successfully", 
-                   user_id=current_user.id,
-                   job_id=job.get("id"),
-                   job_type=job_data.job_type)
+        log.info("Job created successfully", job_id=job.get("id"))
         
         # Here you would typically queue the job for processing
         # process_ai_job.delay(job["id"])
         
-        return {
+        # Rows from PostgREST are already JSON-native, so skip jsonable_encoder
+        return ORJSONResponse(content={
             "job": job,
             "message": "Job created successfully"
-        }
+        })
         
     except InsufficientCreditsError as e:
-        logger.warning("Insufficient credits", 
-                      user_id=current_user.id,
-                      error=str(e))
+        log.warning("Insufficient credits", error=str(e))
         raise HTTPException(
             status_code=status.HTTP_402_PAYMENT_REQUIRED,
             detail={
@@ -101,18 +194,14 @@ async def create_job(
         )
         
     except ValidationError as e:
-        logger.warning("Validation error", 
-                      user_id=current_user.id,
-                      error=str(e))
+        log.warning("Validation error", error=str(e))
         raise HTTPException(
             status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
             detail=str(e)
         )
         
     except Exception as e:
-        logger.error("Job creation failed", 
-                    user_id=current_user.id,
-                    error=str(e))
+        log.error("Job creation failed", error=str(e))
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Failed to create job"
@@ -122,21 +211,20 @@ async def create_job(
 @router.get("/{job_id}")
 async def get_job_status(
     request: Request,
-    job_id: str,
+    job_id: UUID,
     current_user: SupabaseUser = Depends(get_current_active_user),
     user_token: str = Depends(get_raw_token)
-) -> Dict[str, Any]:
+) -> Response:
     """Get job status and progress with detailed information."""
     
-    logger.info("Job status request", 
-               job_id=job_id,
-               user_id=current_user.id)
+    # Malformed IDs are rejected by path validation before any Supabase call
+    job_id = str(job_id)
+    log = logger.bind(user_id=current_user.id, job_id=job_id)
+    log.info("Job status request")
     
-    job = JobService.get_job(job_id, user_token)
+    job = await run_blocking(JobService.get_job, job_id, user_token)
     if not job:
-        logger.warning("Job not found", 
-                      job_id=job_id,
-                      user_id=current_user.id)
+        log.warning("Job not found")
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail={
@@ -145,58 +233,103 @@ async def get_job_status(
             }
         )
     
-    return {
-        "job": job
+    # Succeeded jobs never change, so pollers can keep them; every other state
+    # (including failed, which /run retries) must revalidate
+    etag = _job_etag(job)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": (
+            "private, max-age=31536000, immutable"
+            if job.get("status") in IMMUTABLE_JOB_STATUSES else "no-cache"
+        )
     }
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    return ORJSONResponse(content={
+        "job": job
+    }, headers=headers)
 
 
 @router.get("")
 async def list_jobs(
     request: Request,
-    limit: int = 50,
-    offset: int = 0,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
     current_user: SupabaseUser = Depends(get_current_active_user),
     user_token: str = Depends(get_raw_token)
-) -> Dict[str, Any]:
+) -> ORJSONResponse:
     """List user's jobs with pagination."""
     
-    logger.info("Job list request", 
-               user_id=current_user.id,
-               limit=limit,
-               offset=offset)
+    logger.info("Job list request", user_id=current_user.id, limit=limit, offset=offset)
     
-    jobs = JobService.get_user_jobs(user_token, limit, offset)
+    jobs, total, credits = await run_blocking(JobService.list_user_jobs, user_token, limit, offset)
     
-    return {
+    return ORJSONResponse(content={
         "jobs": jobs,
+        "credits": credits,
         "pagination": {
             "limit": limit,
             "offset": offset,
-            "count": len(jobs)
+            "count": len(jobs),
+            "total": total
         }
-    }
+    })
 
 
 @router.post("/{job_id}/run")
-def run_job(job_id: str, token: str = Depends(require_token)):
+async def run_job(job_id: str, token: str = Depends(require_token)):
     """Run a job with the configured provider (idempotent with credit protection)."""
-    from apps.core.supa_request import user_client, service_client
-    import jwt
-    from apps.core.settings import settings
+    try:
+        # Verification may fetch the JWKS over HTTP on a cold cache
+        uid = await run_blocking(_decode_uid, token)
+    except InvalidTokenError:
+        raise HTTPException(401, "Invalid token")
     
-    # Get job with user authentication (RLS enforced)
-    cli = user_client(token)
-    job = cli.table("jobs").select("*").eq("id", job_id).single().execute().data
-    if not job:
-        raise HTTPException(404, "Job not found")
+    # Finished jobs are answered from Redis without a Supabase round-trip
+    cached = await run_blocking(job_run_guard.get_result, uid, job_id)
+    if cached:
+        return {"status": "succeeded", "job": cached}
     
-    # IDEMPOTENCY CHECK: If job already succeeded with output, return existing result
-    if job.get("status") == "succeeded" and job.get("output_image_url"):
-        logger.info(
-            "Job already completed, returning cached result (idempotent)",
-            job_id=job_id,
-            status=job["status"]
-        )
+    owner = await run_blocking(job_run_guard.acquire, job_id)
+    if owner is None:
+        # Another request is running this job; give it a moment to publish its result
+        for _ in range(RUN_LOCK_WAIT_ATTEMPTS):
+            await asyncio.sleep(RUN_LOCK_WAIT_INTERVAL_SECONDS)
+            cached = await run_blocking(job_run_guard.get_result, uid, job_id)
+            if cached:
+                return {"status": "succeeded", "job": cached}
+        raise HTTPException(409, "Job is already running")
+    
+    try:
+        return await _run_job_locked(job_id, token, uid)
+    finally:
+        await run_blocking(job_run_guard.release, job_id, owner)
+
+
+async def _run_job_locked(job_id: str, token: str, uid: str) -> Dict[str, Any]:
+    """Execute a job while holding its run lock."""
+    log = logger.bind(job_id=job_id, user_id=uid)
+    # Supabase and provider calls are blocking, so each one runs via run_blocking
+    cli = user_client(token)
+    # Move the job to running and fetch it in one RLS-scoped statement; the
+    # status filter makes the idempotency check a database-side condition
+    running = await run_blocking(
+        cli.table("jobs").update({"status": "running"}).eq("id", job_id).neq("status", "succeeded").execute
+    )
+    if running.data:
+        job = running.data[0]
+    else:
+        # No row matched: the job either does not exist or already succeeded
+        existing = (await run_blocking(cli.table("jobs").select("*").eq("id", job_id).limit(1).execute)).data
+        if not existing:
+            raise HTTPException(404, "Job not found")
+        
+        # IDEMPOTENCY CHECK: If job already succeeded, return existing result
+        job = existing[0]
+        log.info("Job already completed, returning cached result (idempotent)", status=job["status"])
+        await run_blocking(job_run_guard.store_result, uid, job_id, job)
         return {"status": "succeeded", "job": job}
     
     # CREDIT PROTECTION: Only charge credits on first execution
@@ -213,122 +346,78 @@ def run_job(job_id: str, token: str = Depends(require_token)):
     credits_required = credit_costs.get(job["job_type"], 1)
     
     # Check if this is the first run (no previous credit transaction for this job)
-    existing_transaction = service_cli.table("credit_transactions").select("id").eq("reference_id", job_id).limit(1).execute()
+    existing_transaction = await run_blocking(
+        service_cli.table("credit_transactions").select("id").eq("reference_id", job_id).limit(1).execute
+    )
     
     if not existing_transaction.data:
         # First run - validate and debit credits
-        uid = jwt.decode(token, settings.supabase_jwt_secret, algorithms=["HS256"])["sub"]
-        
-        logger.info(
-            "First execution, validating and debiting credits",
-            job_id=job_id,
-            user_id=uid,
-            credits_required=credits_required
-        )
+        log.info("First execution, validating and debiting credits", credits_required=credits_required)
         
         # Atomic credit validation and debit
-        has_sufficient_credits = service_cli.rpc("validate_and_debit_credits", {
+        has_sufficient_credits = await run_blocking(service_cli.rpc("validate_and_debit_credits", {
             "target_user_id": uid,
             "credit_amount": credits_required,
             "job_ref_id": job_id
-        }).execute()
+        }).execute)
         
         if not has_sufficient_credits.data:
-            logger.warning(
-                "Insufficient credits for job execution",
-                job_id=job_id,
-                user_id=uid,
-                credits_required=credits_required
-            )
+            log.warning("Insufficient credits for job execution", credits_required=credits_required)
+            # Only a first run can get here, so the job goes back to pending
+            await run_blocking(cli.table("jobs").update({"status": "pending"}).eq("id", job_id).execute)
             raise HTTPException(402, f"Insufficient credits. Required: {credits_required}")
         
         credits_charged = True
-        logger.info(
-            "Credits debited successfully",
-            job_id=job_id,
-            user_id=uid,
-            credits_required=credits_required
-        )
+        # Per-transaction detail stays at debug; the filtering logger drops it for free at INFO
+        log.debug("Credits debited successfully", credits_required=credits_required)
     else:
-        logger.info(
+        log.debug(
             "Subsequent execution, credits already charged",
-            job_id=job_id,
             existing_transaction_id=existing_transaction.data[0]["id"]
         )
-
-    # Update job status to running
-    cli.table("jobs").update({"status": "running"}).eq("id", job_id).execute()
     
     provider = get_provider()
     try:
-        logger.info(
-            "Starting job processing",
-            job_id=job_id,
-            job_type=job["job_type"],
-            provider=provider.__class__.__name__
-        )
+        log.info("Starting job processing", job_type=job["job_type"], provider=type(provider).__name__)
         
         # Execute the job based on type
         if job["job_type"] == "restore":
-            result = provider.restore(token=token, job=job)
+            run_provider = provider.restore
         elif job["job_type"] == "upscale":
-            result = provider.upscale(token=token, job=job)
+            run_provider = provider.upscale
         else:
             raise HTTPException(400, f"Unsupported job_type: {job['job_type']}")
         
+        result = await run_blocking(run_provider, token=token, job=job)
+        
         # Update job with success status and output
-        upd = {
-            "status": "succeeded", 
-            "progress": 1.0, 
-            "output_image_url": result["output_path"]
-        }
-        job2 = cli.table("jobs").update(upd).eq("id", job_id).execute().data[0]
+        job2 = (await run_blocking(service_cli.rpc("run_job_transition", {
+            "target_job_id": job_id,
+            "target_user_id": uid,
+            "new_status": "succeeded",
+            "new_progress": 1.0,
+            "new_output_url": result["output_path"]
+        }).execute)).data[0]
         
-        logger.info(
-            "Job completed successfully",
-            job_id=job_id,
-            output_path=result["output_path"]
-        )
+        log.info("Job completed successfully", output_path=result["output_path"])
         
+        await run_blocking(job_run_guard.store_result, uid, job_id, job2)
         return {"status": "succeeded", "job": job2}
         
     except Exception as e:
-        logger.error(
-            "Job processing failed",
-            job_id=job_id,
-            error=str(e),
-            credits_charged=credits_charged
-        )
-        
-        # Update job with failure status
-        job2 = cli.table("jobs").update({
-            "status": "failed", 
-            "error_message": str(e)
-        }).eq("id", job_id).execute().data[0]
+        log.error("Job processing failed", error=str(e), credits_charged=credits_charged)
         
         # CREDIT REFUND: If credits were charged and job failed, refund them
         if credits_charged:
-            uid = jwt.decode(token, settings.supabase_jwt_secret, algorithms=["HS256"])["sub"]
-            logger.info(
-                "Refunding credits due to job failure",
-                job_id=job_id,
-                user_id=uid,
-                credits_refunded=credits_required
-            )
-            
-            # Refund credits
-            service_cli.rpc("increment_credits", {
-                "target_user_id": uid,
-                "credit_amount": credits_required
-            }).execute()
-            
-            # Create refund transaction record
-            service_cli.table("credit_transactions").insert({
-                "user_id": uid,
-                "amount": credits_required,
-                "transaction_type": "refund",
-                "reference_id": job_id,
-                "metadata": {"reason": "job_failed", "error": str(e)}
-            }).execute()
+            log.info("Refunding credits due to job failure", credits_refunded=credits_required)
+        
+        # Mark the job failed and apply any refund in one RPC
+        await run_blocking(service_cli.rpc("run_job_transition", {
+            "target_job_id": job_id,
+            "target_user_id": uid,
+            "new_status": "failed",
+            "new_error": str(e),
+            "refund_amount": credits_required if credits_charged else 0
+        }).execute)
         
         raise HTTPException(500, f"Processing failed: {e}")
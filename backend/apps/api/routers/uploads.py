@@ -1,31 +1,46 @@
 """
 Supabase Storage upload router with client-direct uploads.
 """
+import re
 import structlog
 from fastapi import APIRouter, Depends, HTTPException, Request
-from slowapi import Limiter
+from fastapi.responses import ORJSONResponse
 from slowapi.util import get_remote_address
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, field_validator
 from typing import Dict, Any
 from apps.api.services import UploadService
+from apps.core.concurrency import run_blocking
+from apps.core.rate_limit import limiter
 from apps.core.security import get_current_active_user, get_raw_token, SupabaseUser
 from apps.core.settings import settings
 
 logger = structlog.get_logger()
-limiter = Limiter(key_func=get_remote_address)
 
 router = APIRouter(prefix="/uploads", tags=["uploads"])
 
 # Allowed MIME types
-ALLOWED_MIME_TYPES = {
+ALLOWED_MIME_TYPES = frozenset({
     "image/jpeg",
     "image/jpg", 
     "image/png",
     "image/webp"
-}
+})
+_ALLOWED_MIME_LIST = sorted(ALLOWED_MIME_TYPES)
+
+# Allowed image extensions, matched case-insensitively at the end of the filename
+ALLOWED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+_EXT_RE = re.compile(r'\.(?:jpe?g|png|webp)\Z', re.IGNORECASE | re.ASCII)
+_TRAVERSAL_RE = re.compile(r'\.\.[/\\]')
 
 # Maximum file size (20MB)
 MAX_FILE_SIZE = 20 * 1024 * 1024
+MAX_FILE_SIZE_MB = MAX_FILE_SIZE >> 20
+
+# Constant part of every upload instructions response
+_STATIC_RESPONSE_TAIL = {
+    "max_file_size": MAX_FILE_SIZE,
+    "allowed_mime_types": _ALLOWED_MIME_LIST
+}
 
 
 class UploadInstructionsRequest(BaseModel):
@@ -34,34 +49,36 @@ class UploadInstructionsRequest(BaseModel):
     content_type: str
     file_size: int
     
-    @validator('filename')
-    def validate_filename(cls, v):
+    @field_validator('filename')
+    @classmethod
+    def validate_filename(cls, v: str) -> str:
         if not v or len(v.strip()) == 0:
             raise ValueError("Filename cannot be empty")
         
         # Check for valid image extensions
-        valid_extensions = ('.jpg', '.jpeg', '.png', '.webp')
-        if not v.lower().endswith(valid_extensions):
-            raise ValueError(f"Invalid file extension. Allowed: {valid_extensions}")
+        if not _EXT_RE.search(v):
+            raise ValueError(f"Invalid file extension. Allowed: {ALLOWED_EXTENSIONS}")
         
         # Prevent path traversal
-        if '../' in v or '..\\' in v:
+        if _TRAVERSAL_RE.search(v):
             raise ValueError("Invalid filename - path traversal detected")
         
         return v.strip()
     
-    @validator('content_type')
-    def validate_content_type(cls, v):
+    @field_validator('content_type')
+    @classmethod
+    def validate_content_type(cls, v: str) -> str:
         if v not in ALLOWED_MIME_TYPES:
             raise ValueError(f"Invalid content type. Allowed: {ALLOWED_MIME_TYPES}")
         return v
     
-    @validator('file_size')
-    def validate_file_size(cls, v):
+    @field_validator('file_size')
+    @classmethod
+    def validate_file_size(cls, v: int) -> int:
         if v <= 0:
             raise ValueError("File size must be greater than 0")
         if v > MAX_FILE_SIZE:
-            raise ValueError(f"File size exceeds maximum allowed size of {MAX_FILE_SIZE // (1024*1024)}MB")
+            raise ValueError(f"File size exceeds maximum allowed size of {MAX_FILE_SIZE_MB}MB")
         return v
 
 
@@ -72,38 +89,33 @@ async def get_upload_instructions(
     upload_request: UploadInstructionsRequest,
     current_user: SupabaseUser = Depends(get_current_active_user),
     user_token: str = Depends(get_raw_token)
-) -> Dict[str, Any]:
+) -> ORJSONResponse:
     """Get upload instructions for Supabase Storage client-direct upload."""
     
-    logger.info("Upload instructions request", 
-               user_id=current_user.id,
-               filename=upload_request.filename,
-               content_type=upload_request.content_type,
-               file_size=upload_request.file_size,
-               remote_addr=get_remote_address(request))
+    log = logger.bind(user_id=current_user.id)
+    log.info("Upload instructions request",
+             filename=upload_request.filename,
+             content_type=upload_request.content_type,
+             file_size=upload_request.file_size,
+             remote_addr=get_remote_address(request))
     
     try:
+        # The user is already verified by the dependency, so pass the ID
+        # through instead of having the service decode the JWT again
         instructions = UploadService.get_upload_instructions(
             user_jwt=user_token,
+            user_id=current_user.id,
             filename=upload_request.filename,
             content_type=upload_request.content_type,
             file_size=upload_request.file_size
         )
         
-        logger.info("Upload instructions generated successfully", 
-                   user_id=current_user.id,
-                   file_path=instructions["file_path"])
+        log.info("Upload instructions generated successfully", file_path=instructions["file_path"])
         
-        return {
-            **instructions,
-            "max_file_size": MAX_FILE_SIZE,
-            "allowed_mime_types": list(ALLOWED_MIME_TYPES)
-        }
+        return ORJSONResponse(content={**instructions, **_STATIC_RESPONSE_TAIL})
         
     except Exception as e:
-        logger.error("Upload instructions generation failed", 
-                    user_id=current_user.id,
-                    error=str(e))
+        log.error("Upload instructions generation failed", error=str(e))
         raise HTTPException(
             status_code=500,
             detail={
@@ -130,7 +142,8 @@ async def get_download_url(
         )
     
     try:
-        download_url = UploadService.get_download_url(user_token, file_path, expires_in)
+        # Signing is a blocking Storage API call, so keep it off the event loop
+        download_url = await run_blocking(UploadService.get_download_url, user_token, file_path, expires_in)
         
         if not download_url:
             raise HTTPException(
@@ -6,22 +6,103 @@ with HMAC signature verification and idempotent event processing.
 Migrated to use Supabase with proper RLS enforcement.
 """
 
-import hashlib
+import functools
 import hmac
-import json
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional
-from fastapi import APIRouter, Request, HTTPException, Depends, Header
+from typing import Dict, Any, Optional, Set, Tuple
+from fastapi import APIRouter, BackgroundTasks, Request, Response, HTTPException, Depends, Header
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import orjson
 import structlog
+from supabase import Client
 
+from apps.core.concurrency import run_blocking
 from apps.core.settings import settings
 from apps.core.exceptions import ValidationError
 from apps.core.supa_request import service_client
-from apps.api.services.entitlements import EntitlementsService
+from apps.api.services.entitlements import EntitlementsService, invalidate_user_limits
 
 router = APIRouter(prefix="/webhooks", tags=["webhooks"])
 logger = structlog.get_logger(__name__)
 
+# Fields every Superwall event must carry
+REQUIRED_EVENT_FIELDS = frozenset(("event", "event_id", "user_id", "product_id"))
+
+# Superwall product IDs mapped to internal plan codes
+PRODUCT_PLAN_MAPPING = {
+    "pro_monthly": "pro",
+    "pro_annual": "pro",
+    "premium_monthly": "premium",
+    "premium_annual": "premium",
+    "pro_weekly": "pro",
+    "premium_weekly": "premium",
+    # Add more mappings as needed
+}
+
+# Entitlement limits granted per plan by webhook events
+PLAN_LIMITS = {
+    "free": {"daily_jobs": 3, "concurrent_jobs": 1, "max_side": 512, "features": ["face_restore"]},
+    "pro": {"daily_jobs": 50, "concurrent_jobs": 3, "max_side": 1024, "features": ["face_restore", "face_swap"]},
+    "premium": {"daily_jobs": 200, "concurrent_jobs": 5, "max_side": 2048, "features": ["face_restore", "face_swap", "upscale"]}
+}
+
+# Serialized once so entitlement inserts do not re-encode constant limits
+PLAN_LIMITS_JSON = {plan: orjson.dumps(limits).decode() for plan, limits in PLAN_LIMITS.items()}
+
+# Route suffix checked by SuperwallSignatureMiddleware, independent of the mount prefix
+SUPERWALL_WEBHOOK_PATH = "/webhooks/superwall"
+
+# Accepted events whose entitlement writes have not finished after this long are re-driven
+PENDING_EVENT_GRACE_SECONDS = 300
+PENDING_EVENT_BATCH_SIZE = 100
+
+
+@functools.lru_cache(maxsize=4)
+def _keyed_hmac(secret: str) -> "hmac.HMAC":
+    """
+    HMAC-SHA256 state with the ipad/opad key blocks already absorbed.
+    
+    The signing secret is fixed for the process, so the key schedule runs once
+    and each request only hashes its payload on a copy of this state.
+    """
+    return hmac.new(secret.encode('utf-8'), digestmod="sha256")
+
+
+def _utc_now_iso() -> str:
+    """Current UTC time as an ISO 8601 string, formatted without building a datetime."""
+    seconds, nanos = divmod(time.time_ns(), 1_000_000_000)
+    return f"{time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(seconds))}.{nanos // 1000:06d}+00:00"
+
+
+def _parse_expires_at(event_data: Dict[str, Any]) -> Optional[datetime]:
+    """Parse the event's expires_at, returning None when it is absent or malformed."""
+    raw_expires_at = event_data.get("expires_at")
+    if not raw_expires_at:
+        return None
+    try:
+        # Python 3.11's C parser accepts the trailing "Z" directly
+        return datetime.fromisoformat(raw_expires_at)
+    except (ValueError, TypeError) as e:
+        logger.warning("Failed to parse expires_at", expires_at=raw_expires_at, error=str(e))
+        return None
+
+
+def _parse_signature(signature: Optional[str]) -> Optional[bytes]:
+    """Decode an X-Superwall-Signature value (optionally "sha256="-prefixed) to raw digest bytes."""
+    if not signature:
+        return None
+    
+    # Remove any prefix from signature (like "sha256=") in a single pass
+    prefix, sep, digest_hex = signature.partition("=")
+    
+    # Compare raw 32-byte digests; malformed hex can never match
+    try:
+        return bytes.fromhex(digest_hex if sep else prefix)
+    except ValueError:
+        return None
+
 
 def verify_superwall_signature(payload: bytes, signature: str, secret: str) -> bool:
     """
@@ -39,28 +120,69 @@ def verify_superwall_signature(payload: bytes, signature: str, secret: str) -> b
         return False
     
     try:
-        # Remove any prefix from signature (like "sha256=")
-        if "=" in signature:
-            signature = signature.split("=", 1)[1]
+        provided_digest = _parse_signature(signature)
+        if provided_digest is None:
+            return False
         
-        # Compute expected signature
-        expected_signature = hmac.new(
-            secret.encode('utf-8'),
-            payload,
-            hashlib.sha256
-        ).hexdigest()
+        # Compute expected signature from a copy of the pre-keyed HMAC state
+        mac = _keyed_hmac(secret).copy()
+        mac.update(payload)
         
         # Use constant-time comparison to prevent timing attacks
-        return hmac.compare_digest(signature, expected_signature)
+        return hmac.compare_digest(provided_digest, mac.digest())
         
     except Exception as e:
         logger.error("Failed to verify signature", error=str(e))
         return False
 
 
+class SuperwallSignatureMiddleware:
+    """
+    Verify Superwall signatures while the webhook route reads its body.
+    
+    Each body chunk is fed to the HMAC as it passes through receive, so the
+    payload is hashed without a second buffered copy. Once the last chunk has
+    been consumed the result is available as request.state.superwall_signature_ok.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or not scope["path"].endswith(SUPERWALL_WEBHOOK_PATH)
+        ):
+            await self.app(scope, receive, send)
+            return
+        
+        state = scope.setdefault("state", {})
+        secret = settings.superwall_signing_secret
+        provided_digest = _parse_signature(Headers(scope=scope).get("x-superwall-signature"))
+        if not secret or provided_digest is None:
+            state["superwall_signature_ok"] = False
+            await self.app(scope, receive, send)
+            return
+        
+        mac = _keyed_hmac(secret).copy()
+        
+        async def hashing_receive() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                mac.update(message.get("body", b""))
+                if not message.get("more_body", False):
+                    state["superwall_signature_ok"] = hmac.compare_digest(provided_digest, mac.digest())
+            return message
+        
+        await self.app(scope, hashing_receive, send)
+
+
 @router.post("/superwall")
 async def superwall_webhook(
     request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     x_superwall_signature: Optional[str] = Header(None)
 ):
     """
@@ -69,6 +191,10 @@ async def superwall_webhook(
     Processes subscription events from Superwall with HMAC signature verification
     and idempotent event handling to prevent duplicate processing.
     
+    subscription_start is applied in one fused RPC and answered with 200. Other
+    events are recorded as pending and answered with 202 Accepted; their
+    entitlement writes run in a background task after the response is sent.
+    
     Expected Superwall event format:
     {
         "event": "subscription_start|subscription_end|subscription_update",
@@ -91,20 +217,24 @@ async def superwall_webhook(
                 logger.warning("Missing Superwall signature header")
                 raise HTTPException(status_code=400, detail="Missing signature header")
             
-            if not verify_superwall_signature(payload, x_superwall_signature, settings.superwall_signing_secret):
+            # Already computed by SuperwallSignatureMiddleware while the body streamed in
+            signature_ok = getattr(request.state, "superwall_signature_ok", None)
+            if signature_ok is None:
+                signature_ok = verify_superwall_signature(payload, x_superwall_signature, settings.superwall_signing_secret)
+            
+            if not signature_ok:
                 logger.warning("Invalid Superwall signature", signature=x_superwall_signature[:20] + "...")
                 raise HTTPException(status_code=401, detail="Invalid signature")
         
-        # Parse JSON payload
+        # Parse JSON payload straight from the raw bytes
         try:
-            event_data = json.loads(payload.decode('utf-8'))
-        except json.JSONDecodeError as e:
+            event_data = orjson.loads(payload)
+        except orjson.JSONDecodeError as e:
             logger.error("Invalid JSON payload", error=str(e))
             raise HTTPException(status_code=400, detail="Invalid JSON payload")
         
         # Validate required fields
-        required_fields = ["event", "event_id", "user_id", "product_id"]
-        missing_fields = [field for field in required_fields if field not in event_data]
+        missing_fields = sorted(REQUIRED_EVENT_FIELDS.difference(event_data))
         if missing_fields:
             logger.error("Missing required fields", missing=missing_fields)
             raise HTTPException(status_code=400, detail=f"Missing required fields: {missing_fields}")
@@ -121,35 +251,55 @@ async def superwall_webhook(
             product_id=event_data.get("product_id")
         )
         
-        # Check for idempotency - has this event been processed already?
+        # The process-wide service client is resolved once and shared by every step;
+        # its calls block, so each one runs via run_blocking
         service_cli = service_client()
-        existing_subscription = service_cli.table("subscriptions").select("id").eq("event_id", event_id).execute()
         
-        if existing_subscription.data:
+        # Most deliveries are new subscriptions; handle them in one fused RPC
+        if event_type == "subscription_start":
+            return await run_blocking(_fast_activate, service_cli, event_data, payload)
+        
+        # Check idempotency and that the user exists in a single RPC
+        preconditions = (await run_blocking(service_cli.rpc("check_webhook_preconditions", {
+            "p_event_id": event_id,
+            "p_user_id": user_id
+        }).execute)).data or {}
+        
+        # Has this event been processed already?
+        existing_subscription_id = preconditions.get("existing_sub_id")
+        if existing_subscription_id:
             logger.info(
                 "Event already processed (idempotent)",
                 event_id=event_id,
-                existing_subscription_id=existing_subscription.data[0]["id"]
+                existing_subscription_id=existing_subscription_id
             )
             return {
                 "status": "success",
                 "message": "Event already processed",
-                "subscription_id": existing_subscription.data[0]["id"]
+                "subscription_id": existing_subscription_id
             }
         
         # Validate that user exists
-        user_check = service_cli.table("profiles").select("id").eq("id", user_id).execute()
-        if not user_check.data:
+        if not preconditions.get("user_exists"):
             logger.error("User not found", user_id=user_id)
             raise HTTPException(status_code=404, detail="User not found")
         
-        # Process the event based on type
-        result = await process_superwall_event(event_data)
+        # Durably record the event, then apply entitlements after responding
+        subscription, created = await run_blocking(record_superwall_event, event_data, payload, service_cli)
         
+        if not created:
+            return {
+                "status": "success",
+                "message": "Event already processed",
+                "subscription_id": subscription["id"]
+            }
+        
+        background_tasks.add_task(process_superwall_event, event_data, subscription, service_cli)
+        response.status_code = 202
         return {
-            "status": "success",
-            "message": "Event processed successfully",
-            **result
+            "status": "accepted",
+            "message": "Event accepted for processing",
+            "subscription_id": subscription["id"]
         }
         
     except HTTPException:
@@ -159,78 +309,292 @@ async def superwall_webhook(
         raise HTTPException(status_code=500, detail="Internal server error")
 
 
-async def process_superwall_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
-    """    
-    Process Superwall event and update subscription/entitlements.
+def _fast_activate(service_cli: Client, event_data: Dict[str, Any], raw_payload: bytes) -> Dict[str, Any]:
+    """
+    Process a subscription_start event with a single RPC.
+    
+    The duplicate check, user check, subscription insert and entitlement swap
+    run inside start_superwall_subscription, so the common case costs one
+    roundtrip instead of three. Other event types use process_superwall_event.
     
     Args:
+        service_cli: Shared service role client for the webhook
         event_data: Parsed webhook event data
+        raw_payload: Webhook body exactly as received (already verified JSON)
         
     Returns:
-        Dictionary with processing results
+        Webhook response body
     """
-    event_type = event_data["event"]
     event_id = event_data["event_id"]
     user_id = event_data["user_id"]
-    product_id = event_data["product_id"]
+    expires_at = _parse_expires_at(event_data)
+    plan_code = map_product_to_plan(event_data["product_id"])
+    limits_plan = plan_code if plan_code in PLAN_LIMITS else "free"
+    
+    outcome = service_cli.rpc("start_superwall_subscription", {
+        "p_event_id": event_id,
+        "p_user_id": user_id,
+        "p_product_id": event_data["product_id"],
+        "p_status": event_data.get("status", "active"),
+        "p_expires_at": expires_at.isoformat() if expires_at else None,
+        "p_raw_payload_json": raw_payload.decode("utf-8"),
+        "p_provider_subscription_id": event_data.get("subscription_id"),
+        "p_plan_code": plan_code,
+        "p_limits_json": PLAN_LIMITS_JSON[limits_plan],
+        "p_effective_from": _utc_now_iso()
+    }).execute().data or {}
+    
+    status = outcome.get("status")
+    if status == "duplicate":
+        logger.info(
+            "Event already processed (idempotent)",
+            event_id=event_id,
+            existing_subscription_id=outcome["subscription_id"]
+        )
+        return {
+            "status": "success",
+            "message": "Event already processed",
+            "subscription_id": outcome["subscription_id"]
+        }
     
-    # Parse dates
-    expires_at = None
-    if "expires_at" in event_data and event_data["expires_at"]:
-        try:
-            expires_at = datetime.fromisoformat(event_data["expires_at"].replace("Z", "+00:00"))
-        except (ValueError, AttributeError) as e:
-            logger.warning("Failed to parse expires_at", expires_at=event_data.get("expires_at"), error=str(e))
+    if status == "user_not_found":
+        logger.error("User not found", user_id=user_id)
+        raise HTTPException(status_code=404, detail="User not found")
     
-    # Map product_id to plan_code
-    plan_code = map_product_to_plan(product_id)
+    if status != "activated" or not outcome.get("entitlement_id"):
+        raise HTTPException(status_code=500, detail="Failed to create entitlement")
+    
+    invalidate_user_limits(user_id)
+    limits = PLAN_LIMITS[limits_plan]
+    logger.info(
+        "Activated subscription",
+        user_id=user_id,
+        plan_code=plan_code,
+        event_id=event_id,
+        subscription_id=outcome["subscription_id"],
+        entitlement_id=outcome["entitlement_id"]
+    )
+    
+    return {
+        "status": "success",
+        "message": "Event processed successfully",
+        "subscription_id": outcome["subscription_id"],
+        "action": "activated",
+        "plan_code": plan_code,
+        "entitlement_id": outcome["entitlement_id"],
+        "limits": limits
+    }
+
+
+def record_superwall_event(
+    event_data: Dict[str, Any],
+    raw_payload: bytes,
+    service_cli: Client
+) -> Tuple[Dict[str, Any], bool]:
+    """
+    Insert the subscription record for an event as pending.
+    
+    Args:
+        event_data: Parsed webhook event data
+        raw_payload: Webhook body exactly as received (already verified JSON)
+        service_cli: Shared service role client for the webhook
+        
+    Returns:
+        The subscription record and whether this call created it
+    """
+    event_id = event_data["event_id"]
+    expires_at = _parse_expires_at(event_data)
     
-    # Create subscription record using service client
-    service_cli = service_client()
     subscription_data = {
-        "user_id": user_id,
-        "product_id": product_id,
+        "user_id": event_data["user_id"],
+        "product_id": event_data["product_id"],
         "status": event_data.get("status", "active"),
         "expires_at": expires_at.isoformat() if expires_at else None,
         "event_id": event_id,
-        "raw_payload_json": json.dumps(event_data),
+        # Store the verified body as received instead of re-serializing the parsed dict
+        "raw_payload_json": raw_payload.decode("utf-8"),
         "provider": "superwall",
-        "provider_subscription_id": event_data.get("subscription_id")
+        "provider_subscription_id": event_data.get("subscription_id"),
+        # Flipped to processed once entitlements are applied; the reaper re-drives leftovers
+        "processing_status": "pending"
     }
     
-    subscription_result = service_cli.table("subscriptions").insert(subscription_data).execute()
+    # The unique event_id makes a concurrent duplicate delivery a no-op instead of a second row
+    subscription_result = service_cli.table("subscriptions").upsert(
+        subscription_data,
+        on_conflict="event_id",
+        ignore_duplicates=True
+    ).execute()
+    
+    if subscription_result.data:
+        return subscription_result.data[0], True
     
-    if not subscription_result.data:
+    # Lost the race to another delivery of the same event
+    existing = service_cli.table("subscriptions").select("id").eq("event_id", event_id).limit(1).execute()
+    if not existing.data:
         raise HTTPException(status_code=500, detail="Failed to create subscription record")
     
-    subscription = subscription_result.data[0]
+    logger.info(
+        "Event already processed (idempotent)",
+        event_id=event_id,
+        existing_subscription_id=existing.data[0]["id"]
+    )
+    return existing.data[0], False
+
+
+async def process_superwall_event(
+    event_data: Dict[str, Any],
+    subscription: Dict[str, Any],
+    service_cli: Client
+) -> Optional[Dict[str, Any]]:
+    """    
+    Apply a recorded Superwall event to the user's entitlements.
     
-    # Process based on event type
-    if event_type in ["subscription_start", "subscription_update"]:
-        result = await handle_subscription_activation(user_id, plan_code, subscription, expires_at)
-    elif event_type == "subscription_end":
-        result = await handle_subscription_deactivation(user_id, subscription)
-    else:
-        logger.warning("Unknown event type", event_type=event_type)
-        result = {"action": "logged", "note": f"Unknown event type: {event_type}"}
+    Runs after the webhook response has been sent, so failures are logged
+    rather than raised; the subscription stays pending and is picked up again
+    by redrive_pending_superwall_events.
+    
+    Args:
+        event_data: Parsed webhook event data
+        subscription: Pending subscription record from record_superwall_event
+        service_cli: Shared service role client for the webhook
+        
+    Returns:
+        Dictionary with processing results, or None if processing failed
+    """
+    event_type = event_data["event"]
+    event_id = event_data["event_id"]
+    user_id = event_data["user_id"]
+    
+    try:
+        expires_at = _parse_expires_at(event_data)
+        plan_code = map_product_to_plan(event_data["product_id"])
+        
+        # Process based on event type
+        handler = EVENT_HANDLERS.get(event_type)
+        if handler is not None:
+            result = await handler(user_id, plan_code, subscription, expires_at, service_cli)
+        else:
+            logger.warning("Unknown event type", event_type=event_type)
+            result = {"action": "logged", "note": f"Unknown event type: {event_type}"}
+        
+        await run_blocking(service_cli.table("subscriptions").update(
+            {"processing_status": "processed"}
+        ).eq("id", subscription["id"]).execute)
+    except Exception as e:
+        logger.error(
+            "Failed to apply Superwall event",
+            event_type=event_type,
+            event_id=event_id,
+            subscription_id=subscription["id"],
+            error=str(e)
+        )
+        return None
     
     logger.info(
         "Processed Superwall event",
         event_type=event_type,
         event_id=event_id,
         user_id=user_id,
-        subscription_id=subscription.id,
+        subscription_id=subscription["id"],
         result=result
     )
     
     return {"subscription_id": subscription["id"], **result}
 
 
+def _latest_processed_at(service_cli: Client, user_ids: Set[str]) -> Dict[str, datetime]:
+    """
+    Creation time of each user's most recently applied Superwall event.
+    
+    Args:
+        service_cli: Service role client
+        user_ids: Users to look up
+        
+    Returns:
+        Mapping of user_id to the created_at of their newest processed event
+    """
+    if not user_ids:
+        return {}
+    
+    result = (service_cli.table("subscriptions")
+              .select("user_id,created_at")
+              .in_("user_id", sorted(user_ids))
+              .eq("provider", "superwall")
+              .eq("processing_status", "processed")
+              .execute())
+    
+    latest: Dict[str, datetime] = {}
+    for row in result.data or []:
+        created_at = datetime.fromisoformat(row["created_at"])
+        if row["user_id"] not in latest or created_at > latest[row["user_id"]]:
+            latest[row["user_id"]] = created_at
+    return latest
+
+
+async def redrive_pending_superwall_events(service_cli: Client) -> int:
+    """
+    Re-apply accepted events whose background processing never finished.
+    
+    Events older than the user's latest applied event are not replayed, so a
+    stale subscription_end cannot undo a later subscription_start; they are
+    marked superseded instead.
+    
+    Args:
+        service_cli: Service role client
+        
+    Returns:
+        Number of events processed successfully
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=PENDING_EVENT_GRACE_SECONDS)
+    pending = await run_blocking(service_cli.table("subscriptions")
+                                 .select("*")
+                                 .eq("processing_status", "pending")
+                                 .lt("created_at", cutoff.isoformat())
+                                 .order("created_at")
+                                 .limit(PENDING_EVENT_BATCH_SIZE)
+                                 .execute)
+    pending_rows = pending.data or []
+    if not pending_rows:
+        return 0
+    
+    latest_processed = await run_blocking(
+        _latest_processed_at, service_cli, {row["user_id"] for row in pending_rows}
+    )
+    
+    # Rows are replayed oldest first, so a newer pending event still wins over an older one
+    processed = 0
+    superseded = []
+    for subscription in pending_rows:
+        newer_applied_at = latest_processed.get(subscription["user_id"])
+        if newer_applied_at is not None and newer_applied_at > datetime.fromisoformat(subscription["created_at"]):
+            superseded.append(subscription["id"])
+            continue
+        
+        event_data = orjson.loads(subscription["raw_payload_json"])
+        if await process_superwall_event(event_data, subscription, service_cli) is not None:
+            processed += 1
+    
+    if superseded:
+        await run_blocking(service_cli.table("subscriptions").update(
+            {"processing_status": "superseded"}
+        ).in_("id", superseded).execute)
+    
+    logger.info(
+        "Re-drove pending Superwall events",
+        pending=len(pending_rows),
+        processed=processed,
+        superseded=len(superseded)
+    )
+    return processed
+
+
 async def handle_subscription_activation(
     user_id: str, 
     plan_code: str, 
     subscription: Dict[str, Any],
-    expires_at: Optional[datetime]
+    expires_at: Optional[datetime],
+    service_cli: Client
 ) -> Dict[str, Any]:
     """    
     Handle subscription activation or update.
@@ -240,44 +604,33 @@ async def handle_subscription_activation(
         plan_code: Plan code (free, pro, premium)
         subscription: Subscription record
         expires_at: When subscription expires
+        service_cli: Shared service role client for the webhook
         
     Returns:
         Dictionary with activation results
     """
     # Create new entitlement using Supabase
-    effective_from = datetime.utcnow()
+    effective_from = _utc_now_iso()
     effective_to = expires_at if expires_at else None
     
-    service_cli = service_client()
+    # Get plan limits; unknown plans fall back to free
+    limits_plan = plan_code if plan_code in PLAN_LIMITS else "free"
+    limits = PLAN_LIMITS[limits_plan]
     
-    # End current entitlements for user
-    if effective_to:
-        service_cli.table("user_entitlements").update({
-            "effective_to": effective_from.isoformat()
-        }).eq("user_id", user_id).is_("effective_to", "null").execute()
-    
-    # Get plan template for limits
-    plan_templates = {
-        "free": {"limits": {"daily_jobs": 3, "concurrent_jobs": 1, "max_side": 512, "features": ["face_restore"]}},
-        "pro": {"limits": {"daily_jobs": 50, "concurrent_jobs": 3, "max_side": 1024, "features": ["face_restore", "face_swap"]}},
-        "premium": {"limits": {"daily_jobs": 200, "concurrent_jobs": 5, "max_side": 2048, "features": ["face_restore", "face_swap", "upscale"]}}
-    }
-    
-    limits = plan_templates.get(plan_code, plan_templates["free"])["limits"]
-    
-    entitlement_data = {
-        "user_id": user_id,
-        "plan_code": plan_code,
-        "limits_json": json.dumps(limits),
-        "effective_from": effective_from.isoformat(),
-        "effective_to": effective_to.isoformat() if effective_to else None
-    }
-    
-    entitlement_result = service_cli.table("user_entitlements").insert(entitlement_data).execute()
+    # End current entitlements (only when the new one expires) and insert the new one in one RPC
+    entitlement_result = await run_blocking(service_cli.rpc("activate_entitlement", {
+        "p_user_id": user_id,
+        "p_plan_code": plan_code,
+        "p_limits_json": PLAN_LIMITS_JSON[limits_plan],
+        "p_effective_from": effective_from,
+        "p_effective_to": effective_to.isoformat() if effective_to else None,
+        "p_end_current": effective_to is not None
+    }).execute)
     
     if not entitlement_result.data:
         raise HTTPException(status_code=500, detail="Failed to create entitlement")
     
+    invalidate_user_limits(user_id)
     entitlement = entitlement_result.data[0]
         
     logger.info(
@@ -299,7 +652,8 @@ async def handle_subscription_activation(
 
 async def handle_subscription_deactivation(
     user_id: str, 
-    subscription: Dict[str, Any]
+    subscription: Dict[str, Any],
+    service_cli: Client
 ) -> Dict[str, Any]:
     """    
     Handle subscription deactivation/cancellation.
@@ -307,34 +661,27 @@ async def handle_subscription_deactivation(
     Args:
         user_id: User identifier
         subscription: Subscription record
+        service_cli: Shared service role client for the webhook
         
     Returns:
         Dictionary with deactivation results
     """
-    service_cli = service_client()
-    
-    # End current entitlements
-    now = datetime.utcnow()
-    service_cli.table("user_entitlements").update({
-        "effective_to": now.isoformat()
-    }).eq("user_id", user_id).is_("effective_to", "null").execute()
-    
-    # Create free plan entitlement
+    # End current entitlements and create the free plan entitlement in one RPC
+    now = _utc_now_iso()
     default_plan = settings.entitlements_default_plan or "free"
-    limits = {"daily_jobs": 3, "concurrent_jobs": 1, "max_side": 512, "features": ["face_restore"]}
     
-    entitlement_data = {
-        "user_id": user_id,
-        "plan_code": default_plan,
-        "limits_json": json.dumps(limits),
-        "effective_from": now.isoformat()
-    }
-    
-    entitlement_result = service_cli.table("user_entitlements").insert(entitlement_data).execute()
+    entitlement_result = await run_blocking(service_cli.rpc("activate_entitlement", {
+        "p_user_id": user_id,
+        "p_plan_code": default_plan,
+        "p_limits_json": PLAN_LIMITS_JSON["free"],
+        "p_effective_from": now,
+        "p_end_current": True
+    }).execute)
     
     if not entitlement_result.data:
         raise HTTPException(status_code=500, detail="Failed to create default entitlement")
     
+    invalidate_user_limits(user_id)
     entitlement = entitlement_result.data[0]
         
     logger.info(
@@ -351,6 +698,25 @@ async def handle_subscription_deactivation(
     }
 
 
+async def _handle_subscription_end(
+    user_id: str,
+    plan_code: str,
+    subscription: Dict[str, Any],
+    expires_at: Optional[datetime],
+    service_cli: Client
+) -> Dict[str, Any]:
+    """Adapt deactivation to the common event handler signature."""
+    return await handle_subscription_deactivation(user_id, subscription, service_cli)
+
+
+# Superwall event type -> handler(user_id, plan_code, subscription, expires_at, service_cli)
+EVENT_HANDLERS = {
+    "subscription_start": handle_subscription_activation,
+    "subscription_update": handle_subscription_activation,
+    "subscription_end": _handle_subscription_end,
+}
+
+
 def map_product_to_plan(product_id: str) -> str:
     """
     Map Superwall product ID to internal plan code.
@@ -361,32 +727,7 @@ def map_product_to_plan(product_id: str) -> str:
     Returns:
         Internal plan code
     """
-    # Define product mapping
-    product_mapping = {
-        # Example Superwall product IDs
-        "pro_monthly": "pro",
-        "pro_annual": "pro", 
-        "premium_monthly": "premium",
-        "premium_annual": "premium",
-        "pro_weekly": "pro",
-        "premium_weekly": "premium",
-        # Add more mappings as needed
-    }
-    
-    plan_code = product_mapping.get(product_id, "free")
-    
-    # Validate plan code exists
-    plan_templates = {
-        "free": True,
-        "pro": True, 
-        "premium": True
-    }
-    
-    if plan_code not in plan_templates:
-        logger.warning("Unknown plan code mapped from product", product_id=product_id, plan_code=plan_code)
-        plan_code = settings.entitlements_default_plan or "free"
-    
-    return plan_code
+    return PRODUCT_PLAN_MAPPING.get(product_id, "free")
 
 
 # Health check endpoint for webhook monitoring
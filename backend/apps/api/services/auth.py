@@ -2,18 +2,48 @@
 Authentication service for user management using Supabase.
 Migrated from SQLModel to use Supabase authentication and RLS enforcement.
 """
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import Future
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from uuid import UUID
 import structlog
+from cachetools import TTLCache
 from apps.core.security import SecurityUtils, SupabaseUser
 from apps.core.exceptions import AuthenticationError, NotFoundError, ValidationError
 from apps.core.settings import settings
-from apps.core.supa_request import user_client, service_client
+from apps.core.supa_request import auth_client, user_client, service_client
 
 
 logger = structlog.get_logger(__name__)
 
+# Profile columns returned to callers; an explicit list keeps columns added to
+# profiles later from widening every auth lookup
+PROFILE_COLUMNS = "id,email,credits,subscription_status,created_at,updated_at"
+
+# Profile rows keyed by token digest and requested id; kept short so credit
+# and subscription changes show up almost immediately
+PROFILE_CACHE_TTL_SECONDS = 10
+_profile_cache: TTLCache = TTLCache(maxsize=10_000, ttl=PROFILE_CACHE_TTL_SECONDS)
+_profile_cache_lock = threading.Lock()
+
+# Sign-ins are never cached: every login gets a fresh session and is checked
+# against the current password and ban state. Sign-ins currently running are
+# keyed by an HMAC of the credentials, so concurrent logins with the same
+# credentials wait on one
+_login_lock = threading.Lock()
+# Per-process key: credentials are never stored or comparable in the clear
+_login_key = os.urandom(32)
+_login_in_flight: Dict[bytes, Future] = {}
+
+
+def _login_digest(email: str, password: str) -> bytes:
+    """Keyed digest of a credential pair used to coalesce concurrent logins."""
+    return hmac.new(_login_key, f"{email.lower()}\0{password}".encode(), hashlib.sha256).digest()
+
 
 class AuthService:
     """Authentication service for user management using Supabase."""
@@ -72,12 +102,43 @@ class AuthService:
     
     @staticmethod
     def authenticate_user(email: str, password: str) -> Optional[Dict[str, Any]]:
-        """Authenticate user with email and password using Supabase Auth."""
+        """
+        Authenticate user with email and password using Supabase Auth.
+        
+        Concurrent calls with the same credentials share one sign-in; results
+        are not reused once it finishes.
+        """
+        key = _login_digest(email, password)
+        with _login_lock:
+            in_flight = _login_in_flight.get(key)
+            if in_flight is None:
+                in_flight = _login_in_flight[key] = Future()
+                leader = True
+            else:
+                leader = False
+        
+        if not leader:
+            return in_flight.result()
+        
         try:
-            service_cli = service_client()
-            
-            # Sign in with Supabase Auth
-            auth_response = service_cli.auth.sign_in_with_password({
+            result = AuthService._sign_in(email, password)
+            with _login_lock:
+                del _login_in_flight[key]
+            in_flight.set_result(result)
+            return result
+        except BaseException as e:
+            with _login_lock:
+                _login_in_flight.pop(key, None)
+            in_flight.set_exception(e)
+            raise
+    
+    @staticmethod
+    def _sign_in(email: str, password: str) -> Optional[Dict[str, Any]]:
+        """Sign in with Supabase Auth and load the profile; None on failure."""
+        try:
+            # Sign in on a throwaway anon client: sign-in switches the client's
+            # Authorization header to the user's token
+            auth_response = auth_client().auth.sign_in_with_password({
                 "email": email,
                 "password": password
             })
@@ -86,7 +147,7 @@ class AuthService:
                 return None
             
             # Get user profile
-            profile_response = service_cli.table("profiles").select("*").eq("id", auth_response.user.id).execute()
+            profile_response = service_client().table("profiles").select(PROFILE_COLUMNS).eq("id", auth_response.user.id).execute()
             
             if not profile_response.data:
                 logger.warning(f"User authenticated but no profile found: {auth_response.user.id}")
@@ -127,29 +188,41 @@ class AuthService:
     
     @staticmethod
     def get_user_by_id(user_jwt: str, user_id: str = None) -> Optional[Dict[str, Any]]:
-        """Get user by ID using user-scoped client."""
+        """Get user by ID using user-scoped client, reusing recent lookups for the same token."""
+        key = (hashlib.sha256(user_jwt.encode()).digest()[:16], user_id)
+        with _profile_cache_lock:
+            profile = _profile_cache.get(key)
+        if profile is not None:
+            return profile
+        
         try:
             client = user_client(user_jwt)
             
             if user_id:
                 # Admin operation - ensure current user has permission
-                response = client.table("profiles").select("*").eq("id", user_id).execute()
+                response = client.table("profiles").select(PROFILE_COLUMNS).eq("id", user_id).execute()
             else:
                 # Get current user's profile
-                response = client.table("profiles").select("*").execute()
+                response = client.table("profiles").select(PROFILE_COLUMNS).execute()
             
-            return response.data[0] if response.data else None
+            profile = response.data[0] if response.data else None
             
         except Exception as e:
             logger.error(f"Failed to get user: {e}")
             return None
+        
+        if profile is not None:
+            with _profile_cache_lock:
+                _profile_cache[key] = profile
+        return profile
     
     @staticmethod
     def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
         """Get user by email using service client (admin operation)."""
         try:
             service_cli = service_client()
-            response = service_cli.table("profiles").select("*").eq("email", email).execute()
+            # email is UNIQUE, so the lookup is an index probe; stop at the first row
+            response = service_cli.table("profiles").select(PROFILE_COLUMNS).eq("email", email).limit(1).execute()
             return response.data[0] if response.data else None
         except Exception as e:
             logger.error(f"Failed to get user by email: {e}")
@@ -157,38 +230,34 @@ class AuthService:
     
     @staticmethod
     def update_user_credits(user_id: str, credits_change: int, transaction_type: str, reference_id: Optional[str] = None) -> bool:
-        """Update user credits using service client RPC function."""
+        """
+        Apply a credit change using service client RPC function.
+        
+        The balance update and ledger entry are written in one statement, and a
+        debit only applies if the balance covers it, so concurrent debits
+        cannot overdraw the account. Returns False when nothing was applied.
+        """
         try:
             service_cli = service_client()
             
-            # Use RPC function for atomic credit update
-            if credits_change > 0:
-                response = service_cli.rpc("increment_credits", {
-                    "target_user_id": user_id,
-                    "credit_amount": credits_change
-                }).execute()
-            else:
-                response = service_cli.rpc("decrement_credits", {
-                    "target_user_id": user_id,
-                    "credit_amount": abs(credits_change)
-                }).execute()
-            
-            if response.data:
-                # Create transaction record
-                transaction_data = {
-                    "user_id": user_id,
-                    "amount": credits_change,
-                    "transaction_type": transaction_type,
-                    "reference_id": reference_id,
-                    "metadata": {"reference_id": reference_id} if reference_id else {}
-                }
-                
-                service_cli.table("credit_transactions").insert(transaction_data).execute()
-                logger.info(f"Updated credits for user {user_id}: {credits_change}")
-                return True
+            response = service_cli.rpc("apply_credit_transaction", {
+                "target_user_id": user_id,
+                "credit_amount": credits_change,
+                "new_transaction_type": transaction_type,
+                "new_metadata": {"reference_id": reference_id} if reference_id else {}
+            }).execute()
             
-            return False
+            if response.data is None:
+                logger.warning(
+                    "Credit change not applied",
+                    user_id=user_id,
+                    credits_change=credits_change
+                )
+                return False
+            
+            logger.info(f"Updated credits for user {user_id}: {credits_change}")
+            return True
             
         except Exception as e:
             logger.error(f"Failed to update user credits: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -2,12 +2,13 @@
 Billing service for receipt validation and credit management using Supabase.
 Migrated from SQLModel to use Supabase authentication and RLS enforcement.
 """
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Mapping
 from uuid import UUID
 import structlog
-from apps.core.exceptions import ValidationError
-from apps.core.supa_request import user_client, service_client
+from apps.core.idempotency import receipt_guard
+from apps.core.supa_request import service_client
 from apps.core.settings import settings
 import json
 import requests
@@ -15,6 +16,15 @@ import requests
 
 logger = structlog.get_logger(__name__)
 
+# Credits granted per purchasable product; read-only since routers share it
+PRODUCT_CREDITS: Mapping[str, int] = MappingProxyType({
+    "credits_10": 10,
+    "credits_50": 50,
+    "credits_100": 100,
+    "subscription_monthly": 100,
+    "subscription_yearly": 1200
+})
+
 
 class BillingService:
     """Billing service for receipt validation and credit management using Supabase."""
@@ -23,21 +33,6 @@ class BillingService:
     def validate_receipt(user_jwt: str, user_id: str, receipt_data: Dict[str, Any]) -> Dict[str, Any]:
         """Validate Superwall receipt and add credits using Supabase."""
         try:
-            # Use user client for RLS enforcement
-            client = user_client(user_jwt)
-            
-            # Check if transaction already processed
-            existing_subscription = client.table("subscriptions").select("id").eq(
-                "transaction_id", receipt_data["transaction_id"]
-            ).execute()
-            
-            if existing_subscription.data:
-                return {
-                    "valid": False,
-                    "credits_added": 0,
-                    "error_message": "Transaction already processed"
-                }
-            
             # Validate receipt with provider
             is_valid = BillingService._validate_receipt_with_provider(receipt_data)
             
@@ -50,46 +45,34 @@ class BillingService:
             
             # Determine credits based on product ID
             credits_to_add = BillingService._get_credits_for_product(receipt_data["product_id"])
-            subscription_expires_at = datetime.utcnow() + timedelta(days=30)
-            
-            # Create subscription record
-            subscription_data = {
-                "user_id": user_id,
-                "product_id": receipt_data["product_id"],
-                "transaction_id": receipt_data["transaction_id"],
-                "receipt_data": receipt_data.get("receipt_data", ""),
-                "status": "active",
-                "credits_included": credits_to_add,
-                "expires_at": subscription_expires_at.isoformat()
-            }
-            
-            subscription_result = client.table("subscriptions").insert(subscription_data).execute()
-            
-            if not subscription_result.data:
-                raise ValidationError("Failed to create subscription record")
+            # One aware timestamp feeds both the subscription row and the response
+            subscription_expires_at = datetime.now(timezone.utc) + timedelta(days=30)
             
-            # Add credits using service client RPC
-            service_cli = service_client()
-            credit_result = service_cli.rpc("increment_credits", {
-                "target_user_id": user_id,
-                "credit_amount": credits_to_add
-            }).execute()
-            
-            if not credit_result.data:
-                # Roll back subscription if credit addition failed
-                client.table("subscriptions").delete().eq("id", subscription_result.data[0]["id"]).execute()
-                raise ValidationError("Failed to add credits")
+            # Replayed receipts are answered from Redis before reaching Postgres
+            transaction_id = receipt_data["transaction_id"]
+            if not receipt_guard.claim(transaction_id):
+                return {
+                    "valid": False,
+                    "credits_added": 0,
+                    "error_message": "Transaction already processed"
+                }
             
-            # Create credit transaction record
-            transaction_data = {
-                "user_id": user_id,
-                "amount": credits_to_add,
-                "transaction_type": "purchase",
-                "reference_id": receipt_data["transaction_id"],
-                "metadata": {"product_id": receipt_data["product_id"]}
-            }
+            # Dedupe, record the subscription and credit the purchase in a single transaction
+            try:
+                result = BillingService.record_purchase(
+                    user_id, receipt_data, credits_to_add, subscription_expires_at
+                )
+            except Exception:
+                # Let the client retry a receipt that was not recorded
+                receipt_guard.release(transaction_id)
+                raise
             
-            service_cli.table("credit_transactions").insert(transaction_data).execute()
+            if result.get("status") == "duplicate":
+                return {
+                    "valid": False,
+                    "credits_added": 0,
+                    "error_message": "Transaction already processed"
+                }
             
             logger.info(
                 "Receipt validated and credits added",
@@ -113,6 +96,29 @@ class BillingService:
                 "error_message": f"Validation error: {str(e)}"
             }
     
+    @staticmethod
+    def record_purchase(
+        user_id: str,
+        receipt_data: Dict[str, Any],
+        credits_to_add: int,
+        expires_at: datetime
+    ) -> Dict[str, Any]:
+        """
+        Record a validated receipt and credit it in one round-trip.
+        
+        Returns the RPC status: "duplicate" when the transaction was already
+        recorded, otherwise "recorded" with the new credit balance.
+        """
+        response = service_client().rpc("record_receipt_purchase", {
+            "target_user_id": user_id,
+            "new_product_id": receipt_data["product_id"],
+            "new_transaction_id": receipt_data["transaction_id"],
+            "new_receipt_data": receipt_data.get("receipt_data", ""),
+            "credit_amount": credits_to_add,
+            "new_expires_at": expires_at.isoformat()
+        }).execute()
+        return response.data or {}
+    
     @staticmethod
     def _validate_receipt_with_provider(receipt_data: Dict[str, Any]) -> bool:
         """Validate receipt with payment provider (placeholder implementation)."""
@@ -123,12 +129,4 @@ class BillingService:
     @staticmethod
     def _get_credits_for_product(product_id: str) -> int:
         """Get credit amount based on product ID."""
-        # Define product mappings
-        product_credits = {
-            "credits_10": 10,
-            "credits_50": 50,
-            "credits_100": 100,
-            "subscription_monthly": 100,
-            "subscription_yearly": 1200
-        }
-        return product_credits.get(product_id, 10)  # Default to 10 credits
\ No newline at end of file
+        return PRODUCT_CREDITS.get(product_id, 10)  # Default to 10 credits
\ No newline at end of file
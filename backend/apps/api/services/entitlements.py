@@ -9,8 +9,13 @@ This service handles:
 """
 
 import json
+import threading
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from enum import Enum
+from typing import Dict, List, NamedTuple, Optional, Tuple
+from cachetools import TTLCache
+from sqlalchemy import Row
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import Session, select, func
 import structlog
 
@@ -23,6 +28,46 @@ from apps.db.models.job import Job
 logger = structlog.get_logger(__name__)
 
 
+class LimitErrorCode(str, Enum):
+    """Reasons a job can be rejected by entitlement limits."""
+    DAILY_LIMIT = "daily_limit"
+    CONCURRENT_LIMIT = "concurrent_limit"
+    PARAM_LIMIT = "param_limit"
+    FEATURE_UNAVAILABLE = "feature_unavailable"
+    CHECK_FAILED = "check_failed"
+
+
+# HTTP status to respond with for each limit error code
+LIMIT_ERROR_STATUS = {
+    LimitErrorCode.DAILY_LIMIT: 429,
+    LimitErrorCode.CONCURRENT_LIMIT: 429,
+    LimitErrorCode.PARAM_LIMIT: 422,
+    LimitErrorCode.FEATURE_UNAVAILABLE: 402,
+    LimitErrorCode.CHECK_FAILED: 500,
+}
+
+
+# Resolved limits per user; entitlements change rarely, so job creation can skip
+# the entitlement query. Local plan changes invalidate their user's entry, and
+# changes made elsewhere show up within the TTL.
+LIMITS_CACHE_TTL_SECONDS = 60
+_limits_cache: TTLCache = TTLCache(maxsize=10_000, ttl=LIMITS_CACHE_TTL_SECONDS)
+_limits_cache_lock = threading.Lock()
+
+
+class LimitContext(NamedTuple):
+    """Usage counters needed to evaluate job creation limits."""
+    
+    jobs_today: int
+    concurrent_jobs: int
+
+
+def invalidate_user_limits(user_id: str) -> None:
+    """Drop a user's cached limits after their entitlement changes."""
+    with _limits_cache_lock:
+        _limits_cache.pop(str(user_id), None)
+
+
 class EntitlementsService:
     """
     Service for managing user entitlements and usage limits.
@@ -45,7 +90,7 @@ class EntitlementsService:
         self._should_close_session = session is None
         
         if self.session is None:
-            self.session = Session(engine)
+            self.session = Session(engine, expire_on_commit=False)
     
     def __enter__(self):
         """Context manager entry."""
@@ -102,16 +147,21 @@ class EntitlementsService:
         Returns:
             Dictionary containing user limits
         """
+        with _limits_cache_lock:
+            cached = _limits_cache.get(str(user_id))
+        if cached is not None:
+            return dict(cached)
+        
         entitlement = self.get_user_entitlement(user_id)
         
         if entitlement and entitlement.is_active():
             limits = entitlement.get_limits()
             plan_code = entitlement.plan_code
         else:
-            # Fallback to default plan or settings
+            # Fallback to default plan or settings (template is only read, not mutated)
             default_plan = settings.entitlements_default_plan
             if default_plan in PLAN_TEMPLATES:
-                limits = PLAN_TEMPLATES[default_plan]["limits"].copy()
+                limits = PLAN_TEMPLATES[default_plan]["limits"]
                 plan_code = default_plan
             else:
                 limits = {
@@ -131,13 +181,16 @@ class EntitlementsService:
             max_side=limits.get("max_side")
         )
         
-        return {
+        resolved = {
             "plan_code": plan_code,
             "daily_jobs": limits.get("daily_jobs", 0),
             "concurrent_jobs": limits.get("concurrent_jobs", 1),
             "max_side": limits.get("max_side", 512),
             "features": limits.get("features", [])
         }
+        with _limits_cache_lock:
+            _limits_cache[str(user_id)] = resolved
+        return dict(resolved)
     
     def get_daily_usage(self, user_id: str, date: datetime = None) -> UsageAggregate:
         """
@@ -176,7 +229,6 @@ class EntitlementsService:
             )
             self.session.add(usage)
             self.session.commit()
-            self.session.refresh(usage)
             
             logger.info(
                 "Created new usage aggregate",
@@ -186,7 +238,34 @@ class EntitlementsService:
         
         return usage
     
-    def check_job_creation_limits(self, user_id: str, job_params: Dict[str, any]) -> Tuple[bool, str]:
+    def _fetch_limit_context(self, user_id: str) -> LimitContext:
+        """
+        Fetch today's job count and running job count in a single query.
+        
+        A missing usage aggregate counts as zero jobs; it is created on the
+        write path, not here.
+        """
+        date_key = UsageAggregate.get_date_key(datetime.utcnow())
+        
+        jobs_today = select(UsageAggregate.jobs_created).where(
+            UsageAggregate.user_id == user_id,
+            UsageAggregate.date == date_key
+        ).scalar_subquery()
+        
+        concurrent_jobs = select(func.count(Job.id)).where(
+            Job.user_id == user_id,
+            Job.status.in_(["pending", "running"])
+        ).scalar_subquery()
+        
+        row = self.session.exec(
+            select(func.coalesce(jobs_today, 0), concurrent_jobs)
+        ).one()
+        
+        return LimitContext(jobs_today=row[0], concurrent_jobs=row[1])
+    
+    def check_job_creation_limits(
+        self, user_id: str, job_params: Dict[str, any]
+    ) -> Tuple[bool, Optional[LimitErrorCode], str]:
         """
         Check if user can create a new job based on limits.
         
@@ -195,26 +274,20 @@ class EntitlementsService:
             job_params: Job parameters to validate
             
         Returns:
-            Tuple of (can_create: bool, error_message: str)
+            Tuple of (can_create: bool, error_code: LimitErrorCode or None, error_message: str).
+            Callers map error_code through LIMIT_ERROR_STATUS for the HTTP status.
         """
         try:
             limits = self.get_user_limits(user_id)
+            context = self._fetch_limit_context(user_id)
             
             # Check daily job limit
-            daily_usage = self.get_daily_usage(user_id)
-            if daily_usage.jobs_created >= limits["daily_jobs"]:
-                return False, f"Daily job limit exceeded ({limits['daily_jobs']} jobs per day)"
+            if context.jobs_today >= limits["daily_jobs"]:
+                return False, LimitErrorCode.DAILY_LIMIT, f"Daily job limit exceeded ({limits['daily_jobs']} jobs per day)"
             
             # Check concurrent job limit
-            concurrent_jobs = self.session.exec(
-                select(func.count(Job.id)).where(
-                    Job.user_id == user_id,
-                    Job.status.in_(["pending", "running"])
-                )
-            ).one()
-            
-            if concurrent_jobs >= limits["concurrent_jobs"]:
-                return False, f"Concurrent job limit exceeded ({limits['concurrent_jobs']} concurrent jobs)"
+            if context.concurrent_jobs >= limits["concurrent_jobs"]:
+                return False, LimitErrorCode.CONCURRENT_LIMIT, f"Concurrent job limit exceeded ({limits['concurrent_jobs']} concurrent jobs)"
             
             # Check max_side parameter
             max_side_limit = limits["max_side"]
@@ -222,7 +295,7 @@ class EntitlementsService:
                 if param_name in job_params:
                     param_value = job_params[param_name]
                     if isinstance(param_value, int) and param_value > max_side_limit:
-                        return False, f"Parameter {param_name}={param_value} exceeds limit of {max_side_limit}"
+                        return False, LimitErrorCode.PARAM_LIMIT, f"Parameter {param_name}={param_value} exceeds limit of {max_side_limit}"
             
             # Check feature access
             job_type = job_params.get("job_type", "")
@@ -237,23 +310,53 @@ class EntitlementsService:
             required_features = feature_mapping.get(job_type, [job_type])
             for feature in required_features:
                 if feature not in available_features:
-                    return False, f"Feature '{feature}' not available in {limits['plan_code']} plan"
+                    return False, LimitErrorCode.FEATURE_UNAVAILABLE, f"Feature '{feature}' not available in {limits['plan_code']} plan"
             
             logger.info(
                 "Job creation limits check passed",
                 user_id=user_id,
                 plan_code=limits["plan_code"],
-                daily_usage=daily_usage.jobs_created,
+                daily_usage=context.jobs_today,
                 daily_limit=limits["daily_jobs"],
-                concurrent_jobs=concurrent_jobs,
+                concurrent_jobs=context.concurrent_jobs,
                 concurrent_limit=limits["concurrent_jobs"]
             )
             
-            return True, ""
+            return True, None, ""
             
         except Exception as e:
             logger.error("Failed to check job creation limits", user_id=user_id, error=str(e))
-            return False, f"Failed to validate limits: {str(e)}"
+            return False, LimitErrorCode.CHECK_FAILED, f"Failed to validate limits: {str(e)}"
+    
+    def _increment_usage(self, user_id: str, **increments: int) -> Row:
+        """
+        Add increments to today's usage aggregate in one atomic UPSERT.
+        
+        The row is created on first use; concurrent writers add to the stored
+        counters instead of overwriting each other. Backed by the unique
+        (user_id, date) index. Caller commits.
+        
+        Returns:
+            Row with the updated jobs_created, jobs_completed and jobs_failed
+        """
+        now = datetime.utcnow()
+        statement = insert(UsageAggregate).values(
+            user_id=user_id,
+            date=UsageAggregate.get_date_key(now),
+            updated_at=now,
+            **increments
+        ).on_conflict_do_update(
+            index_elements=["user_id", "date"],
+            set_={
+                **{name: getattr(UsageAggregate, name) + amount for name, amount in increments.items()},
+                "updated_at": now
+            }
+        ).returning(
+            UsageAggregate.jobs_created,
+            UsageAggregate.jobs_completed,
+            UsageAggregate.jobs_failed
+        )
+        return self.session.execute(statement).one()
     
     def increment_job_usage(self, user_id: str, job_type: str = None) -> None:
         """
@@ -264,10 +367,7 @@ class EntitlementsService:
             job_type: Type of job created (for analytics)
         """
         try:
-            usage = self.get_daily_usage(user_id)
-            usage.jobs_created += 1
-            usage.updated_at = datetime.utcnow()
-            
+            usage = self._increment_usage(user_id, jobs_created=1)
             self.session.commit()
             
             logger.info(
@@ -290,16 +390,13 @@ class EntitlementsService:
             processing_time_seconds: Time taken to process job
         """
         try:
-            usage = self.get_daily_usage(user_id)
-            
+            increments = {"total_processing_time_seconds": processing_time_seconds}
             if job_status == "succeeded":
-                usage.jobs_completed += 1
+                increments["jobs_completed"] = 1
             elif job_status == "failed":
-                usage.jobs_failed += 1
-            
-            usage.total_processing_time_seconds += processing_time_seconds
-            usage.updated_at = datetime.utcnow()
+                increments["jobs_failed"] = 1
             
+            usage = self._increment_usage(user_id, **increments)
             self.session.commit()
             
             logger.info(
@@ -352,7 +449,7 @@ class EntitlementsService:
         
         self.session.add(entitlement)
         self.session.commit()
-        self.session.refresh(entitlement)
+        invalidate_user_limits(user_id)
         
         logger.info(
             "Created user entitlement",
@@ -386,6 +483,7 @@ class EntitlementsService:
         
         if active_entitlements:
             self.session.commit()
+            invalidate_user_limits(user_id)
             logger.info(
                 "Ended active entitlements",
                 user_id=user_id,
@@ -462,7 +560,9 @@ def get_user_limits(user_id: str) -> Dict[str, any]:
         return service.get_user_limits(user_id)
 
 
-def check_job_limits(user_id: str, job_params: Dict[str, any]) -> Tuple[bool, str]:
+def check_job_limits(
+    user_id: str, job_params: Dict[str, any]
+) -> Tuple[bool, Optional[LimitErrorCode], str]:
     """Check job creation limits (convenience function)."""
     with EntitlementsService() as service:
         return service.check_job_creation_limits(user_id, job_params)
@@ -4,11 +4,11 @@ Job service for managing AI processing jobs.
 from datetime import datetime
 from typing import Optional
 from uuid import UUID
-from sqlmodel import Session, select
+from sqlmodel import Session, select, update
+from apps.db.models.credit import CreditTransaction
 from apps.db.models.job import Job, JobCreate
 from apps.core.config import CREDIT_COSTS, JobType
 from apps.core.exceptions import InsufficientCreditsError
-from apps.api.services.auth import AuthService
 from apps.db.models.user import User
 
 
@@ -18,12 +18,9 @@ class JobService:
     @staticmethod
     def create_job(session: Session, user: User, job_data: JobCreate) -> Job:
         """Create a new AI processing job."""
-        from apps.core.config import CREDIT_COSTS, JOB_TIMEOUTS, JobType
-        
         # Check if user has enough credits
         credits_required = CREDIT_COSTS.get(JobType(job_data.job_type), 1)
         if user.credits < credits_required:
-            from apps.core.exceptions import InsufficientCreditsError
             raise InsufficientCreditsError(credits_required, user.credits)
         
         # Create job record
@@ -40,18 +37,27 @@ class JobService:
             credits_cost=credits_required
         )
         
+        # Deduct credits in the database rather than from the caller's copy of
+        # the user, so concurrent jobs cannot both spend the same balance
+        new_balance = session.execute(
+            update(User)
+            .where(User.id == user.id, User.credits >= credits_required)
+            .values(credits=User.credits - credits_required, updated_at=datetime.utcnow())
+            .returning(User.credits)
+        ).scalar_one_or_none()
+        if new_balance is None:
+            session.rollback()
+            raise InsufficientCreditsError(credits_required, user.credits)
+        
         session.add(job)
+        session.add(CreditTransaction(
+            user_id=user.id,
+            amount=-credits_required,
+            transaction_type="usage",
+            reference_id=str(job.id)
+        ))
         session.commit()
-        session.refresh(job)
-        
-        # Deduct credits from user
-        AuthService.update_user_credits(
-            session, 
-            user.id,
-            -credits_required, 
-            "usage",
-            str(job.id)
-        )
+        user.credits = new_balance
         
         # Queue background job (placeholder - would integrate with Celery)
         # queue_ai_processing_task.delay(str(job.id))
@@ -83,11 +89,16 @@ class JobService:
         
         session.add(job)
         session.commit()
-        session.refresh(job)
         return job
     
     @staticmethod
     def get_user_jobs(session: Session, user_id: UUID, skip: int = 0, limit: int = 10) -> list:
         """Get user's jobs with pagination."""
-        statement = select(Job).where(Job.user_id == user_id).offset(skip).limit(limit)
+        statement = (
+            select(Job)
+            .where(Job.user_id == user_id)
+            .order_by(Job.created_at.desc())
+            .offset(skip)
+            .limit(limit)
+        )
         return list(session.exec(statement).all())
\ No newline at end of file
@@ -5,14 +5,17 @@ Replaces SQLModel-based services with PostgREST API calls.
 These services now support per-request user JWT authentication for proper RLS enforcement.
 """
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 from uuid import UUID, uuid4
 import structlog
+import hashlib
+import threading
 import time
 import os
 import sys
-from apps.core.security import SupabaseUser
-from apps.core.exceptions import AuthenticationError, NotFoundError, ValidationError
+from cachetools import TTLCache
+from apps.core.security import SupabaseUser, decode_supabase_jwt
+from apps.core.exceptions import AuthenticationError, InsufficientCreditsError, NotFoundError, ValidationError
 from apps.core.settings import settings
 from apps.core.supabase_client import supabase_client
 from apps.core.supa_request import user_client, service_client
@@ -20,6 +23,22 @@ from apps.core.supa_request import user_client, service_client
 # Initialize structured logger
 logger = structlog.get_logger()
 
+# Maximum accepted upload size in bytes, derived once from settings
+MAX_FILE_SIZE_BYTES = settings.max_file_size_mb * 1024 * 1024
+
+# Signed download URLs are reused for this long; URLs requested with a shorter
+# validity than twice this window are always signed fresh
+SIGNED_URL_CACHE_SECONDS = 300
+_SIGNED_URLS: TTLCache = TTLCache(maxsize=10_000, ttl=SIGNED_URL_CACHE_SECONDS)
+_SIGNED_URLS_LOCK = threading.Lock()
+
+# Timestamp columns stamped when a job enters the given status
+_JOB_STATUS_EXTRAS: Dict[str, Tuple[str, ...]] = {
+    "processing": ("started_at",),
+    "completed": ("completed_at",),
+    "failed": ("completed_at",),
+}
+
 
 class ProfileService:
     """Profile service for user management using Supabase."""
@@ -37,7 +56,8 @@ class ProfileService:
             if profile_result.data:
                 return profile_result.data[0]
             
-            # Create new profile using RPC function with user auth
+            # Create the profile using RPC function with user auth; it is
+            # idempotent and returns the row, so no follow-up read is needed
             response = client.rpc(
                 "bootstrap_user_profile",
                 {
@@ -47,12 +67,7 @@ class ProfileService:
                 }
             ).execute()
             
-            if response.data:
-                # Get the created profile
-                profile_result = client.table("profiles").select("*").eq("id", user.id).execute()
-                return profile_result.data[0] if profile_result.data else None
-            
-            return None
+            return response.data[0] if response.data else None
             
         except Exception as e:
             logger.error(f"Failed to get or create profile for user {user.id}: {e}")
@@ -119,8 +134,7 @@ class UploadService:
     ) -> Dict[str, Any]:
         """Get upload instructions for Supabase Storage using user authentication."""
         # Validate file size
-        max_size = settings.max_file_size_mb * 1024 * 1024  # Convert to bytes
-        if file_size > max_size:
+        if file_size > MAX_FILE_SIZE_BYTES:
             raise ValidationError(f"File size exceeds maximum allowed size of {settings.max_file_size_mb}MB")
         
         # Validate content type
@@ -132,8 +146,7 @@ class UploadService:
         
         if not resolved_user_id and user_jwt:
             try:
-                import jwt
-                payload = jwt.decode(user_jwt, settings.supabase_jwt_secret, algorithms=["HS256"])
+                payload = decode_supabase_jwt(user_jwt)
                 resolved_user_id = payload.get("sub")
             except Exception as exc:
                 raise ValidationError("Token validation failed") from exc
@@ -162,14 +175,33 @@ class UploadService:
     
     @staticmethod
     def get_download_url(user_jwt: str, file_path: str, expires_in: int = 3600) -> Optional[str]:
-        """Get signed download URL for uploaded file using user authentication."""
+        """
+        Get signed download URL for uploaded file using user authentication.
+        
+        URLs are cached per token and path for SIGNED_URL_CACHE_SECONDS, so a
+        returned URL stays valid for at least expires_in minus that window.
+        """
+        cacheable = expires_in >= 2 * SIGNED_URL_CACHE_SECONDS
+        if cacheable:
+            # Keyed by token digest so one user's signed URL is never handed to another
+            key = (hashlib.sha256(user_jwt.encode()).digest()[:16], file_path, expires_in)
+            with _SIGNED_URLS_LOCK:
+                cached = _SIGNED_URLS.get(key)
+            if cached is not None:
+                return cached
+        
         try:
             client = user_client(user_jwt)
             response = client.storage.from_("uploads").create_signed_url(file_path, expires_in)
-            return response.get("signedURL")
+            signed_url = response.get("signedURL")
         except Exception as e:
             logger.error(f"Failed to get download URL: {e}")
             return None
+        
+        if cacheable and signed_url:
+            with _SIGNED_URLS_LOCK:
+                _SIGNED_URLS[key] = signed_url
+        return signed_url
     
     @staticmethod
     def get_public_url(bucket: str, file_path: str) -> str:
@@ -191,46 +223,25 @@ class JobService:
     
     @staticmethod
     def create_job(user: SupabaseUser, job_data: Dict[str, Any], user_jwt: str) -> Optional[Dict[str, Any]]:
-        """Create a new AI processing job with user-scoped authentication."""
+        """Create a new AI processing job, debiting credits in the same statement."""
         try:
-            # Get credit cost for job type
+            # Get credit cost for job type (only used for the error; the RPC prices the job itself)
             credits_required = JobService.CREDIT_COSTS.get(job_data.get("job_type"), 1)
             
-            # Validate and debit credits atomically using service client
-            # (RPC functions are SECURITY DEFINER and validate auth.uid() internally)
-            service_cli = service_client()
-            has_sufficient_credits = service_cli.rpc("validate_and_debit_credits", {
+            # Debit credits and insert the job in one roundtrip
+            # (RPC function is SECURITY DEFINER and checks auth.uid() internally)
+            user_cli = user_client(user_jwt)
+            response = user_cli.rpc("create_job_with_debit", {
                 "target_user_id": user.id,
-                "credit_amount": credits_required,
-                "job_ref_id": None  # Will be updated after job creation
+                "new_job_type": job_data.get("job_type"),
+                "new_input_image_url": job_data.get("input_image_url"),
+                "new_target_image_url": job_data.get("target_image_url"),
+                "new_parameters": job_data.get("parameters", {})
             }).execute()
             
-            if not has_sufficient_credits.data:
-                from apps.core.exceptions import InsufficientCreditsError
-                raise InsufficientCreditsError(credits_required, 0)
-            
-            # Prepare job data
-            job_payload = {
-                "user_id": user.id,
-                "job_type": job_data.get("job_type"),
-                "input_image_url": job_data.get("input_image_url"),
-                "target_image_url": job_data.get("target_image_url"),
-                "parameters": job_data.get("parameters", {}),
-                "status": "pending",
-                "progress": 0.0
-            }
-            
-            # Create job record using user client (RLS enforced)
-            user_cli = user_client(user_jwt)
-            response = user_cli.table("jobs").insert(job_payload).execute()
-            
             if not response.data:
-                # Refund credits if job creation failed
-                service_cli.rpc("increment_credits", {
-                    "target_user_id": user.id,
-                    "credit_amount": credits_required
-                }).execute()
-                raise ValidationError("Failed to create job")
+                # No row means the conditional debit did not match
+                raise InsufficientCreditsError(credits_required, 0)
             
             job = response.data[0]
             logger.info(f"Job created successfully: {job['id']} for user {user.id}")
@@ -266,6 +277,25 @@ class JobService:
             logger.error(f"Failed to get user jobs: {e}")
             return []
     
+    @staticmethod
+    def list_user_jobs(
+        user_jwt: str,
+        limit: int = 50,
+        offset: int = 0
+    ) -> Tuple[List[Dict[str, Any]], int, Optional[int]]:
+        """Get a page of the user's jobs, their total count and the credit balance in one RPC (RLS enforced)."""
+        try:
+            user_cli = user_client(user_jwt)
+            response = user_cli.rpc("list_user_jobs", {
+                "p_limit": limit,
+                "p_offset": offset
+            }).execute()
+            page = response.data or {}
+            return page.get("jobs") or [], page.get("total") or 0, page.get("credits")
+        except Exception as e:
+            logger.error(f"Failed to list user jobs: {e}")
+            return [], 0, None
+    
     @staticmethod
     def update_job_status(
         job_id: str, 
@@ -280,18 +310,19 @@ class JobService:
         If user_jwt is provided, uses user client (for user updates).
         Otherwise uses service client (for system updates).
         """
-        updates = {"status": status}
-        
-        if progress is not None:
-            updates["progress"] = progress
-        if result_url:
-            updates["result_image_url"] = result_url
-        if error_message:
-            updates["error_message"] = error_message
-        if status in ["completed", "failed"]:
-            updates["completed_at"] = datetime.utcnow().isoformat()
-        if status == "processing" and not updates.get("started_at"):
-            updates["started_at"] = datetime.utcnow().isoformat()
+        updates = {
+            field: value
+            for field, value in (
+                ("status", status),
+                ("progress", progress),
+                ("result_image_url", result_url or None),
+                ("error_message", error_message or None),
+            )
+            if value is not None
+        }
+        extras = _JOB_STATUS_EXTRAS.get(status)
+        if extras:
+            updates.update(dict.fromkeys(extras, datetime.utcnow().isoformat()))
         
         try:
             if user_jwt:
@@ -330,25 +361,17 @@ class CreditService:
     def add_credits(user_id: str, amount: int, transaction_type: str = "credit", metadata: Dict[str, Any] = None) -> bool:
         """Add credits to user account using service role (admin operation)."""
         try:
+            # Balance update and ledger entry are written atomically by one RPC
             service_cli = service_client()
-            response = service_cli.rpc("increment_credits", {
+            response = service_cli.rpc("apply_credit_transaction", {
                 "target_user_id": user_id,
-                "credit_amount": amount
+                "credit_amount": amount,
+                "new_transaction_type": transaction_type,
+                "new_metadata": metadata or {}
             }).execute()
             
-            success = response.data if response.data is not None else False
-            
-            if success and metadata:
-                # Create additional transaction record with metadata
-                transaction_data = {
-                    "user_id": user_id,
-                    "amount": amount,
-                    "transaction_type": transaction_type,
-                    "metadata": metadata or {}
-                }
-                service_cli.table("credit_transactions").insert(transaction_data).execute()
-            
-            return success
+            # The function returns the new balance, or null for an unknown user
+            return response.data is not None
         except Exception as e:
             logger.error(f"Failed to add credits for user {user_id}: {e}")
             return False
@@ -363,3 +386,26 @@ class CreditService:
         except Exception as e:
             logger.error(f"Failed to get user credits: {e}")
             return 0
+
+    @staticmethod
+    def get_credit_summary(user_jwt: str, limit: int = 50) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Get the credit balance and recent transactions in a single request.
+
+        The ledger is embedded into the profile row through the user_id foreign
+        key, so dashboards need one round-trip instead of two (RLS enforced).
+        """
+        try:
+            user_cli = user_client(user_jwt)
+            response = (user_cli.table("profiles")
+                       .select("credits,credit_transactions(*)")
+                       .order("created_at", desc=True, foreign_table="credit_transactions")
+                       .limit(limit, foreign_table="credit_transactions")
+                       .execute())
+            if not response.data:
+                return 0, []
+            profile = response.data[0]
+            return profile.get("credits", 0), profile.get("credit_transactions") or []
+        except Exception as e:
+            logger.error(f"Failed to get credit summary: {e}")
+            return 0, []
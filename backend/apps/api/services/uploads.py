@@ -1,7 +1,13 @@
 """
 S3 upload service for handling file uploads.
 """
+import functools
+import hashlib
+import hmac
+import time
+from urllib.parse import quote
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from uuid import uuid4
 import os
@@ -9,16 +15,96 @@ from apps.core.settings import settings
 from apps.core.exceptions import ValidationError
 
 
+# Upload size limit in bytes; settings are fixed for the life of the process
+MAX_FILE_SIZE_BYTES = settings.max_file_size_mb * 1024 * 1024
+
+# Connections kept open by the shared S3 client's pool
+S3_MAX_POOL_CONNECTIONS = 32
+
+
+@functools.lru_cache(maxsize=1)
+def _get_s3_client():
+    """
+    Build the process-wide S3 client once.
+    
+    boto3 clients are thread-safe, so every UploadService shares one client and
+    its connection pool instead of resolving credentials and opening new TLS
+    sessions per instance.
+    """
+    return boto3.client(
+        's3',
+        aws_access_key_id=settings.s3_key,
+        aws_secret_access_key=settings.s3_secret,
+        region_name=settings.s3_region,
+        config=Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            retries={"max_attempts": 3, "mode": "standard"}
+        )
+    )
+
+
+_SIGV4_ALGORITHM = "AWS4-HMAC-SHA256"
+# Presigned query parameters in canonical (sorted) order, minus the signature
+_SIGV4_QUERY_KEYS = ("X-Amz-Algorithm", "X-Amz-Credential", "X-Amz-Date", "X-Amz-Expires", "X-Amz-SignedHeaders")
+
+
+@functools.lru_cache(maxsize=4)
+def _sigv4_signing_key(secret: str, date_stamp: str, region: str) -> bytes:
+    """Derive the SigV4 signing key for S3, which only changes once a day."""
+    key = hmac.digest(f"AWS4{secret}".encode(), date_stamp.encode(), "sha256")
+    for scope_part in (region, "s3", "aws4_request"):
+        key = hmac.digest(key, scope_part.encode(), "sha256")
+    return key
+
+
+def _presign_put_url(file_key: str, content_type: str, expires_in: int) -> str:
+    """
+    Build a SigV4 query-string presigned PUT URL for the configured bucket.
+    
+    Equivalent to boto3's put_object presign with a ContentType, but only the
+    HMAC work is done per call instead of walking botocore's request pipeline.
+    """
+    region = settings.s3_region
+    host = f"{settings.s3_bucket}.s3.{region}.amazonaws.com"
+    amz_date = time.strftime("%Y%m%dT%H%M%SZ", time.gmtime())
+    date_stamp = amz_date[:8]
+    credential_scope = f"{date_stamp}/{region}/s3/aws4_request"
+    
+    canonical_uri = quote(f"/{file_key}", safe="/~")
+    query_values = (
+        _SIGV4_ALGORITHM,
+        f"{settings.s3_key}/{credential_scope}",
+        amz_date,
+        str(expires_in),
+        "content-type;host"
+    )
+    canonical_query = "&".join(
+        f"{key}={quote(value, safe='-_.~')}" for key, value in zip(_SIGV4_QUERY_KEYS, query_values)
+    )
+    canonical_request = "\n".join((
+        "PUT",
+        canonical_uri,
+        canonical_query,
+        f"content-type:{' '.join(content_type.split())}\nhost:{host}\n",
+        "content-type;host",
+        "UNSIGNED-PAYLOAD"
+    ))
+    string_to_sign = "\n".join((
+        _SIGV4_ALGORITHM,
+        amz_date,
+        credential_scope,
+        hashlib.sha256(canonical_request.encode()).hexdigest()
+    ))
+    signing_key = _sigv4_signing_key(settings.s3_secret, date_stamp, region)
+    signature = hmac.new(signing_key, string_to_sign.encode(), "sha256").hexdigest()
+    return f"https://{host}{canonical_uri}?{canonical_query}&X-Amz-Signature={signature}"
+
+
 class UploadService:
     """S3 upload service for handling file uploads."""
     
     def __init__(self):
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=settings.s3_key,
-            aws_secret_access_key=settings.s3_secret,
-            region_name=settings.s3_region
-        )
+        self.s3_client = _get_s3_client()
     
     def generate_presigned_url(
         self, 
@@ -29,34 +115,38 @@ class UploadService:
     ) -> dict:
         """Generate presigned URL for S3 upload."""
         # Validate file size
-        max_size = settings.max_file_size_mb * 1024 * 1024  # Convert to bytes
-        if file_size > max_size:
+        if file_size > MAX_FILE_SIZE_BYTES:
             raise ValidationError(f"File size exceeds maximum allowed size of {settings.max_file_size_mb}MB")
         
         # Validate content type
         if not content_type.startswith('image/'):
             raise ValidationError("Only image files are allowed")
         
-        # Generate unique file key
+        # One id names both the upload and its object key
+        upload_id = str(uuid4())
         file_extension = os.path.splitext(filename)[1]
-        unique_filename = f"{uuid4()}{file_extension}"
+        unique_filename = f"{upload_id}{file_extension}"
         file_key = f"uploads/{unique_filename}"
         
         try:
-            # Generate presigned URL
-            presigned_url = self.s3_client.generate_presigned_url(
-                'put_object',
-                Params={
-                    'Bucket': settings.s3_bucket,
-                    'Key': file_key,
-                    'ContentType': content_type
-                },
-                ExpiresIn=expires_in
-            )
+            if settings.s3_key and settings.s3_secret and "." not in settings.s3_bucket:
+                # Static credentials and a virtual-host-safe bucket: sign locally
+                presigned_url = _presign_put_url(file_key, content_type, expires_in)
+            else:
+                # Credential chains and dotted bucket names need botocore's handling
+                presigned_url = self.s3_client.generate_presigned_url(
+                    'put_object',
+                    Params={
+                        'Bucket': settings.s3_bucket,
+                        'Key': file_key,
+                        'ContentType': content_type
+                    },
+                    ExpiresIn=expires_in
+                )
             
             return {
                 "presigned_url": presigned_url,
-                "upload_id": str(uuid4()),
+                "upload_id": upload_id,
                 "file_key": file_key,
                 "expires_in": expires_in
             }
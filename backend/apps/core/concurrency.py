@@ -0,0 +1,30 @@
+"""
+Helpers for running blocking calls from async request handlers.
+"""
+import functools
+from typing import Any, Callable, Optional, TypeVar
+
+import anyio
+
+T = TypeVar("T")
+
+# Upper bound on worker threads used for blocking I/O from request handlers
+BLOCKING_IO_CONCURRENCY = 32
+
+_blocking_limiter: Optional[anyio.CapacityLimiter] = None
+
+
+def _get_blocking_limiter() -> anyio.CapacityLimiter:
+    """Create the shared limiter lazily; it needs a running event loop."""
+    global _blocking_limiter
+    if _blocking_limiter is None:
+        _blocking_limiter = anyio.CapacityLimiter(BLOCKING_IO_CONCURRENCY)
+    return _blocking_limiter
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking function on a bounded thread pool without stalling the event loop."""
+    return await anyio.to_thread.run_sync(
+        functools.partial(func, *args, **kwargs),
+        limiter=_get_blocking_limiter()
+    )
@@ -0,0 +1,49 @@
+"""
+Redis-backed idempotency keys.
+
+Claiming a key with SET NX answers replayed requests (e.g. mobile clients
+retrying a receipt) from memory before they reach Postgres. The database
+remains the source of truth, so the guard fails open when Redis is down.
+"""
+from typing import Optional
+
+import structlog
+from redis import Redis
+from redis.exceptions import RedisError
+
+from apps.core.settings import settings
+
+logger = structlog.get_logger()
+
+# How long a claimed receipt transaction id short-circuits replays
+RECEIPT_KEY_TTL_SECONDS = 86400
+
+
+class IdempotencyGuard:
+    """Claim-once keys under a namespace; fails open when Redis is unavailable."""
+
+    def __init__(self, namespace: str, ttl_seconds: int, redis_client: Optional[Redis] = None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.redis = redis_client or Redis.from_url(settings.redis_url)
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def claim(self, key: str) -> bool:
+        """Claim key; returns False when it was already claimed."""
+        try:
+            return bool(self.redis.set(self._key(key), "1", nx=True, ex=self.ttl_seconds))
+        except RedisError as e:
+            logger.warning("Idempotency claim failed", namespace=self.namespace, error=str(e))
+            return True
+
+    def release(self, key: str) -> None:
+        """Drop a claim so the request can be retried after a failure."""
+        try:
+            self.redis.delete(self._key(key))
+        except RedisError as e:
+            logger.warning("Idempotency release failed", namespace=self.namespace, error=str(e))
+
+
+receipt_guard = IdempotencyGuard("txn", RECEIPT_KEY_TTL_SECONDS)
@@ -0,0 +1,85 @@
+"""
+Redis-backed guard around job execution.
+
+A per-job mutex keeps concurrent /run calls for the same job from executing
+(and charging for) it twice, and the terminal result is cached so repeat calls
+for a finished job are answered without a Supabase round-trip.
+"""
+import uuid
+from typing import Any, Dict, Optional
+
+import orjson
+import structlog
+from redis import Redis
+from redis.exceptions import RedisError
+
+from apps.core.settings import settings
+
+logger = structlog.get_logger()
+
+# Upper bound on a single provider run; the lock expires on its own after this
+JOB_LOCK_TTL_SECONDS = 600
+# How long finished job payloads are served from Redis
+JOB_RESULT_TTL_SECONDS = 86400
+
+# Delete the lock only if it still belongs to the caller: KEYS[1]=lock, ARGV[1]=owner
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class JobRunGuard:
+    """Per-job run lock plus terminal result cache; fails open when Redis is unavailable."""
+
+    def __init__(self, redis_client: Optional[Redis] = None):
+        self.redis = redis_client or Redis.from_url(settings.redis_url)
+        self._release_script = self.redis.register_script(_RELEASE_LOCK_SCRIPT)
+
+    @staticmethod
+    def _result_key(user_id: str, job_id: str) -> str:
+        # Scoped by owner so a cached row is never served to another user
+        return f"job:{user_id}:{job_id}:terminal"
+
+    @staticmethod
+    def _lock_key(job_id: str) -> str:
+        return f"job:{job_id}:lock"
+
+    def get_result(self, user_id: str, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the cached terminal job row, if any."""
+        try:
+            cached = self.redis.get(self._result_key(user_id, job_id))
+        except RedisError as e:
+            logger.warning("Job result cache read failed", job_id=job_id, error=str(e))
+            return None
+        return orjson.loads(cached) if cached else None
+
+    def store_result(self, user_id: str, job_id: str, job: Dict[str, Any]) -> None:
+        """Cache a terminal job row for repeat /run calls."""
+        try:
+            self.redis.set(self._result_key(user_id, job_id), orjson.dumps(job), ex=JOB_RESULT_TTL_SECONDS)
+        except RedisError as e:
+            logger.warning("Job result cache write failed", job_id=job_id, error=str(e))
+
+    def acquire(self, job_id: str) -> Optional[str]:
+        """Take the run lock; returns an owner token, or None when another run holds it."""
+        owner = uuid.uuid4().hex
+        try:
+            acquired = self.redis.set(self._lock_key(job_id), owner, nx=True, ex=JOB_LOCK_TTL_SECONDS)
+        except RedisError as e:
+            # Fail open: the credit transaction check still prevents double charging
+            logger.warning("Job lock unavailable", job_id=job_id, error=str(e))
+            return owner
+        return owner if acquired else None
+
+    def release(self, job_id: str, owner: str) -> None:
+        """Release the run lock if it is still held by owner."""
+        try:
+            self._release_script(keys=[self._lock_key(job_id)], args=[owner])
+        except RedisError as e:
+            logger.warning("Job lock release failed", job_id=job_id, error=str(e))
+
+
+job_run_guard = JobRunGuard()
@@ -3,6 +3,7 @@ Enhanced health check system with detailed timings and dependency monitoring.
 """
 
 import asyncio
+import functools
 import time
 from typing import Dict, Any, Optional
 import structlog
@@ -21,6 +22,18 @@ logger = structlog.get_logger(__name__)
 settings = settings
 
 
+@functools.lru_cache(maxsize=1)
+def _get_storage_client():
+    """Build the S3 client used by readiness probes once per process."""
+    return boto3.client(
+        's3',
+        aws_access_key_id=settings.s3_key,
+        aws_secret_access_key=settings.s3_secret,
+        region_name=settings.s3_region,
+        endpoint_url=getattr(settings, 's3_endpoint_url', None),
+    )
+
+
 class HealthCheckResult:
     """Result of a health check with timing and status information."""
     
@@ -181,14 +194,7 @@ class HealthChecker:
         start_time = time.time()
         
         try:
-            # Create S3 client
-            s3_client = boto3.client(
-                's3',
-                aws_access_key_id=settings.s3_key,
-                aws_secret_access_key=settings.s3_secret,
-                region_name=settings.s3_region,
-                endpoint_url=getattr(settings, 's3_endpoint_url', None),
-            )
+            s3_client = _get_storage_client()
             
             # Test bucket access
             response = s3_client.head_bucket(Bucket=settings.s3_bucket_name)
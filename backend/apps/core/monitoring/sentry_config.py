@@ -4,6 +4,7 @@ Provides exception tracking and performance monitoring.
 """
 
 import os
+import random
 import sentry_sdk
 from sentry_sdk.integrations.fastapi import FastApiIntegration
 from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
@@ -141,7 +142,6 @@ def _before_send_transaction_filter(event, hint):
     # Sample high-frequency transactions
     if transaction_name and transaction_name.startswith("/api/v1/jobs/"):
         # Reduce sampling for frequent job status checks
-        import random
         if random.random() > 0.1:  # 10% sampling
             return None
     
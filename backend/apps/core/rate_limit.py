@@ -0,0 +1,96 @@
+"""
+Shared rate limiter for the API application and its routers.
+
+A single Limiter instance is created here so the app state and every router
+decorate routes against the same storage backend instead of each module
+building its own in-memory limiter.
+"""
+import time
+from typing import Optional
+
+import structlog
+from redis import Redis
+from redis.exceptions import RedisError
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+
+from apps.core.settings import settings
+
+logger = structlog.get_logger()
+
+# Initialize rate limiter with fallback
+RATE_LIMITING_ENABLED = getattr(settings, 'enable_rate_limiting', True)
+
+if RATE_LIMITING_ENABLED:
+    try:
+        limiter = Limiter(
+            key_func=get_remote_address,
+            storage_uri=settings.redis_url,
+            strategy="moving-window"
+        )
+        logger.info("Rate limiting enabled with Redis")
+    except Exception as e:
+        logger.warning("Rate limiting disabled due to Redis connection error", error=str(e))
+        RATE_LIMITING_ENABLED = False
+        limiter = Limiter(key_func=get_remote_address, enabled=False)
+else:
+    logger.info("Rate limiting disabled via configuration")
+    # Disabled limiter keeps router decorators valid as no-ops
+    limiter = Limiter(key_func=get_remote_address, enabled=False)
+
+
+# Refill and take one token atomically: KEYS[1]=bucket, ARGV=capacity, rate, now, ttl
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[4]))
+return allowed
+"""
+
+
+class TokenBucket:
+    """Redis-backed token bucket shared by all workers; one round-trip per check."""
+    
+    def __init__(self, name: str, capacity: int, refill_per_second: float, redis_client: Optional[Redis] = None):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        # Keep idle buckets around just long enough to refill completely
+        self.ttl = max(1, int(capacity / refill_per_second) + 1)
+        self.redis = redis_client or Redis.from_url(settings.redis_url)
+        self._script = self.redis.register_script(_TOKEN_BUCKET_SCRIPT)
+    
+    def consume(self, key: str) -> bool:
+        """Take one token for key; returns False when the bucket is empty."""
+        try:
+            allowed = self._script(
+                keys=[f"ratelimit:{self.name}:{key}"],
+                args=[self.capacity, self.refill_per_second, time.time(), self.ttl]
+            )
+            return bool(allowed)
+        except RedisError as e:
+            # Fail open so a Redis outage does not take job creation down with it
+            logger.warning("Token bucket check failed", bucket=self.name, error=str(e))
+            return True
+
+
+# Per-user bucket for job creation; None when rate limiting is disabled
+job_creation_bucket: Optional[TokenBucket] = (
+    TokenBucket(
+        "jobs:create",
+        capacity=settings.job_create_burst,
+        refill_per_second=settings.job_create_refill_per_second
+    )
+    if RATE_LIMITING_ENABLED else None
+)
@@ -1,18 +1,68 @@
 """
 Security utilities for Supabase authentication and authorization.
 """
+import hashlib
+import threading
+import time
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Optional
 import jwt
-from fastapi import Depends, HTTPException, status, Header
+from cachetools import TTLCache
+from fastapi import Depends, HTTPException, Request, status, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jwt import InvalidTokenError
+from jwt import InvalidTokenError, PyJWKClient
+from apps.core.concurrency import run_blocking
 from apps.core.settings import settings
 from apps.core.supabase_client import supabase_client
 
 # JWT token scheme
 bearer_scheme = HTTPBearer()
 
+# Asymmetric algorithms Supabase signs with when JWT signing keys are enabled
+ASYMMETRIC_JWT_ALGORITHMS = ["RS256", "ES256"]
+
+# Created once; PyJWKClient caches the fetched key set between calls
+_jwks_client = PyJWKClient(
+    settings.supabase_jwks_url or f"{settings.supabase_url}/auth/v1/.well-known/jwks.json",
+    cache_keys=True
+)
+
+
+# Verified users keyed by token digest so back-to-back requests skip JWT verification
+USER_CACHE_TTL_SECONDS = 30
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+_user_cache_lock = threading.Lock()
+
+
+def decode_supabase_jwt(token: str, **kwargs: Any) -> Dict[str, Any]:
+    """
+    Verify a Supabase JWT and return its claims.
+    
+    Tokens signed with an asymmetric key are checked against the project's JWKS;
+    anything else falls back to the legacy HS256 shared secret. Raises
+    InvalidTokenError (or a subclass) when the token does not verify. A cold
+    JWKS cache fetches the key set over HTTP, so async callers should run this
+    off the event loop.
+    """
+    try:
+        algorithm = jwt.get_unverified_header(token).get("alg")
+    except InvalidTokenError:
+        algorithm = None
+    
+    if algorithm in ASYMMETRIC_JWT_ALGORITHMS:
+        try:
+            key = _jwks_client.get_signing_key_from_jwt(token).key
+        except jwt.PyJWTError as e:
+            # Unknown kid or a failed JWKS fetch (PyJWKClientError) is not an
+            # InvalidTokenError, but the token still cannot be verified
+            raise InvalidTokenError(str(e)) from e
+        algorithms = ASYMMETRIC_JWT_ALGORITHMS
+    else:
+        key = settings.supabase_jwt_secret
+        algorithms = ["HS256"]
+    
+    return jwt.decode(token, key, algorithms=algorithms, audience="authenticated", **kwargs)
+
 
 class SupabaseUser:
     """User object extracted from Supabase JWT token."""
@@ -40,14 +90,8 @@ class SecurityUtils:
             if not token:
                 return None
             
-            # Decode token using Supabase JWT secret
-            payload = jwt.decode(
-                token,
-                settings.supabase_jwt_secret,
-                algorithms=["HS256"],
-                audience="authenticated"
-            )
-            return payload
+            # Decode token using the Supabase signing keys
+            return decode_supabase_jwt(token)
         except InvalidTokenError as e:
             print(f"JWT validation failed: {e}")  # For debugging
             return None
@@ -69,37 +113,75 @@ class SecurityUtils:
         except Exception as e:
             print(f"Failed to extract user from token: {e}")  # For debugging
             return None
+    
+    @staticmethod
+    def get_cached_user(token: str) -> Optional[SupabaseUser]:
+        """Return the user of a recently verified token, without verifying anything."""
+        if not token:
+            return None
+        
+        key = hashlib.sha256(token.encode()).digest()[:16]
+        with _user_cache_lock:
+            return _user_cache.get(key)
+    
+    @staticmethod
+    def get_user_from_token(token: str) -> Optional[SupabaseUser]:
+        """Verify a token and return its user, reusing recent verifications of the same token."""
+        if not token:
+            return None
+        
+        user = SecurityUtils.get_cached_user(token)
+        if user is not None:
+            return user
+        
+        key = hashlib.sha256(token.encode()).digest()[:16]
+        
+        payload = SecurityUtils.verify_supabase_token(token)
+        if payload is None:
+            return None
+        
+        user = SecurityUtils.extract_user_from_token(payload)
+        # Only cache tokens that stay valid for the whole cache window
+        if user is not None and payload.get("exp", 0) > time.time() + USER_CACHE_TTL_SECONDS:
+            with _user_cache_lock:
+                _user_cache[key] = user
+        return user
 
 
 class AuthenticationDependency:
     """Authentication dependency for FastAPI routes using Supabase."""
     
     @staticmethod
-    def get_current_user(
+    async def get_current_user(
+        request: Request,
         credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)
     ) -> SupabaseUser:
         """Get current authenticated user from Supabase JWT token."""
-        credentials_exception = HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-        
-        # Verify Supabase token
-        payload = SecurityUtils.verify_supabase_token(credentials.credentials)
-        if payload is None:
-            raise credentials_exception
+        # Reuse the user if another dependency already resolved it for this request
+        user = getattr(request.state, "user", None)
+        if user is not None:
+            return user
         
-        # Extract user from token payload
-        user = SecurityUtils.extract_user_from_token(payload)
+        # Verify Supabase token and extract the user from its payload; a cache
+        # miss may fetch the JWKS over HTTP, so it is verified off the event loop
+        token = credentials.credentials
+        user = SecurityUtils.get_cached_user(token)
         if user is None:
-            raise credentials_exception
+            user = await run_blocking(SecurityUtils.get_user_from_token, token)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
         
+        request.state.user = user
         return user
     
     @staticmethod
-    def get_current_active_user(
-        current_user: SupabaseUser = Depends(get_current_user)
+    async def get_current_active_user(
+        # __func__ unwraps the staticmethod so FastAPI sees a coroutine function
+        current_user: SupabaseUser = Depends(get_current_user.__func__)
     ) -> SupabaseUser:
         """Get current active user (additional checks can be added here)."""
         # Add any additional user validation logic here
@@ -107,7 +189,7 @@ class AuthenticationDependency:
         return current_user
     
     @staticmethod
-    def get_optional_user(
+    async def get_optional_user(
         credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False))
     ) -> Optional[SupabaseUser]:
         """Get current user if token is provided, otherwise return None."""
@@ -115,11 +197,7 @@ class AuthenticationDependency:
             return None
         
         try:
-            payload = SecurityUtils.verify_supabase_token(credentials.credentials)
-            if payload is None:
-                return None
-            
-            return SecurityUtils.extract_user_from_token(payload)
+            return await run_blocking(SecurityUtils.get_user_from_token, credentials.credentials)
         except Exception:
             return None
 
@@ -142,7 +220,7 @@ def get_current_user_id(authorization: str = Header(None)) -> str:
     """Extract user ID from Authorization header token."""
     token = require_token(authorization)
     try:
-        payload = jwt_decode(token, settings.supabase_jwt_secret, algorithms=["HS256"])
+        payload = decode_supabase_jwt(token)
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token payload")
@@ -151,6 +229,6 @@ def get_current_user_id(authorization: str = Header(None)) -> str:
         raise HTTPException(status_code=401, detail="Invalid token")
 
 
-def get_raw_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> str:
+async def get_raw_token(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> str:
     """Get raw JWT token for client authentication."""
     return credentials.credentials
@@ -13,10 +13,17 @@ class Settings(BaseSettings):
     supabase_url: str
     supabase_anon_key: str
     supabase_service_role_key: str
-    supabase_jwt_secret: str
+    supabase_jwt_secret: str  # Legacy HS256 signing secret
+    supabase_jwks_url: str = ""  # Defaults to {supabase_url}/auth/v1/.well-known/jwks.json
     
     # Database
     database_url: str
+    db_statement_cache_size: int = 512  # Compiled SQL cache entries per engine
+    db_prepare_threshold: int = 1  # psycopg: prepare server-side after N executions
+    db_pool_size: int = 20  # Persistent connections per process
+    db_max_overflow: int = 10  # Extra connections allowed under burst load
+    db_use_null_pool: bool = False  # Let PgBouncer (transaction mode) own pooling instead
+    db_statement_timeout_ms: int = 5000  # Postgres statement_timeout per connection; 0 disables
     
     # JWT Configuration (Supabase)
     jwt_secret: str  # This will be the Supabase JWT secret
@@ -130,6 +137,8 @@ class Settings(BaseSettings):
     # Rate Limiting
     enable_rate_limiting: bool = True
     global_rate_limit: str = "1000/hour"  # Global API rate limit
+    job_create_burst: int = 30  # Token bucket capacity per user for job creation
+    job_create_refill_per_second: float = 0.5  # Tokens added per second (30/minute)
     
     # Session Security
     secure_cookies: bool = False  # Enable secure cookie flags
@@ -10,8 +10,18 @@ Key principles:
 - Credits RPC uses service role with SECURITY DEFINER functions
 """
 
-from typing import Optional, Tuple
-from supabase import create_client, Client
+import functools
+import hashlib
+import json
+import math
+import threading
+import time
+from typing import Any, Optional, Tuple
+import httpx
+import jwt
+import orjson
+from cachetools import TLRUCache
+from supabase import create_client, Client, ClientOptions
 import logging
 
 from apps.core.settings import settings
@@ -19,6 +29,75 @@ from apps.core.settings import settings
 logger = logging.getLogger(__name__)
 
 
+def _contains_non_finite(obj: Any) -> bool:
+    """True if obj holds a NaN or infinite float, which orjson would silently write as null."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_contains_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_contains_non_finite(item) for item in obj)
+    return False
+
+
+def _orjson_dumps(obj: Any) -> bytes:
+    """Encode a request body with orjson, keeping the stdlib's errors for invalid values."""
+    if _contains_non_finite(obj):
+        raise ValueError("Out of range float values are not JSON compliant")
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # Values orjson rejects (e.g. integers wider than 64 bits) keep stdlib behaviour
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), allow_nan=False).encode()
+
+
+def _use_orjson_bodies(client: Client) -> None:
+    """
+    Encode this client's PostgREST request bodies with orjson.
+    
+    postgrest-py passes payloads through httpx's json= argument, which encodes
+    with the stdlib. Only this client's PostgREST session is wrapped; other
+    httpx users in the process are unaffected.
+    """
+    session = client.postgrest.session
+    build_request = session.build_request
+    
+    def orjson_build_request(method: str, url: Any, *, json: Any = None, headers: Any = None, **kwargs: Any) -> httpx.Request:
+        if json is None:
+            return build_request(method, url, headers=headers, **kwargs)
+        headers = httpx.Headers(headers)
+        headers.setdefault("Content-Type", "application/json")
+        kwargs["content"] = _orjson_dumps(json)
+        return build_request(method, url, headers=headers, **kwargs)
+    
+    session.build_request = orjson_build_request
+
+
+# How long an idle user-scoped client is kept, capped by its token's expiry
+USER_CLIENT_TTL_SECONDS = 300
+TOKEN_EXPIRY_MARGIN_SECONDS = 30
+
+
+def _user_client_ttu(_key: bytes, value: Tuple[Client, float], now: float) -> float:
+    """Expire a cached client after the idle TTL or just before its token does."""
+    return min(now + USER_CLIENT_TTL_SECONDS, value[1])
+
+
+# User-scoped clients keyed by token digest so their HTTP connection pools
+# survive across requests from the same session; values are (client, token expiry)
+_USER_CLIENTS: TLRUCache = TLRUCache(maxsize=2048, ttu=_user_client_ttu, timer=time.time)
+_USER_CLIENTS_LOCK = threading.Lock()
+
+
+def _token_expiry(user_jwt: str) -> float:
+    """Wall-clock time shortly before the token expires; signatures are checked by PostgREST."""
+    try:
+        exp = jwt.decode(user_jwt, options={"verify_signature": False}).get("exp")
+    except jwt.PyJWTError:
+        exp = None
+    return exp - TOKEN_EXPIRY_MARGIN_SECONDS if isinstance(exp, (int, float)) else float("inf")
+
+
 def _get_supabase_config() -> Tuple[str, str, str]:
     """
     Retrieve Supabase connection details from settings and ensure they exist.
@@ -49,7 +128,7 @@ def _get_supabase_config() -> Tuple[str, str, str]:
 
 def user_client(user_jwt: str) -> Client:
     """
-    Create a request-scoped Supabase client using user JWT token.
+    Get a Supabase client authenticated with the user JWT token.
     
     This client will enforce Row Level Security (RLS) policies based on the
     authenticated user. Use this for all user-scoped operations like:
@@ -61,13 +140,21 @@ def user_client(user_jwt: str) -> Client:
         user_jwt: The Supabase JWT token from the Authorization header
         
     Returns:
-        Supabase client configured with user authentication
+        Supabase client configured with user authentication. Clients are
+        cached per token for a few minutes, never past the token's expiry,
+        to reuse pooled connections.
         
     Example:
         token = require_token()  # From FastAPI dependency
         client = user_client(token)
         jobs = client.table("jobs").select("*").execute()  # RLS enforced
     """
+    key = hashlib.sha256(user_jwt.encode()).digest()[:16]
+    with _USER_CLIENTS_LOCK:
+        cached = _USER_CLIENTS.get(key)
+    if cached is not None:
+        return cached[0]
+    
     url, anon_key, _ = _get_supabase_config()
     
     # Create client with anon key
@@ -75,17 +162,22 @@ def user_client(user_jwt: str) -> Client:
     
     # Set the user JWT token for PostgREST authentication
     client.postgrest.auth(user_jwt)
+    _use_orjson_bodies(client)
     
     # Set auth token for storage and other Supabase services
     client.auth.set_auth(user_jwt)
     
+    with _USER_CLIENTS_LOCK:
+        _USER_CLIENTS[key] = (client, _token_expiry(user_jwt))
+    
     logger.debug("Created user-scoped Supabase client")
     return client
 
 
+@functools.lru_cache(maxsize=1)
 def service_client() -> Client:
     """
-    Create a service role Supabase client for admin operations.
+    Get the shared service role Supabase client for admin operations.
     
     This client bypasses RLS and has full access to all data. Use sparingly
     and only for controlled operations like:
@@ -97,7 +189,7 @@ def service_client() -> Client:
     operations that require system-level access and ensure proper validation.
     
     Returns:
-        Supabase client with service role permissions
+        Supabase client with service role permissions, created once per process
         
     Example:
         client = service_client()
@@ -107,11 +199,33 @@ def service_client() -> Client:
     url, _, service_key = _get_supabase_config()
 
     client = create_client(url, service_key)
+    _use_orjson_bodies(client)
     
     logger.debug("Created service role Supabase client")
     return client
 
 
+def auth_client() -> Client:
+    """
+    Get a fresh anon-key client for password sign-ins.
+    
+    A successful sign-in rewrites the client's Authorization header to the
+    user's access token, so sign-ins must never go through the shared
+    service_client(). The client is not cached, and its session is neither
+    persisted nor refreshed since the token is handed straight to the caller.
+    
+    Returns:
+        New Supabase client with the anon key
+    """
+    url, anon_key, _ = _get_supabase_config()
+    
+    return create_client(
+        url,
+        anon_key,
+        options=ClientOptions(persist_session=False, auto_refresh_token=False)
+    )
+
+
 class SupabaseClientManager:
     """
     Context manager for Supabase clients with proper error handling.
@@ -38,7 +38,7 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
         db_obj = self.model(**obj_in.dict())
         session.add(db_obj)
         session.commit()
-        session.refresh(db_obj)
+        # Models fill their defaults in Python, so there is nothing to re-read
         return db_obj
     
     def update(
@@ -54,7 +54,6 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
             setattr(db_obj, field, value)
         session.add(db_obj)
         session.commit()
-        session.refresh(db_obj)
         return db_obj
     
     def delete(self, session: Session, *, id: UUID) -> Optional[ModelType]:
@@ -8,6 +8,7 @@ audit and debugging purposes.
 
 from datetime import datetime
 from typing import Optional
+from sqlalchemy import Index, text
 from sqlmodel import SQLModel, Field, Column, JSON, Text
 import uuid
 
@@ -20,6 +21,15 @@ class Subscription(SQLModel, table=True):
     including active status, expiration dates, and event metadata.
     """
     __tablename__ = "subscriptions"
+    # One row per store transaction; record_receipt_purchase dedupes on it
+    __table_args__ = (
+        Index(
+            "ix_subscriptions_transaction_id",
+            "transaction_id",
+            unique=True,
+            postgresql_where=text("transaction_id IS NOT NULL")
+        ),
+    )
     
     id: str = Field(
         default_factory=lambda: str(uuid.uuid4()),
@@ -48,17 +58,24 @@ class Subscription(SQLModel, table=True):
         description="When the subscription expires (null for lifetime subscriptions)"
     )
     
-    event_id: str = Field(
+    event_id: Optional[str] = Field(
+        default=None,
         unique=True,
         index=True,
-        description="Unique event ID from payment provider for idempotency"
+        description="Unique event ID from payment provider for idempotency (null for receipt purchases)"
     )
     
-    raw_payload_json: str = Field(
+    raw_payload_json: Optional[str] = Field(
+        default=None,
         sa_column=Column(Text),
         description="Raw JSON payload from payment provider webhook for debugging"
     )
     
+    processing_status: str = Field(
+        default="processed",
+        description="Webhook processing state: pending until entitlements are applied, then processed (or superseded by a newer event)"
+    )
+    
     # Metadata
     created_at: datetime = Field(
         default_factory=datetime.utcnow,
@@ -71,7 +88,7 @@ class Subscription(SQLModel, table=True):
     )
     
     # Provider metadata
-    provider: str = Field(
+    provider: Optional[str] = Field(
         default="superwall",
         description="Payment provider name (superwall, stripe, apple, google)"
     )
@@ -81,6 +98,23 @@ class Subscription(SQLModel, table=True):
         description="Provider's internal subscription ID"
     )
     
+    # Receipt purchase metadata (null for webhook events)
+    transaction_id: Optional[str] = Field(
+        default=None,
+        description="Store transaction ID of a validated receipt"
+    )
+    
+    receipt_data: Optional[str] = Field(
+        default=None,
+        sa_column=Column(Text),
+        description="Raw receipt submitted by the client"
+    )
+    
+    credits_included: Optional[int] = Field(
+        default=None,
+        description="Credits granted by the receipt purchase"
+    )
+    
     class Config:
         json_encoders = {
             datetime: lambda v: v.isoformat()
@@ -246,6 +280,10 @@ class UsageAggregate(SQLModel, table=True):
     usage analytics for billing and capacity planning.
     """
     __tablename__ = "usage_aggregates"
+    # One row per user and day; also the conflict target for usage UPSERTs
+    __table_args__ = (
+        Index("ix_usage_aggregates_user_date", "user_id", "date", unique=True),
+    )
     
     id: str = Field(
         default_factory=lambda: str(uuid.uuid4()),
@@ -301,10 +339,6 @@ class UsageAggregate(SQLModel, table=True):
     )
     
     class Config:
-        # Ensure unique constraint on user_id + date
-        indexes = [
-            ("user_id", "date")
-        ]
         json_encoders = {
             datetime: lambda v: v.isoformat()
         }
@@ -1,16 +1,48 @@
 """
 Database connection and session management.
 """
+from sqlalchemy.pool import NullPool
 from sqlmodel import create_engine, SQLModel, Session
 from apps.core.settings import settings
 
 
+def _connect_args(database_url: str) -> dict:
+    """Driver options: server-side prepared statements and a statement timeout where supported."""
+    args = {}
+    if database_url.startswith("postgresql+psycopg:"):
+        # psycopg 3 prepares repeated statements so Postgres skips parse/plan;
+        # PgBouncer transaction mode can route the next transaction to a server
+        # connection without them, so preparing is turned off there
+        args["prepare_threshold"] = None if settings.db_use_null_pool else settings.db_prepare_threshold
+    # PgBouncer rejects unknown startup parameters, so only set this on direct connections
+    if database_url.startswith("postgresql") and settings.db_statement_timeout_ms and not settings.db_use_null_pool:
+        # A stuck query fails fast instead of holding a pooled connection
+        args["options"] = f"-c statement_timeout={settings.db_statement_timeout_ms}"
+    return args
+
+
+def _pool_args(database_url: str) -> dict:
+    """Connection pool sizing; PgBouncer transaction mode and SQLite keep their own defaults."""
+    if settings.db_use_null_pool:
+        return {"poolclass": NullPool}
+    if database_url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_recycle": 1800,  # Recycle connections every 30 minutes
+        "pool_use_lifo": True,  # Reuse warm connections; surplus ones idle out and get recycled
+    }
+
+
 # Create database engine
 engine = create_engine(
     settings.database_url,
     echo=settings.is_development,  # Log SQL queries in development
     pool_pre_ping=True,  # Verify connections before use
-    pool_recycle=300,  # Recycle connections every 5 minutes
+    query_cache_size=settings.db_statement_cache_size,  # Reuse compiled SQL for stable query shapes
+    connect_args=_connect_args(settings.database_url),
+    **_pool_args(settings.database_url),
 )
 
 
@@ -21,5 +53,7 @@ def create_db_and_tables():
 
 def get_session():
     """Dependency to get database session."""
-    with Session(engine) as session:
+    # Models set ids and timestamps client-side, so committed instances stay
+    # valid and need no reload after commit
+    with Session(engine, expire_on_commit=False) as session:
         yield session
\ No newline at end of file
@@ -4,9 +4,11 @@ import mimetypes
 import io
 import requests
 import random
+from requests.adapters import HTTPAdapter
 from typing import Dict, Optional
+from uuid import uuid4
+from apps.core.security import decode_supabase_jwt
 from apps.core.supa_request import user_client, service_client
-from apps.core.settings import settings
 import structlog
 
 logger = structlog.get_logger(__name__)
@@ -24,6 +26,11 @@ BASE_DELAY = 1.0  # Base delay in seconds
 MAX_JITTER = 0.2  # ±20% jitter
 RETRY_STATUS_CODES = {429, 500, 502, 503, 504}  # HTTP codes that trigger retry
 
+# Shared keep-alive pool so start, every poll and the output download reuse
+# connections instead of paying a TLS handshake each; retries stay in _http_with_retry
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64))
+
 
 def _headers():
     return {"Authorization": f"Token {TOK}", "Content-Type": "application/json"}
@@ -50,7 +57,7 @@ def _http_with_retry(method: str, url: str, **kwargs) -> requests.Response:
                 max_retries=MAX_RETRIES
             )
             
-            response = requests.request(method, url, **kwargs)
+            response = _SESSION.request(method, url, **kwargs)
             
             # Success (2xx status codes)
             if 200 <= response.status_code < 300:
@@ -186,7 +193,6 @@ def _download(url: str) -> bytes:
 
 
 def _upload_output(uid: str, src_url: str, filename_hint: str = "result.png") -> str:
-    from uuid import uuid4
     sv = service_client()
     # Generate output path: outputs/{user_id}/{unique_filename}
     file_extension = filename_hint.split('.')[-1] if '.' in filename_hint else 'png'
@@ -202,8 +208,7 @@ def _upload_output(uid: str, src_url: str, filename_hint: str = "result.png") ->
 class ReplicateProvider:
     def restore(self, *, token: str, job: Dict) -> Dict:
         # token -> user client for job updates; service client for storage ops
-        import jwt
-        uid = jwt.decode(token, settings.supabase_jwt_secret, algorithms=["HS256"])["sub"]
+        uid = decode_supabase_jwt(token)["sub"]
         in_path = job["input_image_url"]  # e.g., uploads/<uid>/...
         signed = _signed_input(in_path)
         # GFPGAN common inputs: {"img": url, "version": "1.4" ... } — keep minimal
@@ -217,8 +222,7 @@ class ReplicateProvider:
         return {"output_path": stored}
 
     def upscale(self, *, token: str, job: Dict) -> Dict:
-        import jwt
-        uid = jwt.decode(token, settings.supabase_jwt_secret, algorithms=["HS256"])["sub"]
+        uid = decode_supabase_jwt(token)["sub"]
         in_path = job["input_image_url"]
         signed = _signed_input(in_path)
         # Real-ESRGAN typical inputs: {"image": url, "scale": 4}
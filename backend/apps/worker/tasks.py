@@ -154,7 +154,8 @@ def process_ai_job(self, job_id: str):
 
 async def _process_ai_job_async(job_id: str, retry_count: int = 0) -> Dict[str, Any]:
     """Async job processing implementation."""
-    with Session(engine) as session:
+    # Progress commits are frequent; keep the job loaded instead of re-selecting it after each one
+    with Session(engine, expire_on_commit=False) as session:
         statement = select(Job).where(Job.id == job_id)
         job = session.exec(statement).first()
         
@@ -252,6 +253,7 @@ async def _process_job_with_provider(job: Job, session: Session, cache_key: str)
         
         if result.status == ProviderStatus.SUCCEEDED:
             # Process outputs
+            # Artifacts and the succeeded status land in one commit
             artifacts = await _process_job_outputs(job, provider, result, session, cache_key)
             
             job.status = "succeeded"
@@ -381,7 +383,7 @@ async def _process_job_outputs(job: Job, provider, result, session: Session, cac
             session.add(artifact)
             artifacts.append(artifact)
     
-    session.commit()
+    # Committed by the caller together with the job's final status
     return artifacts
 
 
@@ -494,4 +496,27 @@ def cancel_ai_job(job_id: str):
             
     except Exception as e:
         logger.error("Job cancellation failed", job_id=job_id, error=str(e))
-        return {"status": "error", "error": str(e)}
\ No newline at end of file
+        return {"status": "error", "error": str(e)}
+
+
+@celery_app.task
+def redrive_pending_webhooks():
+    """Re-apply Superwall events accepted with 202 whose entitlement writes never finished."""
+    from apps.api.routers.webhooks import redrive_pending_superwall_events
+    from apps.core.supa_request import service_client
+    
+    try:
+        processed = asyncio.run(redrive_pending_superwall_events(service_client()))
+        return {"processed": processed}
+    except Exception as e:
+        logger.error("Pending webhook re-drive failed", error=str(e))
+        return {"status": "error", "error": str(e)}
+
+
+# Periodic tasks schedule
+celery_app.conf.beat_schedule = {
+    'redrive-pending-webhooks': {
+        'task': 'apps.worker.tasks.redrive_pending_webhooks',
+        'schedule': 300.0,  # Run every five minutes
+    },
+}
@@ -132,6 +132,96 @@ BEGIN
 END;
 $$;
 
+-- Function to debit credits and create a job in a single statement
+-- Returns the created job row, or no rows when credits are insufficient
+-- (the cost is derived from the job type here, so callers cannot choose it;
+-- dropping the old credit_amount argument changes the signature)
+DROP FUNCTION IF EXISTS public.create_job_with_debit(uuid, integer, text, text, text, jsonb);
+CREATE FUNCTION public.create_job_with_debit(
+    target_user_id uuid,
+    new_job_type text,
+    new_input_image_url text,
+    new_target_image_url text DEFAULT NULL,
+    new_parameters jsonb DEFAULT '{}'
+)
+RETURNS SETOF public.jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    credit_amount integer;
+BEGIN
+    -- Validate input parameters
+    IF target_user_id IS NULL OR new_job_type IS NULL THEN
+        RAISE EXCEPTION 'User ID and job type are required';
+    END IF;
+    
+    -- Only the service role may create jobs for another user; this runs as
+    -- SECURITY DEFINER and a missing auth.uid() must not bypass the check
+    IF auth.uid() IS DISTINCT FROM target_user_id
+        AND COALESCE(auth.jwt() ->> 'role', '') <> 'service_role' THEN
+        RAISE EXCEPTION 'Cannot create jobs for another user';
+    END IF;
+    
+    -- Mirrors JobService.CREDIT_COSTS
+    credit_amount := CASE new_job_type
+        WHEN 'face_swap' THEN 2
+        ELSE 1
+    END;
+    
+    -- Debit, insert the job and record the transaction in one roundtrip;
+    -- the conditional UPDATE leaves every CTE empty when credits are short
+    RETURN QUERY
+    WITH debit AS (
+        UPDATE public.profiles
+        SET credits = credits - credit_amount,
+            updated_at = now()
+        WHERE id = target_user_id
+          AND credits >= credit_amount
+        RETURNING id
+    ), new_job AS (
+        INSERT INTO public.jobs (
+            user_id,
+            job_type,
+            input_image_url,
+            target_image_url,
+            parameters,
+            status,
+            progress
+        )
+        SELECT
+            debit.id,
+            new_job_type,
+            new_input_image_url,
+            new_target_image_url,
+            COALESCE(new_parameters, '{}'::jsonb),
+            'pending',
+            0
+        FROM debit
+        RETURNING *
+    ), debit_transaction AS (
+        INSERT INTO public.credit_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            job_id,
+            metadata
+        )
+        SELECT
+            new_job.user_id,
+            -credit_amount, -- Negative amount for debit
+            'debit',
+            new_job.id,
+            jsonb_build_object(
+                'operation', 'create_job_with_debit',
+                'timestamp', now()
+            )
+        FROM new_job
+    )
+    SELECT * FROM new_job;
+END;
+$$;
+
 -- Function to get user credits safely
 CREATE OR REPLACE FUNCTION public.get_user_credits(target_user_id uuid)
 RETURNS integer
@@ -149,6 +239,151 @@ BEGIN
 END;
 $$;
 
+-- Function to change a balance and record its ledger entry in one statement
+CREATE OR REPLACE FUNCTION public.apply_credit_transaction(
+    target_user_id uuid,
+    credit_amount integer,
+    new_transaction_type text,
+    new_metadata jsonb DEFAULT '{}'::jsonb
+)
+RETURNS integer
+LANGUAGE sql
+SECURITY DEFINER
+AS $$
+    -- The ledger row is only written when the profile update matched, and both
+    -- commit together; returns the new balance, or NULL for an unknown user or
+    -- a debit larger than the balance
+    WITH updated_profile AS (
+        UPDATE public.profiles
+        SET credits = credits + credit_amount,
+            updated_at = now()
+        WHERE id = target_user_id
+          AND credits + credit_amount >= 0
+        RETURNING id, credits
+    ),
+    ledger_entry AS (
+        INSERT INTO public.credit_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            metadata
+        )
+        SELECT
+            id,
+            credit_amount,
+            new_transaction_type,
+            COALESCE(new_metadata, '{}'::jsonb) || jsonb_build_object(
+                'operation', 'apply_credit_transaction',
+                'timestamp', now()
+            )
+        FROM updated_profile
+    )
+    SELECT credits FROM updated_profile;
+$$;
+
+-- Function to record a validated receipt and credit the purchase in one transaction,
+-- skipping receipts whose transaction was already recorded (deduplicated by the
+-- unique ix_subscriptions_transaction_id index from Alembic revision 007)
+-- (an unknown user raises, which also rolls back the subscription insert;
+-- the return type changed from integer, which CREATE OR REPLACE cannot do)
+DROP FUNCTION IF EXISTS public.record_receipt_purchase(uuid, text, text, text, integer, timestamptz);
+CREATE FUNCTION public.record_receipt_purchase(
+    target_user_id uuid,
+    new_product_id text,
+    new_transaction_id text,
+    new_receipt_data text,
+    credit_amount integer,
+    new_expires_at timestamptz
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    existing_sub_id public.subscriptions.id%TYPE;
+    new_sub_id public.subscriptions.id%TYPE;
+    new_balance integer;
+BEGIN
+    -- Ids and timestamps are set client-side for ORM rows, so set them here too
+    INSERT INTO public.subscriptions (
+        id,
+        user_id,
+        product_id,
+        transaction_id,
+        receipt_data,
+        status,
+        credits_included,
+        expires_at,
+        created_at,
+        updated_at
+    ) VALUES (
+        gen_random_uuid()::text,
+        target_user_id,
+        new_product_id,
+        new_transaction_id,
+        new_receipt_data,
+        'active',
+        credit_amount,
+        new_expires_at,
+        now(),
+        now()
+    )
+    ON CONFLICT (transaction_id) WHERE transaction_id IS NOT NULL DO NOTHING
+    RETURNING id INTO new_sub_id;
+    
+    -- The transaction was already recorded, possibly by a concurrent submission
+    IF new_sub_id IS NULL THEN
+        SELECT id INTO existing_sub_id FROM public.subscriptions WHERE transaction_id = new_transaction_id LIMIT 1;
+        RETURN jsonb_build_object('status', 'duplicate', 'subscription_id', existing_sub_id);
+    END IF;
+    
+    new_balance := public.apply_credit_transaction(
+        target_user_id,
+        credit_amount,
+        'purchase',
+        jsonb_build_object('product_id', new_product_id, 'reference_id', new_transaction_id)
+    );
+    
+    IF new_balance IS NULL THEN
+        RAISE EXCEPTION 'User % not found', target_user_id;
+    END IF;
+    
+    RETURN jsonb_build_object('status', 'recorded', 'credits', new_balance);
+END;
+$$;
+
+-- Function to list the caller's jobs with the total row count and current credit
+-- balance, so a job list screen needs a single roundtrip
+-- (the return type changed from a row set, which CREATE OR REPLACE cannot do)
+DROP FUNCTION IF EXISTS public.list_user_jobs(integer, integer);
+CREATE FUNCTION public.list_user_jobs(
+    p_limit integer DEFAULT 50,
+    p_offset integer DEFAULT 0
+)
+RETURNS jsonb
+LANGUAGE sql
+STABLE
+AS $$
+    -- COUNT(*) OVER() is computed before LIMIT/OFFSET, so one scan yields the page and the total
+    WITH page AS (
+        SELECT COUNT(*) OVER() AS total, to_jsonb(j) AS job, j.created_at
+        FROM public.jobs j
+        WHERE j.user_id = (SELECT auth.uid())
+        ORDER BY j.created_at DESC
+        LIMIT p_limit
+        OFFSET p_offset
+    )
+    SELECT jsonb_build_object(
+        -- An offset past the end leaves no row to read the window total from
+        'total', COALESCE(
+            (SELECT MAX(total) FROM page),
+            (SELECT COUNT(*) FROM public.jobs WHERE user_id = (SELECT auth.uid()))
+        ),
+        'credits', (SELECT credits FROM public.profiles WHERE id = (SELECT auth.uid())),
+        'jobs', COALESCE((SELECT jsonb_agg(job ORDER BY created_at DESC) FROM page), '[]'::jsonb)
+    );
+$$;
+
 -- Function to refund credits for failed jobs
 CREATE OR REPLACE FUNCTION public.refund_job_credits(
     target_user_id uuid,
@@ -207,13 +442,245 @@ BEGIN
 END;
 $$;
 
+-- Function to record the final state of a run and refund credits on failure
+-- Used by the /jobs/{id}/run endpoint so completion is a single roundtrip
+CREATE OR REPLACE FUNCTION public.run_job_transition(
+    target_job_id uuid,
+    target_user_id uuid,
+    new_status text,
+    new_progress float8 DEFAULT NULL,
+    new_output_url text DEFAULT NULL,
+    new_error text DEFAULT NULL,
+    refund_amount integer DEFAULT 0
+)
+RETURNS SETOF public.jobs
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    affected_rows integer;
+BEGIN
+    -- Validate input parameters
+    IF target_job_id IS NULL OR target_user_id IS NULL OR new_status IS NULL THEN
+        RAISE EXCEPTION 'Job ID, user ID, and status are required';
+    END IF;
+    
+    -- Update the job, scoped to its owner since this bypasses RLS
+    RETURN QUERY
+    WITH updated_job AS (
+        UPDATE public.jobs
+        SET status = new_status,
+            progress = COALESCE(new_progress, progress),
+            output_image_url = COALESCE(new_output_url, output_image_url),
+            error_message = COALESCE(new_error, error_message),
+            updated_at = now()
+        WHERE id = target_job_id
+          AND user_id = target_user_id
+        RETURNING *
+    )
+    SELECT * FROM updated_job;
+    
+    GET DIAGNOSTICS affected_rows = ROW_COUNT;
+    
+    IF affected_rows = 0 THEN
+        RAISE EXCEPTION 'Job not found: %', target_job_id;
+    END IF;
+    
+    -- Refund credits atomically with the status change
+    IF COALESCE(refund_amount, 0) > 0 THEN
+        UPDATE public.profiles 
+        SET credits = credits + refund_amount,
+            updated_at = now()
+        WHERE id = target_user_id;
+        
+        INSERT INTO public.credit_transactions (
+            user_id,
+            amount,
+            transaction_type,
+            reference_id,
+            metadata
+        ) VALUES (
+            target_user_id,
+            refund_amount,
+            'refund',
+            target_job_id,
+            jsonb_build_object(
+                'operation', 'run_job_transition',
+                'timestamp', now(),
+                'reason', 'job_failed',
+                'error', new_error
+            )
+        );
+    END IF;
+END;
+$$;
+
+-- Function to check webhook idempotency and the target user in one roundtrip
+CREATE OR REPLACE FUNCTION public.check_webhook_preconditions(
+    p_event_id text,
+    p_user_id text
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+STABLE
+SECURITY DEFINER
+AS $$
+DECLARE
+    user_found boolean;
+BEGIN
+    -- Provider user IDs are untrusted text; anything that is not a UUID cannot match a profile
+    BEGIN
+        user_found := EXISTS (SELECT 1 FROM public.profiles WHERE id = p_user_id::uuid);
+    EXCEPTION WHEN invalid_text_representation THEN
+        user_found := false;
+    END;
+    
+    RETURN jsonb_build_object(
+        'existing_sub_id', (SELECT id FROM public.subscriptions WHERE event_id = p_event_id LIMIT 1),
+        'user_exists', user_found
+    );
+END;
+$$;
+
+-- Function to replace a user's open entitlement with a new one in one roundtrip
+-- (argument types follow the table so the function works with either ID column type)
+CREATE OR REPLACE FUNCTION public.activate_entitlement(
+    p_user_id public.user_entitlements.user_id%TYPE,
+    p_plan_code public.user_entitlements.plan_code%TYPE,
+    p_limits_json public.user_entitlements.limits_json%TYPE,
+    p_effective_from public.user_entitlements.effective_from%TYPE,
+    p_effective_to public.user_entitlements.effective_to%TYPE DEFAULT NULL,
+    p_end_current boolean DEFAULT true
+)
+RETURNS SETOF public.user_entitlements
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+BEGIN
+    -- Close the currently open entitlement and open the new one atomically
+    IF p_end_current THEN
+        UPDATE public.user_entitlements
+        SET effective_to = p_effective_from
+        WHERE user_id = p_user_id
+          AND effective_to IS NULL;
+    END IF;
+    
+    RETURN QUERY
+    WITH new_entitlement AS (
+        INSERT INTO public.user_entitlements (
+            user_id,
+            plan_code,
+            limits_json,
+            effective_from,
+            effective_to
+        ) VALUES (
+            p_user_id,
+            p_plan_code,
+            p_limits_json,
+            p_effective_from,
+            p_effective_to
+        )
+        RETURNING *
+    )
+    SELECT * FROM new_entitlement;
+END;
+$$;
+
+-- Function for the common subscription_start webhook: duplicate check, user check,
+-- subscription insert and entitlement swap in one roundtrip
+CREATE OR REPLACE FUNCTION public.start_superwall_subscription(
+    p_event_id public.subscriptions.event_id%TYPE,
+    p_user_id public.subscriptions.user_id%TYPE,
+    p_product_id public.subscriptions.product_id%TYPE,
+    p_status public.subscriptions.status%TYPE,
+    p_expires_at public.subscriptions.expires_at%TYPE,
+    p_raw_payload_json public.subscriptions.raw_payload_json%TYPE,
+    p_provider_subscription_id public.subscriptions.provider_subscription_id%TYPE,
+    p_plan_code public.user_entitlements.plan_code%TYPE,
+    p_limits_json public.user_entitlements.limits_json%TYPE,
+    p_effective_from public.user_entitlements.effective_from%TYPE
+)
+RETURNS jsonb
+LANGUAGE plpgsql
+SECURITY DEFINER
+AS $$
+DECLARE
+    existing_sub_id public.subscriptions.id%TYPE;
+    new_sub_id public.subscriptions.id%TYPE;
+    new_entitlement_id public.user_entitlements.id%TYPE;
+BEGIN
+    SELECT id INTO existing_sub_id FROM public.subscriptions WHERE event_id = p_event_id LIMIT 1;
+    IF existing_sub_id IS NOT NULL THEN
+        RETURN jsonb_build_object('status', 'duplicate', 'subscription_id', existing_sub_id);
+    END IF;
+    
+    -- Provider user IDs are untrusted text; anything that is not a UUID cannot match a profile
+    BEGIN
+        IF NOT EXISTS (SELECT 1 FROM public.profiles WHERE id = p_user_id::uuid) THEN
+            RETURN jsonb_build_object('status', 'user_not_found');
+        END IF;
+    EXCEPTION WHEN invalid_text_representation THEN
+        RETURN jsonb_build_object('status', 'user_not_found');
+    END;
+    
+    INSERT INTO public.subscriptions (
+        user_id,
+        product_id,
+        status,
+        expires_at,
+        event_id,
+        raw_payload_json,
+        provider,
+        provider_subscription_id
+    ) VALUES (
+        p_user_id,
+        p_product_id,
+        p_status,
+        p_expires_at,
+        p_event_id,
+        p_raw_payload_json,
+        'superwall',
+        p_provider_subscription_id
+    )
+    ON CONFLICT (event_id) DO NOTHING
+    RETURNING id INTO new_sub_id;
+    
+    -- A concurrent delivery of the same event won the insert
+    IF new_sub_id IS NULL THEN
+        SELECT id INTO existing_sub_id FROM public.subscriptions WHERE event_id = p_event_id LIMIT 1;
+        RETURN jsonb_build_object('status', 'duplicate', 'subscription_id', existing_sub_id);
+    END IF;
+    
+    -- Current entitlements are only closed when the new one expires, as in the general path
+    SELECT id INTO new_entitlement_id
+    FROM public.activate_entitlement(
+        p_user_id,
+        p_plan_code,
+        p_limits_json,
+        p_effective_from,
+        p_expires_at,
+        p_expires_at IS NOT NULL
+    );
+    
+    RETURN jsonb_build_object(
+        'status', 'activated',
+        'subscription_id', new_sub_id,
+        'entitlement_id', new_entitlement_id
+    );
+END;
+$$;
+
 -- Function to bootstrap user profile (for new registrations)
-CREATE OR REPLACE FUNCTION public.bootstrap_user_profile(
+-- Idempotent: an existing profile is returned untouched, so concurrent first
+-- requests cannot race each other into a primary key violation
+-- (the return type changed from uuid, which CREATE OR REPLACE cannot do)
+DROP FUNCTION IF EXISTS public.bootstrap_user_profile(uuid, text, integer);
+CREATE FUNCTION public.bootstrap_user_profile(
     user_id uuid,
     user_email text,
     initial_credits integer DEFAULT 10
 )
-RETURNS uuid
+RETURNS SETOF public.profiles
 LANGUAGE plpgsql
 SECURITY DEFINER
 AS $$
@@ -223,7 +690,14 @@ BEGIN
         RAISE EXCEPTION 'User ID and email are required';
     END IF;
     
-    -- Insert user profile (will fail if already exists due to primary key constraint)
+    -- Only the service role may bootstrap (and so read back) another user's
+    -- profile; this runs as SECURITY DEFINER and would otherwise bypass RLS
+    IF auth.uid() IS DISTINCT FROM user_id
+        AND COALESCE(auth.jwt() ->> 'role', '') <> 'service_role' THEN
+        RAISE EXCEPTION 'Cannot bootstrap a profile for another user';
+    END IF;
+    
+    -- Insert user profile; the primary key turns a repeat call into a no-op
     INSERT INTO public.profiles (
         id,
         email,
@@ -234,10 +708,11 @@ BEGIN
         user_email,
         COALESCE(initial_credits, 10),
         'inactive'
-    );
+    )
+    ON CONFLICT (id) DO NOTHING;
     
-    -- Create initial credit transaction if credits > 0
-    IF initial_credits > 0 THEN
+    -- Create initial credit transaction only for a newly created profile
+    IF FOUND AND initial_credits > 0 THEN
         INSERT INTO public.credit_transactions (
             user_id,
             amount,
@@ -255,20 +730,42 @@ BEGIN
         );
     END IF;
     
-    RETURN user_id;
+    RETURN QUERY
+    SELECT * FROM public.profiles p WHERE p.id = bootstrap_user_profile.user_id;
 END;
 $$;
 
+-- Job creation debits credits, so anonymous callers get no execute grant at all
+REVOKE EXECUTE ON FUNCTION public.create_job_with_debit(uuid, text, text, text, jsonb) FROM PUBLIC;
+
 -- Grant necessary permissions to authenticated users
 GRANT EXECUTE ON FUNCTION public.increment_credits(uuid, integer) TO authenticated;
 GRANT EXECUTE ON FUNCTION public.validate_and_debit_credits(uuid, integer, uuid) TO authenticated;
+GRANT EXECUTE ON FUNCTION public.create_job_with_debit(uuid, text, text, text, jsonb) TO authenticated;
 GRANT EXECUTE ON FUNCTION public.get_user_credits(uuid) TO authenticated;
+GRANT EXECUTE ON FUNCTION public.list_user_jobs(integer, integer) TO authenticated;
 GRANT EXECUTE ON FUNCTION public.refund_job_credits(uuid, uuid, integer) TO authenticated;
 GRANT EXECUTE ON FUNCTION public.bootstrap_user_profile(uuid, text, integer) TO authenticated;
 
 -- Grant service role permissions for backend operations
 GRANT EXECUTE ON FUNCTION public.increment_credits(uuid, integer) TO service_role;
 GRANT EXECUTE ON FUNCTION public.validate_and_debit_credits(uuid, integer, uuid) TO service_role;
+GRANT EXECUTE ON FUNCTION public.create_job_with_debit(uuid, text, text, text, jsonb) TO service_role;
 GRANT EXECUTE ON FUNCTION public.get_user_credits(uuid) TO service_role;
+GRANT EXECUTE ON FUNCTION public.list_user_jobs(integer, integer) TO service_role;
 GRANT EXECUTE ON FUNCTION public.refund_job_credits(uuid, uuid, integer) TO service_role;
-GRANT EXECUTE ON FUNCTION public.bootstrap_user_profile(uuid, text, integer) TO service_role;
\ No newline at end of file
+GRANT EXECUTE ON FUNCTION public.bootstrap_user_profile(uuid, text, integer) TO service_role;
+
+-- Refunds, credit grants and webhook writes are server-driven, so these are not exposed to end users
+REVOKE EXECUTE ON FUNCTION public.run_job_transition(uuid, uuid, text, float8, text, text, integer) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.run_job_transition(uuid, uuid, text, float8, text, text, integer) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.apply_credit_transaction(uuid, integer, text, jsonb) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.apply_credit_transaction(uuid, integer, text, jsonb) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.check_webhook_preconditions(text, text) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.check_webhook_preconditions(text, text) TO service_role;
+REVOKE EXECUTE ON FUNCTION public.activate_entitlement FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.activate_entitlement TO service_role;
+REVOKE EXECUTE ON FUNCTION public.start_superwall_subscription FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.start_superwall_subscription TO service_role;
+REVOKE EXECUTE ON FUNCTION public.record_receipt_purchase(uuid, text, text, text, integer, timestamptz) FROM PUBLIC;
+GRANT EXECUTE ON FUNCTION public.record_receipt_purchase(uuid, text, text, text, integer, timestamptz) TO service_role;
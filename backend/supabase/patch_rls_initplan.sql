@@ -0,0 +1,48 @@
+-- RLS InitPlan Patch for Supabase
+-- Replaces the per-row auth.uid()/auth.jwt() policies on profiles, jobs and
+-- credit_transactions with the consolidated (SELECT auth.uid()) versions
+-- from rls_policies.sql. Idempotent; run once on existing databases.
+
+-- Drop the original per-row policies
+DROP POLICY IF EXISTS "Users can view own profile" ON public.profiles;
+DROP POLICY IF EXISTS "Users can update own profile" ON public.profiles;
+DROP POLICY IF EXISTS "Users can insert own profile" ON public.profiles;
+DROP POLICY IF EXISTS "Service role can manage all profiles" ON public.profiles;
+
+DROP POLICY IF EXISTS "Users can view own jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Users can create own jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Users can update own jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Users can delete own jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Service role can manage all jobs" ON public.jobs;
+
+DROP POLICY IF EXISTS "Users can view own credit transactions" ON public.credit_transactions;
+DROP POLICY IF EXISTS "Users can create own credit transactions" ON public.credit_transactions;
+DROP POLICY IF EXISTS "Service role can manage all credit transactions" ON public.credit_transactions;
+
+-- Drop the consolidated policies too so the patch can be re-run
+DROP POLICY IF EXISTS "Owner or service role can view profiles" ON public.profiles;
+DROP POLICY IF EXISTS "Owner or service role can update profiles" ON public.profiles;
+DROP POLICY IF EXISTS "Owner or service role can insert profiles" ON public.profiles;
+DROP POLICY IF EXISTS "Service role can delete profiles" ON public.profiles;
+
+DROP POLICY IF EXISTS "Owner or service role can view jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Owner or service role can create jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Owner or service role can update jobs" ON public.jobs;
+DROP POLICY IF EXISTS "Owner or service role can delete jobs" ON public.jobs;
+
+DROP POLICY IF EXISTS "Owner or service role can view credit transactions" ON public.credit_transactions;
+DROP POLICY IF EXISTS "Owner or service role can create credit transactions" ON public.credit_transactions;
+DROP POLICY IF EXISTS "Service role can update credit transactions" ON public.credit_transactions;
+DROP POLICY IF EXISTS "Service role can delete credit transactions" ON public.credit_transactions;
+
+-- Recreate the policies
+\i rls_policies.sql
+
+-- Final verification query
+SELECT 
+    tablename,
+    COUNT(*) as policy_count
+FROM pg_policies 
+WHERE schemaname = 'public' 
+AND tablename IN ('profiles', 'jobs', 'credit_transactions')
+GROUP BY tablename;
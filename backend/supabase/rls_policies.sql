@@ -1,50 +1,76 @@
 -- Row Level Security Policies for Supabase AI Processing Platform
 -- This file contains all RLS policies to ensure users can only access their own data
+--
+-- auth.uid() and auth.jwt() are wrapped in (SELECT ...) so Postgres evaluates them
+-- once per statement as an InitPlan instead of once per row. Owner and service role
+-- access share one permissive policy per command so each row is checked only once.
 
 -- Profiles table policies
 -- Users can only see and update their own profile
-CREATE POLICY "Users can view own profile" ON public.profiles
-    FOR SELECT USING (auth.uid() = id);
+CREATE POLICY "Owner or service role can view profiles" ON public.profiles
+    FOR SELECT USING (
+        (SELECT auth.uid()) = id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
-CREATE POLICY "Users can update own profile" ON public.profiles
-    FOR UPDATE USING (auth.uid() = id);
+CREATE POLICY "Owner or service role can update profiles" ON public.profiles
+    FOR UPDATE USING (
+        (SELECT auth.uid()) = id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
-CREATE POLICY "Users can insert own profile" ON public.profiles
-    FOR INSERT WITH CHECK (auth.uid() = id);
+CREATE POLICY "Owner or service role can insert profiles" ON public.profiles
+    FOR INSERT WITH CHECK (
+        (SELECT auth.uid()) = id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
+
+CREATE POLICY "Service role can delete profiles" ON public.profiles
+    FOR DELETE USING ((SELECT auth.jwt() ->> 'role') = 'service_role');
 
 -- Jobs table policies
--- Users can only see their own jobs
-CREATE POLICY "Users can view own jobs" ON public.jobs
-    FOR SELECT USING (auth.uid() = user_id);
+-- Users can only see, create, update and delete their own jobs
+CREATE POLICY "Owner or service role can view jobs" ON public.jobs
+    FOR SELECT USING (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
--- Users can only create jobs for themselves
-CREATE POLICY "Users can create own jobs" ON public.jobs
-    FOR INSERT WITH CHECK (auth.uid() = user_id);
+CREATE POLICY "Owner or service role can create jobs" ON public.jobs
+    FOR INSERT WITH CHECK (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
--- Users can only update their own jobs
-CREATE POLICY "Users can update own jobs" ON public.jobs
-    FOR UPDATE USING (auth.uid() = user_id);
+CREATE POLICY "Owner or service role can update jobs" ON public.jobs
+    FOR UPDATE USING (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
--- Users can only delete their own jobs (if needed)
-CREATE POLICY "Users can delete own jobs" ON public.jobs
-    FOR DELETE USING (auth.uid() = user_id);
+CREATE POLICY "Owner or service role can delete jobs" ON public.jobs
+    FOR DELETE USING (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
 -- Credit transactions table policies
--- Users can only see their own credit transactions
-CREATE POLICY "Users can view own credit transactions" ON public.credit_transactions
-    FOR SELECT USING (auth.uid() = user_id);
-
--- Users can only create credit transactions for themselves
-CREATE POLICY "Users can create own credit transactions" ON public.credit_transactions
-    FOR INSERT WITH CHECK (auth.uid() = user_id);
+-- Users can only see and create their own credit transactions
+CREATE POLICY "Owner or service role can view credit transactions" ON public.credit_transactions
+    FOR SELECT USING (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
--- Service role policies (for backend operations)
--- Allow service role to perform all operations (for system functions)
-CREATE POLICY "Service role can manage all profiles" ON public.profiles
-    FOR ALL USING (auth.jwt() ->> 'role' = 'service_role');
+CREATE POLICY "Owner or service role can create credit transactions" ON public.credit_transactions
+    FOR INSERT WITH CHECK (
+        (SELECT auth.uid()) = user_id
+        OR (SELECT auth.jwt() ->> 'role') = 'service_role'
+    );
 
-CREATE POLICY "Service role can manage all jobs" ON public.jobs
-    FOR ALL USING (auth.jwt() ->> 'role' = 'service_role');
+-- Only backend operations may rewrite or remove transaction history
+CREATE POLICY "Service role can update credit transactions" ON public.credit_transactions
+    FOR UPDATE USING ((SELECT auth.jwt() ->> 'role') = 'service_role');
 
-CREATE POLICY "Service role can manage all credit transactions" ON public.credit_transactions
-    FOR ALL USING (auth.jwt() ->> 'role' = 'service_role');
\ No newline at end of file
+CREATE POLICY "Service role can delete credit transactions" ON public.credit_transactions
+    FOR DELETE USING ((SELECT auth.jwt() ->> 'role') = 'service_role');
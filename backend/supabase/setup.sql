@@ -17,6 +17,9 @@
 CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_user_status ON public.jobs(user_id, status);
 CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_type_status ON public.jobs(job_type, status);
 CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_credit_transactions_user_type ON public.credit_transactions(user_id, transaction_type);
+-- Serve "newest first for one user" pages (list_user_jobs, credit history) straight from the index
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_jobs_user_created ON public.jobs(user_id, created_at DESC);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_credit_transactions_user_created ON public.credit_transactions(user_id, created_at DESC);
 
 -- Create a view for user job statistics
 CREATE OR REPLACE VIEW public.user_job_stats AS
@@ -98,4 +98,33 @@ class TestBilling:
         
         # Refresh user to check credits
         test_session.refresh(test_user)
-        assert test_user.credits < initial_credits
\ No newline at end of file
+        assert test_user.credits < initial_credits
+
+
+class TestReceiptIdempotency:
+    """Test the Redis idempotency guard in front of receipt processing"""
+    
+    def test_replayed_key_is_refused(self):
+        """A second claim for the same transaction id is refused"""
+        from unittest.mock import MagicMock
+        from apps.core.idempotency import IdempotencyGuard
+        
+        redis_client = MagicMock()
+        redis_client.set.side_effect = [True, None]
+        guard = IdempotencyGuard("txn", 60, redis_client=redis_client)
+        
+        assert guard.claim("tx-1") is True
+        assert guard.claim("tx-1") is False
+        redis_client.set.assert_called_with("txn:tx-1", "1", nx=True, ex=60)
+    
+    def test_redis_outage_fails_open(self):
+        """Claims succeed when Redis is unavailable; Postgres still dedupes"""
+        from unittest.mock import MagicMock
+        from redis.exceptions import ConnectionError
+        from apps.core.idempotency import IdempotencyGuard
+        
+        redis_client = MagicMock()
+        redis_client.set.side_effect = ConnectionError("down")
+        guard = IdempotencyGuard("txn", 60, redis_client=redis_client)
+        
+        assert guard.claim("tx-1") is True
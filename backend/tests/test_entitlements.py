@@ -12,13 +12,22 @@ import pytest
 from datetime import datetime, timedelta
 from sqlmodel import Session, select
 
-from apps.api.services.entitlements import EntitlementsService
+from apps.api.services.entitlements import EntitlementsService, LimitErrorCode, LIMIT_ERROR_STATUS
 from apps.db.models.subscription import UserEntitlement, UsageAggregate, PLAN_TEMPLATES
 from apps.db.models.job import Job
 from apps.db.models.user import User
 from tests.conftest import TestHelpers
 
 
+@pytest.fixture(autouse=True)
+def clear_limits_cache():
+    """Keep cached limits from leaking between tests."""
+    from apps.api.services import entitlements
+    entitlements._limits_cache.clear()
+    yield
+    entitlements._limits_cache.clear()
+
+
 class TestEntitlementsService:
     """Test entitlements service functionality."""
     
@@ -161,9 +170,10 @@ class TestEntitlementsService:
         }
         
         with EntitlementsService(session) as service:
-            can_create, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
+            can_create, error_code, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
         
         assert can_create is True
+        assert error_code is None
         assert error_message == ""
     
     def test_check_job_creation_limits_daily_exceeded(self, test_user, session):
@@ -191,9 +201,10 @@ class TestEntitlementsService:
         job_params = {"job_type": "face_restore"}
         
         with EntitlementsService(session) as service:
-            can_create, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
+            can_create, error_code, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
         
         assert can_create is False
+        assert error_code == LimitErrorCode.DAILY_LIMIT
         assert "Daily job limit exceeded" in error_message
     
     def test_check_job_creation_limits_concurrent_exceeded(self, test_user, session):
@@ -220,9 +231,10 @@ class TestEntitlementsService:
         job_params = {"job_type": "face_restore"}
         
         with EntitlementsService(session) as service:
-            can_create, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
+            can_create, error_code, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
         
         assert can_create is False
+        assert error_code == LimitErrorCode.CONCURRENT_LIMIT
         assert "Concurrent job limit exceeded" in error_message
     
     def test_check_job_creation_limits_max_side_exceeded(self, test_user, session):
@@ -244,9 +256,10 @@ class TestEntitlementsService:
         }
         
         with EntitlementsService(session) as service:
-            can_create, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
+            can_create, error_code, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
         
         assert can_create is False
+        assert error_code == LimitErrorCode.PARAM_LIMIT
         assert "exceeds limit of 512" in error_message
     
     def test_check_job_creation_limits_feature_unavailable(self, test_user, session):
@@ -265,9 +278,10 @@ class TestEntitlementsService:
         job_params = {"job_type": "face_swap"}
         
         with EntitlementsService(session) as service:
-            can_create, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
+            can_create, error_code, error_message = service.check_job_creation_limits(str(test_user.id), job_params)
         
         assert can_create is False
+        assert error_code == LimitErrorCode.FEATURE_UNAVAILABLE
         assert "not available in free plan" in error_message
     
     def test_increment_job_usage(self, test_user, session):
@@ -346,7 +360,7 @@ class TestEntitlementsConvenienceFunctions:
         from apps.api.services.entitlements import check_job_limits
         
         job_params = {"job_type": "face_restore", "max_side": 512}
-        can_create, error_message = check_job_limits(str(test_user.id), job_params)
+        can_create, error_code, error_message = check_job_limits(str(test_user.id), job_params)
         
         assert isinstance(can_create, bool)
         assert isinstance(error_message, str)
@@ -398,4 +412,120 @@ class TestPlanTemplates:
         # Premium should have more than pro
         assert premium_limits["daily_jobs"] >= pro_limits["daily_jobs"]
         assert premium_limits["concurrent_jobs"] >= pro_limits["concurrent_jobs"]
-        assert premium_limits["max_side"] >= pro_limits["max_side"]
\ No newline at end of file
+        assert premium_limits["max_side"] >= pro_limits["max_side"]
+    
+    def test_limit_error_codes_have_status(self):
+        """Test every limit error code maps to an HTTP status."""
+        for code in LimitErrorCode:
+            assert code in LIMIT_ERROR_STATUS
+        
+        assert LIMIT_ERROR_STATUS[LimitErrorCode.DAILY_LIMIT] == 429
+        assert LIMIT_ERROR_STATUS[LimitErrorCode.FEATURE_UNAVAILABLE] == 402
+
+
+class TestLimitsCache:
+    """Test in-process caching of resolved user limits."""
+    
+    def test_limits_cached_until_invalidated(self):
+        """Test repeat lookups skip the entitlement query until invalidated."""
+        from unittest.mock import MagicMock
+        from apps.api.services.entitlements import invalidate_user_limits
+        
+        session = MagicMock()
+        session.exec.return_value.first.return_value = None
+        service = EntitlementsService(session)
+        user_id = "limits-cache-user"
+        invalidate_user_limits(user_id)
+        
+        first = service.get_user_limits(user_id)
+        first["daily_jobs"] = -1
+        second = service.get_user_limits(user_id)
+        
+        assert session.exec.call_count == 1
+        assert second["daily_jobs"] != -1
+        
+        invalidate_user_limits(user_id)
+        service.get_user_limits(user_id)
+        assert session.exec.call_count == 2
+
+
+class TestLimitContext:
+    """Test the aggregated limit check query."""
+    
+    def test_check_limits_uses_single_query(self):
+        """Test usage and concurrent job counts come back from one query."""
+        from unittest.mock import MagicMock
+        
+        session = MagicMock()
+        session.exec.return_value.one.return_value = (0, 0)
+        service = EntitlementsService(session)
+        service.get_user_limits = MagicMock(return_value={
+            "plan_code": "pro",
+            "daily_jobs": 10,
+            "concurrent_jobs": 2,
+            "max_side": 1024,
+            "features": ["face_restore", "basic_upscale"]
+        })
+        
+        can_create, error_code, _ = service.check_job_creation_limits("user-1", {"job_type": "face_restore"})
+        
+        assert can_create is True
+        assert error_code is None
+        assert session.exec.call_count == 1
+    
+    def test_check_limits_reports_concurrent_limit(self):
+        """Test the fetched concurrent job count is enforced."""
+        from unittest.mock import MagicMock
+        
+        session = MagicMock()
+        session.exec.return_value.one.return_value = (1, 2)
+        service = EntitlementsService(session)
+        service.get_user_limits = MagicMock(return_value={
+            "plan_code": "pro",
+            "daily_jobs": 10,
+            "concurrent_jobs": 2,
+            "max_side": 1024,
+            "features": ["face_restore", "basic_upscale"]
+        })
+        
+        can_create, error_code, _ = service.check_job_creation_limits("user-1", {"job_type": "face_restore"})
+        
+        assert can_create is False
+        assert error_code == LimitErrorCode.CONCURRENT_LIMIT
+
+
+class TestUsageUpsert:
+    """Test atomic usage aggregate updates."""
+    
+    def test_increment_job_usage_upserts(self):
+        """Test job creation bumps the counter with one UPSERT and no read."""
+        from unittest.mock import MagicMock
+        from sqlalchemy.dialects import postgresql
+        
+        session = MagicMock()
+        service = EntitlementsService(session)
+        
+        service.increment_job_usage("user-1", "face_restore")
+        
+        session.exec.assert_not_called()
+        session.execute.assert_called_once()
+        session.commit.assert_called_once()
+        
+        sql = str(session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        assert "ON CONFLICT (user_id, date) DO UPDATE" in sql
+        assert "jobs_created = (usage_aggregates.jobs_created +" in sql
+    
+    def test_update_job_completion_increments(self):
+        """Test completion only touches the counters for its status."""
+        from unittest.mock import MagicMock
+        from sqlalchemy.dialects import postgresql
+        
+        session = MagicMock()
+        service = EntitlementsService(session)
+        
+        service.update_job_completion("user-1", "failed", processing_time_seconds=60)
+        
+        sql = str(session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        assert "jobs_failed = (usage_aggregates.jobs_failed +" in sql
+        assert "total_processing_time_seconds = (usage_aggregates.total_processing_time_seconds +" in sql
+        assert "jobs_completed = (" not in sql
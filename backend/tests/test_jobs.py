@@ -3,6 +3,9 @@ import pytest
 from fastapi.testclient import TestClient
 from sqlmodel import Session
 from unittest.mock import patch
+from pydantic import ValidationError
+
+from apps.api.routers.jobs import JobCreateRequest, FaceRestoreParams, UpscaleParams, _job_etag
 
 from apps.db.models.user import User
 from apps.db.models.job import Job
@@ -132,4 +135,133 @@ class TestJobs:
         data = response.json()
         assert isinstance(data, list)
         assert len(data) >= 1
-        assert any(job["id"] == str(test_job.id) for job in data)
\ No newline at end of file
+        assert any(job["id"] == str(test_job.id) for job in data)
+
+
+class TestJobParameters:
+    """Test job parameter validation"""
+    
+    def test_parameters_dispatch_on_job_type(self):
+        """Parameters are parsed into the model matching job_type"""
+        job = JobCreateRequest(
+            job_type="upscale",
+            input_image_url="https://example.com/in.png",
+            parameters={"scale": 2}
+        )
+        
+        assert isinstance(job.parameters, UpscaleParams)
+        assert job.parameters.scale == 2
+        assert "job_type" not in job.model_dump()["parameters"]
+    
+    def test_parameters_tag_follows_top_level_job_type(self):
+        """A conflicting parameters.job_type cannot pick a different model"""
+        job = JobCreateRequest(
+            job_type="upscale",
+            input_image_url="https://example.com/in.png",
+            parameters={"job_type": "restore", "scale": 2}
+        )
+        
+        assert isinstance(job.parameters, UpscaleParams)
+    
+    def test_parameters_default_when_omitted(self):
+        """Omitted parameters fall back to the job type defaults"""
+        job = JobCreateRequest(job_type="restore", input_image_url="https://example.com/in.png")
+        
+        assert isinstance(job.parameters, FaceRestoreParams)
+        assert job.parameters.model == "gfpgan"
+    
+    def test_parameters_rejected_for_job_type(self):
+        """Out-of-range values are rejected for the selected job type"""
+        with pytest.raises(ValidationError):
+            JobCreateRequest(
+                job_type="upscale",
+                input_image_url="https://example.com/in.png",
+                parameters={"scale": 3}
+            )
+    
+    def test_face_swap_requires_target_image(self):
+        """Face swap jobs are rejected without a target image URL"""
+        with pytest.raises(ValidationError):
+            JobCreateRequest(job_type="face_swap", input_image_url="https://example.com/in.png")
+    
+    def test_input_url_must_be_http(self):
+        """Non-HTTP input URLs are rejected"""
+        with pytest.raises(ValidationError):
+            JobCreateRequest(job_type="upscale", input_image_url="ftp://example.com/in.png")
+
+
+class TestJobEtag:
+    """Test job status validators"""
+    
+    def test_etag_is_stable_for_same_row(self):
+        """Identical job rows produce the same quoted ETag"""
+        job = {"id": "job-1", "status": "running", "progress": 0.5}
+        assert _job_etag(job) == _job_etag(dict(job))
+        assert _job_etag(job).startswith('"') and _job_etag(job).endswith('"')
+    
+    def test_etag_changes_with_status(self):
+        """A status transition invalidates the previous ETag"""
+        running = {"id": "job-1", "status": "running", "progress": 0.5}
+        succeeded = {"id": "job-1", "status": "succeeded", "progress": 1.0}
+        assert _job_etag(running) != _job_etag(succeeded)
+    
+    @pytest.mark.parametrize("job_status,cache_control", [
+        ("succeeded", "private, max-age=31536000, immutable"),
+        ("failed", "no-cache"),
+        ("running", "no-cache"),
+    ])
+    def test_only_succeeded_jobs_are_immutable(self, job_status, cache_control):
+        """Failed jobs can be re-run, so only succeeded ones are cached for good"""
+        import asyncio
+        from unittest.mock import Mock
+        from uuid import uuid4
+        from apps.api.routers.jobs import get_job_status
+        
+        job = {"id": "job-1", "status": job_status, "progress": 1.0}
+        with patch('apps.api.routers.jobs.JobService.get_job', return_value=job):
+            response = asyncio.run(get_job_status(
+                Mock(headers={}), uuid4(), Mock(id="user-1"), "user.jwt.token"
+            ))
+        
+        assert response.headers["cache-control"] == cache_control
+
+
+class TestJobRunGuard:
+    """Test the Redis run lock and result cache used by /run"""
+    
+    def test_lock_is_exclusive(self):
+        """A second acquire for the same job is refused while the lock is held"""
+        from unittest.mock import MagicMock
+        from apps.core.job_guard import JobRunGuard
+        
+        redis_client = MagicMock()
+        redis_client.set.side_effect = [True, None]
+        guard = JobRunGuard(redis_client=redis_client)
+        
+        assert guard.acquire("job-1") is not None
+        assert guard.acquire("job-1") is None
+        assert redis_client.set.call_args.kwargs["nx"] is True
+    
+    def test_result_cache_is_scoped_to_owner(self):
+        """Cached terminal rows are keyed by user and decoded from orjson"""
+        from unittest.mock import MagicMock
+        from apps.core.job_guard import JobRunGuard
+        
+        redis_client = MagicMock()
+        redis_client.get.return_value = b'{"id":"job-1","status":"succeeded"}'
+        guard = JobRunGuard(redis_client=redis_client)
+        
+        assert guard.get_result("user-1", "job-1") == {"id": "job-1", "status": "succeeded"}
+        redis_client.get.assert_called_once_with("job:user-1:job-1:terminal")
+    
+    def test_uid_of_expiring_token_is_not_cached(self):
+        """Tokens expiring within the cache window are verified on every /run call"""
+        import time
+        from apps.api.routers import jobs
+        
+        payload = {"sub": "user-1", "exp": time.time() + 5}
+        with patch('apps.api.routers.jobs.decode_supabase_jwt', return_value=payload) as decode:
+            assert jobs._decode_uid("expiring.jwt.token") == "user-1"
+            assert jobs._decode_uid("expiring.jwt.token") == "user-1"
+        
+        assert decode.call_count == 2
@@ -242,10 +242,11 @@ class TestSuperwallWebhooks:
             }
         )
         
-        assert response.status_code == 200
+        # Non-start events are accepted and applied in a background task
+        assert response.status_code == 202
         data = response.json()
-        assert data["status"] == "success"
-        assert data["action"] == "deactivated"
+        assert data["status"] == "accepted"
+        assert data["subscription_id"]
     
     def test_webhook_invalid_json(self):
         """Test webhook with invalid JSON payload."""
@@ -74,4 +74,34 @@ class TestRateLimiting:
                     break
         
         # Should eventually hit rate limit
-        assert 429 in responses
\ No newline at end of file
+        assert 429 in responses
+
+
+class TestTokenBucket:
+    """Test the Redis token bucket used for job creation"""
+
+    def test_bucket_uses_per_key_redis_script(self):
+        """Test bucket runs its script against a key-scoped Redis entry"""
+        from unittest.mock import MagicMock
+        from apps.core.rate_limit import TokenBucket
+
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.return_value = 0
+        bucket = TokenBucket("jobs:create", capacity=30, refill_per_second=0.5, redis_client=redis_client)
+
+        assert bucket.consume("user-1") is False
+        call = redis_client.register_script.return_value.call_args
+        assert call.kwargs["keys"] == ["ratelimit:jobs:create:user-1"]
+        assert bucket.ttl == 61
+
+    def test_bucket_fails_open_on_redis_error(self):
+        """Test bucket allows requests when Redis is unavailable"""
+        from unittest.mock import MagicMock
+        from redis.exceptions import ConnectionError
+        from apps.core.rate_limit import TokenBucket
+
+        redis_client = MagicMock()
+        redis_client.register_script.return_value.side_effect = ConnectionError("down")
+        bucket = TokenBucket("jobs:create", capacity=30, refill_per_second=0.5, redis_client=redis_client)
+
+        assert bucket.consume("user-1") is True
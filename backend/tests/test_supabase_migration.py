@@ -6,7 +6,7 @@ import pytest
 from unittest.mock import Mock, patch
 from apps.core.security import SecurityUtils, SupabaseUser
 from apps.core.supabase_client import SupabaseClient
-from apps.api.services import ProfileService, JobService, CreditService, UploadService
+from apps.api.services import AuthService, BillingService, ProfileService, JobService, CreditService, UploadService
 
 
 class TestSupabaseAuthentication:
@@ -74,6 +74,20 @@ class TestSupabaseClient:
             
             assert client._client == mock_client
             mock_create_client.assert_called_once()
+    
+    def test_request_bodies_encoded_with_orjson(self):
+        """Test PostgREST bodies go through orjson without changing httpx globally."""
+        from apps.core.supa_request import service_client
+        
+        session = service_client().postgrest.session
+        request = session.build_request("POST", "https://test.supabase.co/rest/v1/rpc/f", json={"a": [1, "ç"], 1: 2})
+        
+        assert request.content == '{"a":[1,"ç"],"1":2}'.encode()
+        assert request.headers["content-type"] == "application/json"
+        
+        # Non-finite floats are rejected like the stdlib encoder does, not written as null
+        with pytest.raises(ValueError):
+            session.build_request("POST", "https://test.supabase.co/rest/v1/rpc/f", json={"x": float("nan")})
 
 
 class TestServices:
@@ -100,6 +114,185 @@ class TestServices:
         assert JobService.CREDIT_COSTS["face_restore"] == 1
         assert JobService.CREDIT_COSTS["upscale"] == 1
     
+    @patch('apps.api.services.supabase.user_client')
+    def test_job_service_create_job_leaves_cost_to_rpc(self, mock_user_client):
+        """Test the job creation RPC is not sent a caller-chosen credit amount."""
+        rpc = mock_user_client.return_value.rpc
+        rpc.return_value.execute.return_value = Mock(data=[{"id": "job-1"}])
+        user = SupabaseUser(user_id="user-1", email="test@example.com", payload={})
+    
+        job = JobService.create_job(user, {"job_type": "face_swap", "input_image_url": "in.jpg"}, "fake.jwt.token")
+    
+        assert job == {"id": "job-1"}
+        name, params = rpc.call_args.args
+        assert name == "create_job_with_debit"
+        assert "credit_amount" not in params
+        assert params["new_job_type"] == "face_swap"
+    
+    @patch('apps.api.services.supabase.user_client')
+    def test_job_service_list_user_jobs(self, mock_user_client):
+        """Test job listing returns the page, the total and the credit balance."""
+        mock_user_client.return_value.rpc.return_value.execute.return_value = Mock(data={
+            "total": 7,
+            "credits": 12,
+            "jobs": [{"id": "job-1"}, {"id": "job-2"}]
+        })
+        
+        jobs, total, credits = JobService.list_user_jobs("fake.jwt.token", limit=2, offset=0)
+        
+        assert [job["id"] for job in jobs] == ["job-1", "job-2"]
+        assert total == 7
+        assert credits == 12
+        mock_user_client.return_value.rpc.assert_called_once_with(
+            "list_user_jobs", {"p_limit": 2, "p_offset": 0}
+        )
+    
+    @patch('apps.api.services.supabase.service_client')
+    def test_job_service_update_job_status_fields(self, mock_service_client):
+        """Test status updates only send set fields plus the status timestamp."""
+        table = mock_service_client.return_value.table
+        table.return_value.update.return_value.eq.return_value.execute.return_value = Mock(data=[{"id": "job-1"}])
+    
+        JobService.update_job_status("job-1", "failed", error_message="boom", result_url="")
+    
+        updates = table.return_value.update.call_args.args[0]
+        assert set(updates) == {"status", "error_message", "completed_at"}
+        assert updates["error_message"] == "boom"
+    
+    @patch('apps.api.services.supabase.user_client')
+    def test_credit_service_credit_summary(self, mock_user_client):
+        """Test balance and transactions are read from one embedded select."""
+        table = mock_user_client.return_value.table
+        query = table.return_value.select.return_value
+        query.order.return_value = query
+        query.limit.return_value = query
+        query.execute.return_value = Mock(data=[{
+            "credits": 8,
+            "credit_transactions": [{"id": "tx-1"}, {"id": "tx-2"}]
+        }])
+    
+        credits, transactions = CreditService.get_credit_summary("fake.jwt.token", limit=2)
+    
+        assert credits == 8
+        assert [tx["id"] for tx in transactions] == ["tx-1", "tx-2"]
+        table.assert_called_once_with("profiles")
+        query.limit.assert_called_once_with(2, foreign_table="credit_transactions")
+    
+    @patch('apps.api.services.supabase.user_client')
+    def test_upload_service_download_url_reused(self, mock_user_client):
+        """Test signed download URLs are reused per token and path."""
+        create_signed_url = mock_user_client.return_value.storage.from_.return_value.create_signed_url
+        create_signed_url.return_value = {"signedURL": "https://example.com/signed"}
+        
+        first = UploadService.get_download_url("cache.jwt.token", "user-1/a.png", 3600)
+        second = UploadService.get_download_url("cache.jwt.token", "user-1/a.png", 3600)
+        other = UploadService.get_download_url("other.jwt.token", "user-1/a.png", 3600)
+        
+        assert first == second == other == "https://example.com/signed"
+        assert create_signed_url.call_count == 2
+    
+    @patch('apps.api.services.auth.user_client')
+    def test_auth_service_user_lookup_reused(self, mock_user_client):
+        """Test profile lookups are reused per token and requested id."""
+        execute = mock_user_client.return_value.table.return_value.select.return_value.execute
+        execute.return_value = Mock(data=[{"id": "user-1", "credits": 3}])
+        
+        first = AuthService.get_user_by_id("lookup.jwt.token")
+        second = AuthService.get_user_by_id("lookup.jwt.token")
+        
+        assert first == second == {"id": "user-1", "credits": 3}
+        assert execute.call_count == 1
+    
+    @patch('apps.api.services.auth.service_client')
+    @patch('apps.api.services.auth.auth_client')
+    def test_auth_service_repeat_login_signs_in_again(self, mock_auth_client, mock_service_client):
+        """Test sequential logins each sign in, so sessions and profiles are never stale."""
+        cli = mock_auth_client.return_value
+        cli.auth.sign_in_with_password.return_value = Mock(
+            user=Mock(id="user-1", email="login@example.com"),
+            session=Mock(access_token="access-token")
+        )
+        mock_service_client.return_value.table.return_value.select.return_value.eq.return_value.execute.return_value = Mock(
+            data=[{"id": "user-1", "credits": 5}]
+        )
+        
+        first = AuthService.authenticate_user("login@example.com", "secret-1")
+        second = AuthService.authenticate_user("login@example.com", "secret-1")
+        
+        assert first["access_token"] == second["access_token"] == "access-token"
+        assert cli.auth.sign_in_with_password.call_count == 2
+        
+        # A password change or ban is seen by the very next login
+        cli.auth.sign_in_with_password.return_value = Mock(user=None, session=None)
+        assert AuthService.authenticate_user("login@example.com", "secret-1") is None
+        assert cli.auth.sign_in_with_password.call_count == 3
+    
+    def test_auth_service_sign_in_keeps_service_client_role(self):
+        """Test signing in never switches the shared service client to the user's token."""
+        from supabase_auth import SyncGoTrueClient
+        from apps.core.supa_request import service_client
+        
+        session = Mock(access_token="USER-JWT")
+        
+        def fake_sign_in(gotrue, credentials):
+            # Mirror supabase-py: a successful sign-in notifies SIGNED_IN listeners
+            gotrue._notify_all_subscribers("SIGNED_IN", session)
+            return Mock(user=Mock(id="user-3", email=credentials["email"]), session=session)
+        
+        service = service_client()
+        service_auth_header = service.options.headers["Authorization"]
+        
+        with patch.object(SyncGoTrueClient, "sign_in_with_password", fake_sign_in), \
+                patch.object(service, "table") as table:
+            table.return_value.select.return_value.eq.return_value.execute.return_value = Mock(
+                data=[{"id": "user-3", "credits": 1}]
+            )
+            result = AuthService.authenticate_user("role@example.com", "pw")
+        
+        assert result["access_token"] == "USER-JWT"
+        assert service.options.headers["Authorization"] == service_auth_header
+    
+    def test_auth_service_concurrent_logins_share_sign_in(self):
+        """Test concurrent logins with the same credentials run one sign-in."""
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        
+        release = threading.Event()
+        calls = []
+        
+        def slow_sign_in(email, password):
+            calls.append(email)
+            release.wait(5)
+            return {"id": "user-2", "access_token": "shared-token"}
+        
+        with patch.object(AuthService, "_sign_in", side_effect=slow_sign_in):
+            with ThreadPoolExecutor(max_workers=3) as pool:
+                futures = [pool.submit(AuthService.authenticate_user, "burst@example.com", "pw") for _ in range(3)]
+                while not calls:
+                    threading.Event().wait(0.01)
+                release.set()
+                results = [f.result(timeout=5) for f in futures]
+        
+        assert len(calls) == 1
+        assert all(r["access_token"] == "shared-token" for r in results)
+    
+    @patch('apps.api.services.billing.receipt_guard')
+    @patch('apps.api.services.billing.service_client')
+    def test_billing_service_duplicate_receipt(self, mock_service_client, mock_receipt_guard):
+        """Test a receipt already recorded is rejected by the single purchase RPC."""
+        mock_receipt_guard.claim.return_value = True
+        rpc = mock_service_client.return_value.rpc
+        rpc.return_value.execute.return_value = Mock(data={"status": "duplicate", "subscription_id": "sub-1"})
+        
+        result = BillingService.validate_receipt(
+            "fake.jwt.token", "user-1", {"product_id": "credits_10", "transaction_id": "tx-1"}
+        )
+        
+        assert result["valid"] is False
+        assert result["error_message"] == "Transaction already processed"
+        rpc.assert_called_once()
+        assert rpc.call_args.args[0] == "record_receipt_purchase"
+    
     @patch('apps.api.services.supabase_client')
     def test_profile_service_get_profile(self, mock_supabase_client):
         """Test profile service get profile."""
@@ -164,6 +357,24 @@ class TestErrorHandling:
         user = SecurityUtils.extract_user_from_token(payload)
         
         assert user is None
+    
+    def test_unknown_signing_key_is_invalid_token(self):
+        """Test an RS256 token with an unknown kid fails as an invalid token."""
+        import base64
+        import json
+        import jwt
+        from jwt import PyJWKClientError
+        from apps.core.security import decode_supabase_jwt
+        
+        segments = [{"alg": "RS256", "kid": "bogus", "typ": "JWT"}, {"sub": "user-1"}]
+        token = ".".join(
+            base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode() for part in segments
+        ) + ".c2ln"
+        
+        with patch('apps.core.security._jwks_client') as mock_jwks:
+            mock_jwks.get_signing_key_from_jwt.side_effect = PyJWKClientError("Unable to find a signing key")
+            with pytest.raises(jwt.InvalidTokenError):
+                decode_supabase_jwt(token)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,16 @@
 """Tests for upload endpoints"""
+import time
 import pytest
 from fastapi.testclient import TestClient
 from unittest.mock import patch
+from urllib.parse import parse_qs, quote, urlsplit
 
+from botocore.auth import S3SigV4QueryAuth
+from botocore.awsrequest import AWSRequest
+from botocore.credentials import Credentials
+
+from apps.api.services.uploads import UploadService, _presign_put_url
+from apps.core.settings import settings
 from apps.db.models.user import User
 
 
@@ -100,4 +108,41 @@ class TestUploads:
             headers=auth_headers
         )
         
-        assert response.status_code == 422
\ No newline at end of file
+        assert response.status_code == 422
+
+
+class TestPresignPutUrl:
+    """Test the local SigV4 presigner against botocore's signer"""
+
+    @pytest.mark.parametrize("file_key,content_type", [
+        ("uploads/abc.png", "image/png"),
+        ("uploads/a b+c~d=e.jpg", "image/jpeg"),
+        ("uploads/x.PNG", "image/png;  charset=x"),
+    ])
+    def test_matches_botocore(self, file_key, content_type):
+        """Test the URL is identical to botocore's for the same inputs and time"""
+        request = AWSRequest(
+            method="PUT",
+            url=f"https://my-bucket.s3.eu-central-1.amazonaws.com/{quote(file_key, safe='/~')}",
+            headers={"Content-Type": content_type}
+        )
+        S3SigV4QueryAuth(Credentials("AKIDEXAMPLE", "secret"), "s3", "eu-central-1", expires=3600).add_auth(request)
+        signed_at = time.strptime(parse_qs(urlsplit(request.url).query)["X-Amz-Date"][0], "%Y%m%dT%H%M%SZ")
+
+        with patch.object(settings, "s3_bucket", "my-bucket"), \
+             patch.object(settings, "s3_region", "eu-central-1"), \
+             patch.object(settings, "s3_key", "AKIDEXAMPLE"), \
+             patch.object(settings, "s3_secret", "secret"), \
+             patch("apps.api.services.uploads.time.gmtime", return_value=signed_at):
+            url = _presign_put_url(file_key, content_type, 3600)
+
+        assert url == request.url
+
+    def test_upload_id_names_file_key(self):
+        """Test the returned upload id is the one used in the object key"""
+        with patch.object(settings, "s3_bucket", "my-bucket"), \
+             patch.object(settings, "s3_key", "AKIDEXAMPLE"), \
+             patch.object(settings, "s3_secret", "secret"):
+            result = UploadService().generate_presigned_url("photo.png", "image/png", 1024)
+
+        assert result["file_key"] == f"uploads/{result['upload_id']}.png"
@@ -0,0 +1,118 @@
+"""
+Tests for Superwall webhook helpers.
+
+Imports only the webhooks router, so these run without building the full app.
+"""
+
+import asyncio
+import hashlib
+import hmac
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
+
+import orjson
+from fastapi import BackgroundTasks, Response
+
+from apps.api.routers import webhooks
+from apps.api.routers.webhooks import verify_superwall_signature
+
+
+class TestSignatureVerification:
+    """Test Superwall signature verification helper."""
+    
+    def sign(self, payload: bytes, secret: str = "secret") -> str:
+        """Build a prefixed hex signature for payload."""
+        return "sha256=" + hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).hexdigest()
+    
+    def test_valid_signature(self):
+        """Test matching signature is accepted."""
+        assert verify_superwall_signature(b'{"a":1}', self.sign(b'{"a":1}'), "secret")
+    
+    def test_tampered_payload(self):
+        """Test signature over a different payload is rejected."""
+        assert not verify_superwall_signature(b'{"a":2}', self.sign(b'{"a":1}'), "secret")
+    
+    def test_malformed_hex_signature(self):
+        """Test non-hex signature is rejected without raising."""
+        assert not verify_superwall_signature(b'{"a":1}', "sha256=not-hex", "secret")
+
+
+class TestDeferredEventProcessing:
+    """Test non-start events are accepted with 202 and applied in the background."""
+    
+    def call_webhook(self, event_data, service_cli):
+        """Invoke the webhook handler with a pre-verified signature."""
+        request = Mock()
+        request.body = AsyncMock(return_value=orjson.dumps(event_data))
+        request.state = SimpleNamespace(superwall_signature_ok=True)
+        response = Response()
+        background_tasks = BackgroundTasks()
+        
+        with patch.object(webhooks, "service_client", return_value=service_cli):
+            body = asyncio.run(webhooks.superwall_webhook(
+                request, response, background_tasks, x_superwall_signature="sha256=00"
+            ))
+        return body, response, background_tasks
+    
+    def test_subscription_end_accepted(self):
+        """Test a new subscription_end is recorded pending and answered with 202."""
+        service_cli = MagicMock()
+        service_cli.rpc.return_value.execute.return_value = Mock(data={"user_exists": True})
+        service_cli.table.return_value.upsert.return_value.execute.return_value = Mock(data=[{"id": "sub-1"}])
+        event = {"event": "subscription_end", "event_id": "evt-1", "user_id": "user-1", "product_id": "pro_monthly"}
+        
+        body, response, background_tasks = self.call_webhook(event, service_cli)
+        
+        assert response.status_code == 202
+        assert body["status"] == "accepted"
+        assert body["subscription_id"] == "sub-1"
+        assert len(background_tasks.tasks) == 1
+        recorded = service_cli.table.return_value.upsert.call_args.args[0]
+        assert recorded["processing_status"] == "pending"
+    
+    def test_duplicate_event_not_requeued(self):
+        """Test an already processed event is answered without scheduling work."""
+        service_cli = MagicMock()
+        service_cli.rpc.return_value.execute.return_value = Mock(data={"existing_sub_id": "sub-1", "user_exists": True})
+        event = {"event": "subscription_update", "event_id": "evt-1", "user_id": "user-1", "product_id": "pro_monthly"}
+        
+        body, response, background_tasks = self.call_webhook(event, service_cli)
+        
+        assert response.status_code == 200
+        assert body["message"] == "Event already processed"
+        assert background_tasks.tasks == []
+
+
+class TestPendingEventRedrive:
+    """Test re-driving events whose background processing never finished."""
+    
+    def pending_row(self, row_id, event, created_at):
+        """Build a pending subscription row as PostgREST returns it."""
+        payload = {"event": event, "event_id": row_id, "user_id": "user-1", "product_id": "pro_monthly"}
+        return {
+            "id": row_id,
+            "user_id": "user-1",
+            "created_at": created_at,
+            "raw_payload_json": orjson.dumps(payload).decode()
+        }
+    
+    def test_stale_event_superseded(self):
+        """Test a pending event older than the latest applied one is not replayed."""
+        table = MagicMock()
+        table.select.return_value.eq.return_value.lt.return_value.order.return_value.limit.return_value.execute.return_value = Mock(data=[
+            self.pending_row("stale-end", "subscription_end", "2026-10-17T10:00:00"),
+            self.pending_row("fresh-update", "subscription_update", "2026-10-17T12:00:00"),
+        ])
+        table.select.return_value.in_.return_value.eq.return_value.eq.return_value.execute.return_value = Mock(data=[
+            {"user_id": "user-1", "created_at": "2026-10-17T11:00:00.5"},
+        ])
+        service_cli = MagicMock()
+        service_cli.table.return_value = table
+        
+        with patch.object(webhooks, "process_superwall_event", AsyncMock(return_value={"action": "activated"})) as process:
+            processed = asyncio.run(webhooks.redrive_pending_superwall_events(service_cli))
+        
+        assert processed == 1
+        assert [call.args[1]["id"] for call in process.call_args_list] == ["fresh-update"]
+        table.update.assert_called_once_with({"processing_status": "superseded"})
+        table.update.return_value.in_.assert_called_once_with("id", ["stale-end"])